@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_asgi_application()
+
+# solo al servir, no en cada comando de manage.py (ver CUENTAKM_OCR_PRECALENTAR)
+from lecturas.services.openai_km import precalentar_al_servir  # noqa: E402
+
+precalentar_al_servir()
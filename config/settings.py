@@ -4,24 +4,15 @@ from dotenv import load_dotenv
 import dj_database_url
 
 # ---------------------------------------------------------
-# Cargar archivo .env correctamente
+# Cargar archivo .env (una sola vez: el resto del código lee django.conf.settings)
 # ---------------------------------------------------------
 
 BASE_DIR = Path(__file__).resolve().parent.parent  # ==> backend/
 
 ENV_PATH = BASE_DIR / ".env"                       # ==> backend/.env
 
-if ENV_PATH.exists():
-    load_dotenv(ENV_PATH)
-else:
-    print("⚠️  No se encontró el archivo .env en:", ENV_PATH)
-
-print("Cargando .env desde:", ENV_PATH)
-print("EMAIL_HOST_USER en .env:", os.getenv("EMAIL_HOST_USER"))
-print("EMAIL_HOST_PASSWORD en .env:", os.getenv("EMAIL_HOST_PASSWORD"))
-print("OPENAI_API_KEY:", os.getenv("OPENAI_API_KEY"))
-print("OPENAI_API_KEY:", os.getenv("OPENAI_API_KEY"))
-
+# Sin .env (p.ej. en Render) las variables vienen del entorno
+load_dotenv(ENV_PATH)
 
 
 # Quick-start development settings - unsuitable for production
@@ -52,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # el primero: su tiempo total incluye al resto de middlewares
+    "lecturas.middleware.MetricasMiddleware",
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     "whitenoise.middleware.WhiteNoiseMiddleware",
@@ -94,6 +87,16 @@ DATABASES = {
     )
 }
 
+if DATABASES["default"]["ENGINE"] == "django.db.backends.sqlite3":
+    # SQLite no tiene SELECT ... FOR UPDATE: con BEGIN IMMEDIATE cada transacción
+    # toma el bloqueo de escritura al empezar, así que las altas de lecturas se
+    # serializan igual que con el bloqueo de fila en PostgreSQL (transaction_mode
+    # es de Django 5.1: de ahí el mínimo en requirements.txt).
+    DATABASES["default"].setdefault("OPTIONS", {}).update({"transaction_mode": "IMMEDIATE", "timeout": 20})
+    # BD de tests en fichero: el test de concurrencia levanta un servidor con
+    # varios hilos y cada uno necesita su propia conexión (está en .gitignore)
+    DATABASES["default"]["TEST"] = {"NAME": str(BASE_DIR / "test_db.sqlite3")}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -153,7 +156,36 @@ MEDIA_URL = '/media/'
 from pathlib import Path
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Subidas: siempre a fichero temporal (nunca en memoria) y con tamaño máximo
+FILE_UPLOAD_HANDLERS = ["lecturas.uploads.LimiteTamanoUploadHandler"]
+CUENTAKM_UPLOAD_MAX_BYTES = int(os.getenv("CUENTAKM_UPLOAD_MAX_BYTES", str(15 * 1024 * 1024)))  # por foto
+
+# Subida por lotes (POST /api/lecturas/lote/): límite de la petición entera solo en esa vista
+CUENTAKM_UPLOAD_LOTE_MAX_BYTES = int(os.getenv("CUENTAKM_UPLOAD_LOTE_MAX_BYTES", str(250 * 1024 * 1024)))
+CUENTAKM_LOTE_MAX_ITEMS = int(os.getenv("CUENTAKM_LOTE_MAX_ITEMS", "100"))
+CUENTAKM_LOTE_HILOS = int(os.getenv("CUENTAKM_LOTE_HILOS", "8"))  # OCR en paralelo por lote
+DATA_UPLOAD_MAX_NUMBER_FILES = CUENTAKM_LOTE_MAX_ITEMS
+
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Vacío => la URL por defecto del SDK (solo se cambia para un proxy o para `manage.py benchmark_carga`)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+
+# ==================== OCR REMOTO (OpenAI) ====================
+# Perfil de preprocesado de la foto (ver openai_km.PERFILES_PREPROCESADO);
+# MAX_LADO/CALIDAD sobrescriben los del perfil por defecto
+CUENTAKM_OCR_PERFIL = os.getenv("CUENTAKM_OCR_PERFIL", "equilibrado")
+CUENTAKM_OCR_MAX_LADO = os.getenv("CUENTAKM_OCR_MAX_LADO")
+CUENTAKM_OCR_CALIDAD = os.getenv("CUENTAKM_OCR_CALIDAD")
+CUENTAKM_OCR_CONNECT_TIMEOUT = float(os.getenv("CUENTAKM_OCR_CONNECT_TIMEOUT", "5"))
+CUENTAKM_OCR_READ_TIMEOUT = float(os.getenv("CUENTAKM_OCR_READ_TIMEOUT", "30"))
+CUENTAKM_OCR_POOL = int(os.getenv("CUENTAKM_OCR_POOL", "10"))
+# Importar el SDK y crear el cliente al arrancar el servidor (wsgi.py/asgi.py) o el worker
+# de la cola, no en cada comando de manage.py, para que no lo pague la primera lectura:
+#   "hilo" (en segundo plano, no retrasa el arranque) | "arranque" (antes de servir) | "no" (en la primera lectura)
+CUENTAKM_OCR_PRECALENTAR = os.getenv("CUENTAKM_OCR_PRECALENTAR", "hilo")
+
+# Presupuesto de tiempo de imports al arrancar (manage.py comprobar_arranque)
+CUENTAKM_ARRANQUE_PRESUPUESTO_MS = int(os.getenv("CUENTAKM_ARRANQUE_PRESUPUESTO_MS", "800"))
 
 # ==================== EMAIL / BREVO (SMTP) ====================
 
@@ -172,3 +204,103 @@ DEFAULT_FROM_EMAIL = os.getenv(
     "DEFAULT_FROM_EMAIL",
     EMAIL_HOST_USER or "no-reply@tipsitpv.com",
 )
+
+# ==================== VISTAS ASYNC (ASGI) ====================
+# True => /api/lecturas/ y /api/lecturas/estado/ usan las vistas async (cliente de
+# OCR async, ORM async, emails siempre por la outbox). Solo tiene sentido sirviendo
+# config.asgi:application con uvicorn (p.ej. gunicorn -k uvicorn.workers.UvicornWorker)
+# y con `manage.py enviar_emails` en cron.
+CUENTAKM_VISTAS_ASYNC = os.getenv("CUENTAKM_VISTAS_ASYNC", "False") == "True"
+
+# ==================== OCR ASÍNCRONO ====================
+# True => POST /api/lecturas/ responde 202 y el OCR lo hace `manage.py procesar_trabajos_ocr`
+CUENTAKM_OCR_ASYNC = os.getenv("CUENTAKM_OCR_ASYNC", "False") == "True"
+CUENTAKM_OCR_WORKERS = int(os.getenv("CUENTAKM_OCR_WORKERS", "2"))
+# Espera entre intentos de un trabajo cuyo OCR falló (segundos, exponencial: base, 2*base... hasta el máximo)
+CUENTAKM_OCR_COLA_ESPERA_BASE = int(os.getenv("CUENTAKM_OCR_COLA_ESPERA_BASE", "30"))
+CUENTAKM_OCR_COLA_ESPERA_MAX = int(os.getenv("CUENTAKM_OCR_COLA_ESPERA_MAX", "600"))
+
+# ==================== CACHÉ DE OCR ====================
+# "bd" (tabla CacheOCR, compartida entre workers) | "django" (framework de caché) | "" (desactivada)
+CUENTAKM_OCR_CACHE = os.getenv("CUENTAKM_OCR_CACHE", "bd")
+CUENTAKM_OCR_CACHE_ALIAS = os.getenv("CUENTAKM_OCR_CACHE_ALIAS", "default")
+CUENTAKM_OCR_CACHE_TTL = int(os.getenv("CUENTAKM_OCR_CACHE_TTL", str(7 * 24 * 3600)))
+CUENTAKM_OCR_CACHE_MAX = int(os.getenv("CUENTAKM_OCR_CACHE_MAX", "5000"))
+
+# True => los emails a Administración se encolan en EmailOutbox y los manda `manage.py enviar_emails`
+CUENTAKM_EMAIL_OUTBOX = os.getenv("CUENTAKM_EMAIL_OUTBOX", "False") == "True"
+
+# Días que un email en ERROR conserva sus adjuntos para poder reencolarlo desde
+# el admin; pasado el plazo `barrer_media` borra las fotos (0 = sin límite)
+CUENTAKM_OUTBOX_ERROR_RETENCION_DIAS = int(os.getenv("CUENTAKM_OUTBOX_ERROR_RETENCION_DIAS", "14"))
+
+# False => sin email por lectura; solo el resumen semanal (`manage.py enviar_resumen_semanal`)
+CUENTAKM_EMAIL_POR_LECTURA = os.getenv("CUENTAKM_EMAIL_POR_LECTURA", "True") == "True"
+
+# ==================== BACKEND DE OCR ====================
+# "openai" | "local" (7 segmentos, sin red) | "local+openai" (remoto solo si la confianza local es baja) | "fake"
+CUENTAKM_OCR_BACKEND = os.getenv("CUENTAKM_OCR_BACKEND", "openai")
+CUENTAKM_OCR_LOCAL_CONFIANZA = float(os.getenv("CUENTAKM_OCR_LOCAL_CONFIANZA", "0.85"))
+
+# ==================== CACHÉ ====================
+# ETags y payloads de /api/comerciales/ y /api/lecturas/estado/.
+# Con varios workers conviene una caché compartida (p.ej. Redis o
+# "django.core.cache.backends.db.DatabaseCache" + `manage.py createcachetable`):
+# con locmem cada proceso tiene sus propias versiones y solo duran
+# CUENTAKM_HTTP_CACHE_TTL_LOCAL segundos.
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.getenv("CACHE_LOCATION", "cuentakm"),
+    }
+}
+CUENTAKM_HTTP_CACHE_ALIAS = os.getenv("CUENTAKM_HTTP_CACHE_ALIAS", "default")
+CUENTAKM_HTTP_CACHE_TTL = int(os.getenv("CUENTAKM_HTTP_CACHE_TTL", "3600"))
+# Con caché local del proceso (locmem): segundos que dura cada versión, es decir,
+# lo que otro worker puede tardar en ver un cambio. Con caché compartida no se usa.
+CUENTAKM_HTTP_CACHE_TTL_LOCAL = int(os.getenv("CUENTAKM_HTTP_CACHE_TTL_LOCAL", "10"))
+
+# ==================== IDEMPOTENCIA ====================
+# Cabecera Idempotency-Key en POST /api/lecturas/: cuánto se guarda la respuesta
+# y el Retry-After del 409 a un reintento con la petición original aún en curso
+CUENTAKM_IDEMPOTENCIA_TTL = int(os.getenv("CUENTAKM_IDEMPOTENCIA_TTL", str(24 * 3600)))
+CUENTAKM_IDEMPOTENCIA_RETRY_AFTER = int(os.getenv("CUENTAKM_IDEMPOTENCIA_RETRY_AFTER", "5"))
+
+# ==================== PROTECCIÓN DE LA API DE VISIÓN ====================
+# Límite de ritmo compartido por todos los procesos (0 = sin límite) y ráfaga máxima
+CUENTAKM_OCR_MAX_POR_MINUTO = float(os.getenv("CUENTAKM_OCR_MAX_POR_MINUTO", "300"))
+CUENTAKM_OCR_RAFAGA = int(os.getenv("CUENTAKM_OCR_RAFAGA", "20"))
+CUENTAKM_OCR_ESPERA_MAX = float(os.getenv("CUENTAKM_OCR_ESPERA_MAX", "10"))  # s esperando ficha
+# Reintentos de 429/5xx/errores de conexión con espera exponencial y jitter (los timeouts de lectura no se reintentan)
+CUENTAKM_OCR_REINTENTOS = int(os.getenv("CUENTAKM_OCR_REINTENTOS", "2"))
+CUENTAKM_OCR_BACKOFF_BASE = float(os.getenv("CUENTAKM_OCR_BACKOFF_BASE", "0.5"))
+CUENTAKM_OCR_BACKOFF_MAX = float(os.getenv("CUENTAKM_OCR_BACKOFF_MAX", "8"))
+# Cortacircuitos: tras N fallos seguidos, sin llamar durante PAUSA segundos
+CUENTAKM_OCR_CIRCUITO_FALLOS = int(os.getenv("CUENTAKM_OCR_CIRCUITO_FALLOS", "5"))
+CUENTAKM_OCR_CIRCUITO_PAUSA = int(os.getenv("CUENTAKM_OCR_CIRCUITO_PAUSA", "60"))
+# True => con el OCR caído la lectura se encola (202) en vez de descartarse (503)
+CUENTAKM_OCR_ENCOLAR_SI_NO_DISPONIBLE = os.getenv("CUENTAKM_OCR_ENCOLAR_SI_NO_DISPONIBLE", "True") == "True"
+
+# ==================== MINIATURAS ====================
+# Se generan una vez por lectura tras el OCR; las adjuntan los emails y las muestra el admin
+CUENTAKM_MINIATURA_LADO = int(os.getenv("CUENTAKM_MINIATURA_LADO", "480"))  # px, lado mayor
+CUENTAKM_MINIATURA_CALIDAD = int(os.getenv("CUENTAKM_MINIATURA_CALIDAD", "70"))
+
+# ==================== LIMPIEZA DE MEDIA ====================
+# True => las peticiones solo desvinculan las fotos; los ficheros los borra
+# `manage.py barrer_media` (cron) en bloque, fuera del camino de la petición.
+# Activarlo SOLO con ese cron programado: sin él las fotos se quedan en disco
+CUENTAKM_BORRADO_DIFERIDO = os.getenv("CUENTAKM_BORRADO_DIFERIDO", "False") == "True"
+# Días que se guardan las fotos de semanas que no se cierran (0 = sin límite)
+CUENTAKM_MEDIA_RETENCION_DIAS = int(os.getenv("CUENTAKM_MEDIA_RETENCION_DIAS", "30"))
+# Días que se guardan las miniaturas de semanas cerradas (0 = sin límite)
+CUENTAKM_MINIATURA_RETENCION_DIAS = int(os.getenv("CUENTAKM_MINIATURA_RETENCION_DIAS", "180"))
+# Minutos de gracia antes de borrar un fichero sin lectura (subidas en curso)
+CUENTAKM_MEDIA_GRACIA_MINUTOS = int(os.getenv("CUENTAKM_MEDIA_GRACIA_MINUTOS", "60"))
+
+# ==================== MÉTRICAS ====================
+# Cabecera Server-Timing con el tiempo de cada etapa (foto, OCR, emails, borrado, BD)
+CUENTAKM_SERVER_TIMING = os.getenv("CUENTAKM_SERVER_TIMING", "True") == "True"
+# Token para /metrics ("Authorization: Bearer <token>"). Vacío => /metrics solo
+# responde con DEBUG=True; en producción da 404 hasta que se configure
+CUENTAKM_METRICAS_TOKEN = os.getenv("CUENTAKM_METRICAS_TOKEN", "")
@@ -1,31 +1,115 @@
+import gzip
+import hashlib
+import threading
+
 from django.contrib import admin
 from django.urls import path, include
 from django.http import HttpResponse, HttpResponseNotFound
 from django.conf import settings
 from django.conf.urls.static import static
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_header_parameters
 from pathlib import Path
 
+from lecturas.views import MetricasView
+
+try:
+    import brotli
+except ImportError:  # opcional: sin él solo se sirve gzip
+    brotli = None
+
+
+class _IndexSPA:
+    """
+    index.html en memoria, ya comprimido (gzip y, si está instalado, brotli)
+    y con su ETag. Se lee una vez; en DEBUG se recarga si cambia el mtime
+    (el build de Vite lo reescribe).
+    """
+
+    def __init__(self, ruta: Path):
+        stat = ruta.stat()
+        contenido = ruta.read_bytes()
+        self.mtime = stat.st_mtime
+        self.mtime_http = int(stat.st_mtime)  # If-Modified-Since tiene resolución de segundos
+        self.etag = f'W/"{hashlib.sha256(contenido).hexdigest()[:32]}"'
+        self.last_modified = http_date(self.mtime_http)
+        self.variantes = {"identity": contenido, "gzip": gzip.compress(contenido, 9, mtime=0)}
+        if brotli is not None:
+            self.variantes["br"] = brotli.compress(contenido)
+
+    def variante(self, accept_encoding: str):
+        aceptadas = set()
+        for parte in accept_encoding.split(","):
+            codificacion, params = parse_header_parameters(parte)
+            try:
+                calidad = float(params.get("q", 1))
+            except ValueError:
+                calidad = 0
+            if codificacion and calidad > 0:
+                aceptadas.add(codificacion.lower())
+        for codificacion in ("br", "gzip"):
+            if codificacion in aceptadas and codificacion in self.variantes:
+                return codificacion, self.variantes[codificacion]
+        return None, self.variantes["identity"]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _ruta_index() -> Path:
+    if settings.DEBUG:
+        return Path(settings.BASE_DIR) / "static" / "dist" / "index.html"
+    return Path(settings.STATIC_ROOT) / "dist" / "index.html"
+
+
+def _obtener_index():
+    global _index
+    index = _index
+    if index is not None and not settings.DEBUG:
+        return index
+    ruta = _ruta_index()
+    try:
+        if index is not None and ruta.stat().st_mtime == index.mtime:
+            return index
+        with _index_lock:
+            _index = _IndexSPA(ruta)
+    except FileNotFoundError:
+        return None
+    return _index
+
 
 def spa_index(request):
     """
     Sirve el index.html del frontend (Vue SPA)
     - En DEBUG: desde backend/static/dist/index.html
     - En producción: desde STATIC_ROOT/dist/index.html
+    Los assets con hash los sirve WhiteNoise; el index se revalida siempre
+    (no-cache) para que un deploy nuevo llegue en la siguiente apertura, pero
+    sin cambios la respuesta es un 304.
     """
-    if settings.DEBUG:
-        index_path = Path(settings.BASE_DIR) / "static" / "dist" / "index.html"
-    else:
-        index_path = Path(settings.STATIC_ROOT) / "dist" / "index.html"
-
-    if not index_path.exists():
+    index = _obtener_index()
+    if index is None:
         return HttpResponseNotFound("index.html no encontrado")
 
-    return HttpResponse(index_path.read_text(encoding="utf-8"))
+    respuesta = get_conditional_response(request, etag=index.etag, last_modified=index.mtime_http)
+    if respuesta is None:
+        codificacion, contenido = index.variante(request.headers.get("Accept-Encoding", ""))
+        respuesta = HttpResponse(contenido, content_type="text/html; charset=utf-8")
+        if codificacion:
+            respuesta["Content-Encoding"] = codificacion
+        respuesta["Content-Length"] = str(len(contenido))
+    respuesta["ETag"] = index.etag
+    respuesta["Last-Modified"] = index.last_modified
+    respuesta["Cache-Control"] = "no-cache"
+    patch_vary_headers(respuesta, ("Accept-Encoding",))
+    return respuesta
 
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/", include("lecturas.urls")),
+    path("metrics", MetricasView.as_view(), name="metricas"),
     path("", spa_index),
 ]
 
@@ -1,5 +1,27 @@
 from django.contrib import admin
-from .models import Comercial, LecturaCuentaKM
+from django.utils.html import format_html
+
+from .models import (
+    ClaveIdempotencia,
+    Comercial,
+    EmailOutbox,
+    EstadoServicioExterno,
+    LecturaCuentaKM,
+    PuntoControlReproceso,
+    ResumenSemanal,
+    RevisionLectura,
+    TrabajoOCR,
+)
+from .services import outbox
+from .services.exportacion import (
+    CABECERA_LECTURAS,
+    CABECERA_SEMANAL,
+    filas_lecturas,
+    filas_semanales,
+    respuesta_csv,
+)
+from .services.miniaturas import foto_para_adjuntar
+from .services.reproceso import aplicar_revision
 
 
 @admin.register(Comercial)
@@ -10,6 +32,107 @@ class ComercialAdmin(admin.ModelAdmin):
 
 @admin.register(LecturaCuentaKM)
 class LecturaCuentaKMAdmin(admin.ModelAdmin):
-    list_display = ("comercial", "tipo_lectura", "semana", "anio", "kilometros", "fin_fuera_de_plazo", "inicio_no_cuadra", "created_at")
+    list_display = ("vista_previa", "comercial", "tipo_lectura", "semana", "anio", "kilometros", "fin_fuera_de_plazo", "inicio_no_cuadra", "created_at")
+    list_display_links = ("vista_previa", "comercial")
     list_filter = ("tipo_lectura", "anio", "semana", "fin_fuera_de_plazo", "inicio_no_cuadra")
     search_fields = ("comercial__nombre",)
+    list_select_related = ("comercial",)
+    readonly_fields = ("vista_previa_grande",)
+    actions = ("exportar_lecturas_csv", "exportar_totales_semanales_csv")
+
+    @admin.display(description="Foto")
+    def vista_previa(self, obj):
+        # solo la miniatura: la original pesa MB y haría lenta la lista
+        if not obj.miniatura:
+            return "-"
+        return format_html(
+            '<img src="{}" alt="" loading="lazy" style="max-height:60px;max-width:90px">', obj.miniatura.url
+        )
+
+    @admin.display(description="Vista previa")
+    def vista_previa_grande(self, obj):
+        foto = foto_para_adjuntar(obj)
+        if not foto:
+            return "-"
+        return format_html(
+            '<a href="{}" target="_blank"><img src="{}" alt="" style="max-width:480px"></a>',
+            obj.imagen.url if obj.imagen else foto.url,
+            foto.url,
+        )
+
+    @admin.action(description="Exportar lecturas seleccionadas (CSV)")
+    def exportar_lecturas_csv(self, request, queryset):
+        return respuesta_csv("lecturas.csv", CABECERA_LECTURAS, filas_lecturas(queryset))
+
+    @admin.action(description="Exportar km semanales de las lecturas seleccionadas (CSV)")
+    def exportar_totales_semanales_csv(self, request, queryset):
+        return respuesta_csv("km_semanales.csv", CABECERA_SEMANAL, filas_semanales(base=queryset))
+
+
+@admin.register(TrabajoOCR)
+class TrabajoOCRAdmin(admin.ModelAdmin):
+    list_display = ("id", "lectura", "estado", "intentos", "http_status", "created_at", "updated_at")
+    list_filter = ("estado",)
+    raw_id_fields = ("lectura",)
+    # el job_id que da la API a quien sube la foto
+    search_fields = ("clave",)
+
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ("asunto", "estado", "intentos", "proximo_intento", "created_at", "enviado_at")
+    list_filter = ("estado",)
+    search_fields = ("asunto",)
+    actions = ("reencolar",)
+
+    @admin.action(description="Reencolar los emails no enviados")
+    def reencolar(self, request, queryset):
+        n = outbox.reencolar(queryset)
+        self.message_user(request, f"{n} email(s) reencolado(s)")
+
+
+@admin.register(ResumenSemanal)
+class ResumenSemanalAdmin(admin.ModelAdmin):
+    list_display = ("comercial", "semana", "anio", "km_inicio", "km_fin", "kms", "fin_fuera_de_plazo", "inicio_no_cuadra", "cerrada_at")
+    list_filter = ("anio", "semana", "fin_fuera_de_plazo", "inicio_no_cuadra")
+    search_fields = ("comercial__nombre",)
+    list_select_related = ("comercial",)
+
+
+@admin.register(ClaveIdempotencia)
+class ClaveIdempotenciaAdmin(admin.ModelAdmin):
+    list_display = ("clave", "estado", "http_status", "created_at", "expira_en")
+    list_filter = ("estado",)
+    search_fields = ("clave",)
+
+
+@admin.register(RevisionLectura)
+class RevisionLecturaAdmin(admin.ModelAdmin):
+    list_display = ("lectura", "km_actual", "km_nuevo", "confianza", "ejecucion", "estado", "created_at")
+    list_filter = ("estado", "ejecucion")
+    search_fields = ("lectura__comercial__nombre",)
+    list_select_related = ("lectura__comercial",)
+    raw_id_fields = ("lectura",)
+    actions = ("aplicar", "descartar")
+
+    @admin.action(description="Aplicar el km nuevo a la lectura")
+    def aplicar(self, request, queryset):
+        pendientes = queryset.filter(estado=RevisionLectura.PENDIENTE).select_related("lectura")
+        for revision in pendientes:
+            aplicar_revision(revision)
+        self.message_user(request, f"{len(pendientes)} revisión(es) aplicada(s)")
+
+    @admin.action(description="Descartar (mantener el km actual)")
+    def descartar(self, request, queryset):
+        n = queryset.filter(estado=RevisionLectura.PENDIENTE).update(estado=RevisionLectura.DESCARTADA)
+        self.message_user(request, f"{n} revisión(es) descartada(s)")
+
+
+@admin.register(PuntoControlReproceso)
+class PuntoControlReprocesoAdmin(admin.ModelAdmin):
+    list_display = ("nombre", "ultimo_id", "procesadas", "diferencias", "errores", "updated_at")
+
+
+@admin.register(EstadoServicioExterno)
+class EstadoServicioExternoAdmin(admin.ModelAdmin):
+    list_display = ("nombre", "fichas", "fallos_seguidos", "abierto_hasta", "updated_at")
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class LecturasConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'lecturas'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        # el cliente OCR se precalienta en config/wsgi.py y asgi.py, no aquí:
+        # ready() también corre en cada comando de manage.py (migrate, cron...)
@@ -0,0 +1,193 @@
+import io
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image, ImageDraw
+
+from lecturas.services.ocr_local import SEGMENTOS_POR_DIGITO
+
+
+# ============================================================
+# Sustitutos locales para medir sin red (manage.py benchmark_carga)
+# ============================================================
+# Nada de esto se usa al servir peticiones: es el banco de pruebas para
+# medir latencia y throughput de la API sin pagar llamadas al modelo ni
+# mandar emails de verdad. Vive junto al comando (el "_" hace que Django no
+# lo tome por un comando) y también lo usan los tests.
+
+
+# ============================================================
+# Fotos sintéticas de cuentakilómetros
+# ============================================================
+def foto_cuentakm(km: int, tamano=(1600, 1200), escala: int = 3, ruido: bool = True, calidad: int = 90) -> bytes:
+    """
+    JPEG con `km` dibujado como un display de 7 segmentos (verde sobre
+    negro, como los cuadros digitales), legible también por el OCR local.
+    Con `ruido` la foto pesa y se comprime como una de verdad y no como
+    un fondo liso.
+    """
+    img = Image.new("RGB", tamano, "black")
+    if ruido:
+        # grano oscuro alrededor de 32: no tapa los dígitos
+        img.paste(Image.effect_noise(tamano, 24).point(lambda v: v // 4).convert("RGB"))
+    dibujo = ImageDraw.Draw(img)
+
+    ancho, alto, grosor = 20 * escala, 36 * escala, 5 * escala
+    medio = alto // 2
+    tinta = (120, 255, 120)
+    x = (tamano[0] - len(str(km)) * (ancho + 4 * escala)) // 2
+    y = (tamano[1] - alto) // 2
+
+    for cifra in str(km):
+        segmentos = SEGMENTOS_POR_DIGITO[int(cifra)]
+        zonas = {
+            "a": (grosor, 0, ancho - grosor, grosor),
+            "g": (grosor, medio - grosor // 2, ancho - grosor, medio + grosor // 2),
+            "d": (grosor, alto - grosor, ancho - grosor, alto),
+            "f": (0, grosor, grosor, medio - 2),
+            "b": (ancho - grosor, grosor, ancho, medio - 2),
+            "e": (0, medio + 2, grosor, alto - grosor),
+            "c": (ancho - grosor, medio + 2, ancho, alto - grosor),
+        }
+        for segmento in segmentos:
+            x0, y0, x1, y1 = zonas[segmento]
+            dibujo.rectangle([x + x0, y + y0, x + x1, y + y1], fill=tinta)
+        x += ancho + 4 * escala
+
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=calidad)
+    return out.getvalue()
+
+
+# ============================================================
+# Servidor falso de la API de visión
+# ============================================================
+class ServidorVisionFalso:
+    """
+    Servidor HTTP local que contesta como la API de OpenAI a las dos rutas
+    que usa openai_km (/chat/completions del SDK legacy y /responses del
+    nuevo). Apuntar OPENAI_BASE_URL a `url` (y reiniciar el cliente OCR).
+
+    - latencia / jitter: segundos que tarda cada respuesta (uniforme en
+      latencia ± jitter).
+    - tasa_error: fracción de peticiones que responden 500 o 429, para
+      ejercitar reintentos y cortacircuitos.
+    - respuestas: plantillas del texto del modelo, en rotación; "{km}" se
+      sustituye por un contador creciente (p.ej. "Km: {km}" para probar la
+      normalización). Creciente para que un FIN nunca sea menor que su INICIO.
+
+    Uso: `with ServidorVisionFalso(latencia=0.3) as servidor: ...`
+    """
+
+    def __init__(self, latencia=0.3, jitter=0.0, tasa_error=0.0, respuestas=None, km_inicial=100000, semilla=None):
+        self.latencia = latencia
+        self.jitter = jitter
+        self.tasa_error = tasa_error
+        self.respuestas = itertools.cycle(respuestas or ["{km}"])
+        self._kms = itertools.count(km_inicial, 137)
+        self._azar = random.Random(semilla)
+        self._lock = threading.Lock()
+        self.peticiones = 0
+        self.errores = 0
+        self._httpd = None
+        self._hilo = None
+
+    @property
+    def url(self) -> str:
+        host, puerto = self._httpd.server_address[:2]
+        return f"http://{host}:{puerto}/v1"
+
+    def arrancar(self):
+        servidor = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            # keep-alive, como la API real: el pool del cliente reutiliza conexiones
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                codigo, cuerpo = servidor._responder(self.path)
+                datos = json.dumps(cuerpo).encode("utf-8")
+                self.send_response(codigo)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(datos)))
+                self.end_headers()
+                self.wfile.write(datos)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Manejador)
+        self._httpd.daemon_threads = True
+        self._hilo = threading.Thread(target=self._httpd.serve_forever, name="vision-falsa", daemon=True)
+        self._hilo.start()
+        return self
+
+    def parar(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        return self.arrancar()
+
+    def __exit__(self, *exc):
+        self.parar()
+
+    def _responder(self, ruta: str):
+        with self._lock:
+            self.peticiones += 1
+            espera = max(0.0, self.latencia + self._azar.uniform(-self.jitter, self.jitter))
+            fallo = self._azar.random() < self.tasa_error
+            if fallo:
+                self.errores += 1
+            else:
+                texto = next(self.respuestas).format(km=next(self._kms))
+        time.sleep(espera)
+
+        if fallo:
+            codigo = self._azar.choice([429, 500])
+            return codigo, {"error": {"message": "error simulado", "type": "server_error", "code": None}}
+        if ruta.rstrip("/").endswith("/responses"):
+            return 200, _respuesta_responses(texto)
+        return 200, _respuesta_chat(texto)
+
+
+def _respuesta_chat(texto: str) -> dict:
+    return {
+        "id": "chatcmpl-falso",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "falso",
+        "choices": [
+            {"index": 0, "message": {"role": "assistant", "content": texto}, "finish_reason": "stop"},
+        ],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+def _respuesta_responses(texto: str) -> dict:
+    return {
+        "id": "resp_falso",
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": "falso",
+        "status": "completed",
+        "output": [
+            {
+                "id": "msg_falso",
+                "type": "message",
+                "role": "assistant",
+                "status": "completed",
+                "content": [{"type": "output_text", "text": texto, "annotations": []}],
+            }
+        ],
+        "parallel_tool_calls": False,
+        "tool_choice": "auto",
+        "tools": [],
+    }
@@ -0,0 +1,72 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from lecturas.services.limpieza_media import (
+    TAMANO_LOTE,
+    barrer_huerfanos,
+    caducar_fotos_antiguas,
+    caducar_miniaturas_cerradas,
+)
+from lecturas.services.outbox import liberar_adjuntos_en_error, retencion_error
+
+
+class Command(BaseCommand):
+    help = (
+        "Limpia media/lecturas/: desvincula las fotos que superan la retención (semanas "
+        "que nunca se cerraron, miniaturas de semanas cerradas y adjuntos de emails en error) "
+        "y borra los ficheros que ya no referencia ninguna lectura (borrado diferido, "
+        "peticiones que fallaron a medias...). Pensado para cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--retencion-dias",
+            type=int,
+            default=getattr(settings, "CUENTAKM_MEDIA_RETENCION_DIAS", 30),
+            help="Días que se conservan las fotos de semanas abiertas (0 = sin límite).",
+        )
+        parser.add_argument(
+            "--retencion-miniaturas-dias",
+            type=int,
+            default=getattr(settings, "CUENTAKM_MINIATURA_RETENCION_DIAS", 180),
+            help="Días que se conservan las miniaturas de semanas cerradas (0 = sin límite).",
+        )
+        parser.add_argument(
+            "--gracia-minutos",
+            type=int,
+            default=getattr(settings, "CUENTAKM_MEDIA_GRACIA_MINUTOS", 60),
+            help="No se borran ficheros modificados hace menos de estos minutos.",
+        )
+        parser.add_argument("--lote", type=int, default=TAMANO_LOTE, help="Nombres comprobados por consulta.")
+        parser.add_argument(
+            "--simular",
+            action="store_true",
+            help="Solo informa de lo que borraría (no caduca fotos ni borra ficheros).",
+        )
+        parser.add_argument("--sin-retencion", action="store_true", help="Solo barrer huérfanos.")
+
+    def handle(self, *args, **options):
+        if not (options["simular"] or options["sin_retencion"]):
+            dias = retencion_error()
+            liberados = liberar_adjuntos_en_error(dias)
+            if liberados:
+                self.stdout.write(f"Borradas las fotos de {liberados} email(s) en error de más de {dias} día(s)")
+            caducadas = caducar_fotos_antiguas(options["retencion_dias"])
+            if caducadas:
+                self.stdout.write(f"Caducadas {caducadas} foto(s) de más de {options['retencion_dias']} día(s)")
+            dias = options["retencion_miniaturas_dias"]
+            caducadas = caducar_miniaturas_cerradas(dias)
+            if caducadas:
+                self.stdout.write(f"Caducadas {caducadas} miniatura(s) de semanas cerradas de más de {dias} día(s)")
+
+        stats = barrer_huerfanos(
+            gracia_minutos=options["gracia_minutos"],
+            lote=max(1, options["lote"]),
+            simular=options["simular"],
+        )
+        accion = "Se borrarían" if options["simular"] else "Borrados"
+        self.stdout.write(
+            f"Revisados {stats['revisados']} fichero(s), {stats['referenciados']} en uso. "
+            f"{accion} {stats['borrados']} huérfano(s) ({stats['bytes'] / 1024 / 1024:.1f} MB)"
+            + (f", {stats['errores']} error(es)" if stats["errores"] else "")
+        )
@@ -0,0 +1,223 @@
+import json
+import math
+import random
+import resource
+import statistics
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from lecturas.management.commands._simulacion import ServidorVisionFalso, foto_cuentakm
+from lecturas.models import Comercial, LecturaCuentaKM
+from lecturas.services import metricas
+from lecturas.services.openai_km import reiniciar_cliente_ocr
+
+
+URL_LECTURAS = "/api/lecturas/"
+URL_ESTADO = "/api/lecturas/estado/"
+
+
+class Command(BaseCommand):
+    help = (
+        "Prueba de carga de /api/lecturas/ y /api/lecturas/estado/ con sustitutos locales: "
+        "servidor falso de la API de visión (latencia, errores y respuestas configurables), "
+        "email en memoria y fotos sintéticas. Cada usuario virtual es un comercial que "
+        "consulta su estado, sube el INICIO, vuelve a consultar y sube el FIN. "
+        "Usa una BD de pruebas desechable (la real no se toca) y muestra p50/p95/p99, "
+        "peticiones/s, consultas SQL por petición y pico de RSS del proceso."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrencia",
+            type=int,
+            nargs="+",
+            default=[1, 4, 16],
+            help="Usuarios simultáneos; se mide cada nivel por separado.",
+        )
+        parser.add_argument("--ciclos", type=int, default=25, help="Ciclos (4 peticiones) por usuario y nivel.")
+        parser.add_argument("--latencia", type=float, default=0.3, help="Segundos que tarda el OCR falso.")
+        parser.add_argument("--jitter", type=float, default=0.1, help="± segundos sobre la latencia.")
+        parser.add_argument("--tasa-error", type=float, default=0.0, help="Fracción de llamadas OCR con 429/500.")
+        parser.add_argument(
+            "--respuestas",
+            nargs="+",
+            default=None,
+            help="Plantillas del texto del modelo, con {km} (p.ej. 'Km: {km}').",
+        )
+        parser.add_argument("--lado", type=int, default=1600, help="Ancho de las fotos sintéticas (4:3).")
+        parser.add_argument(
+            "--con-limite",
+            action="store_true",
+            help="Mantiene el límite de ritmo de la API de visión (por defecto se quita para medir la app).",
+        )
+        parser.add_argument("--semilla", type=int, default=1)
+        parser.add_argument("--json", dest="salida_json", help="Guarda los resultados en este fichero.")
+        parser.add_argument(
+            "--umbral-p95-ms",
+            type=float,
+            help="Falla si el p95 de alguna ruta en algún nivel supera estos milisegundos.",
+        )
+
+    def handle(self, *args, **options):
+        niveles = options["concurrencia"]
+        if any(n < 1 for n in niveles) or options["ciclos"] < 1:
+            raise CommandError("--concurrencia y --ciclos tienen que ser positivos")
+
+        azar = random.Random(options["semilla"])
+        lado = options["lado"]
+        tamano = (lado, lado * 3 // 4)
+        # unas pocas fotos distintas bastan: sin caché de OCR, no se repiten llamadas
+        self.stdout.write("Generando fotos sintéticas...")
+        fotos = [foto_cuentakm(azar.randint(10000, 999999), tamano=tamano) for _ in range(8)]
+
+        ajustes = {
+            "ALLOWED_HOSTS": [*settings.ALLOWED_HOSTS, "testserver"],  # host del test Client
+            "OPENAI_API_KEY": "benchmark",
+            "CUENTAKM_OCR_BACKEND": "openai",
+            "CUENTAKM_OCR_CACHE": "",
+            "CUENTAKM_OCR_ASYNC": False,
+            "EMAIL_BACKEND": "django.core.mail.backends.locmem.EmailBackend",
+            "MEDIA_ROOT": tempfile.mkdtemp(prefix="benchmark_carga_"),
+        }
+        if not options["con_limite"]:
+            ajustes["CUENTAKM_OCR_MAX_POR_MINUTO"] = 0
+
+        servidor = ServidorVisionFalso(
+            latencia=options["latencia"],
+            jitter=options["jitter"],
+            tasa_error=options["tasa_error"],
+            respuestas=options["respuestas"],
+            semilla=options["semilla"],
+        )
+
+        nombre_bd = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        self.stdout.write(f"BD de pruebas: {nombre_bd}")
+        resultados = []
+        try:
+            with servidor, override_settings(OPENAI_BASE_URL=servidor.url, **ajustes):
+                reiniciar_cliente_ocr()
+                metricas.reiniciar()
+                self.stdout.write(
+                    f"{'usuarios':>8} {'ruta':<8} {'n':>5} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} "
+                    f"{'p99 ms':>8} {'req/s':>7} {'SQL/req':>8} {'RSS MB':>7}"
+                )
+                for usuarios in niveles:
+                    resultados.extend(self._nivel(usuarios, options["ciclos"], fotos))
+                reiniciar_cliente_ocr()
+        finally:
+            connection.creation.destroy_test_db(nombre_bd, verbosity=0)
+
+        self.stdout.write(
+            f"OCR falso: {servidor.peticiones} llamadas, {servidor.errores} con error. "
+            f"Métricas: {json.dumps(metricas.snapshot(), sort_keys=True)}"
+        )
+
+        if options["salida_json"]:
+            with open(options["salida_json"], "w", encoding="utf-8") as f:
+                json.dump(resultados, f, indent=2)
+
+        umbral = options["umbral_p95_ms"]
+        if umbral is not None:
+            excedidos = [r for r in resultados if r["p95_ms"] > umbral]
+            if excedidos:
+                detalle = ", ".join(f"{r['ruta']}@{r['usuarios']}={r['p95_ms']:.0f}ms" for r in excedidos)
+                raise CommandError(f"p95 por encima de {umbral:.0f} ms: {detalle}")
+
+    def _nivel(self, usuarios: int, ciclos: int, fotos: list) -> list:
+        # un comercial por ciclo: cada uno cierra su semana con INICIO + FIN
+        comerciales = Comercial.objects.bulk_create(
+            [Comercial(nombre=f"Benchmark {usuarios}-{i}") for i in range(usuarios * ciclos)]
+        )
+        ids = [c.id for c in comerciales]
+        medidas = defaultdict(list)  # ruta -> [(segundos, consultas, ok)]
+        lock = threading.Lock()
+
+        def usuario(indice):
+            # un 500 cuenta como error en la tabla, no tumba al usuario virtual
+            cliente = Client(raise_request_exception=False)
+            propias = defaultdict(list)
+            try:
+                for ciclo in range(ciclos):
+                    comercial_id = ids[indice * ciclos + ciclo]
+                    for tipo in (LecturaCuentaKM.INICIO, LecturaCuentaKM.FIN):
+                        propias["estado"].append(
+                            self._medir(lambda: cliente.get(URL_ESTADO, {"comercial_id": comercial_id}))
+                        )
+                        foto = fotos[(indice + ciclo) % len(fotos)]
+                        propias["lecturas"].append(
+                            self._medir(lambda: cliente.post(URL_LECTURAS, self._datos_subida(comercial_id, tipo, foto)))
+                        )
+            finally:
+                connections.close_all()
+            with lock:
+                for ruta, valores in propias.items():
+                    medidas[ruta].extend(valores)
+
+        hilos = [threading.Thread(target=usuario, args=(i,)) for i in range(usuarios)]
+        t0 = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        duracion = time.perf_counter() - t0
+
+        rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB en Linux
+        filas = []
+        for ruta in ("estado", "lecturas"):
+            valores = medidas[ruta]
+            tiempos = sorted(1000 * segundos for segundos, _, _ in valores)
+            fila = {
+                "usuarios": usuarios,
+                "ruta": ruta,
+                "peticiones": len(valores),
+                "errores": sum(1 for _, _, ok in valores if not ok),
+                "p50_ms": _percentil(tiempos, 50),
+                "p95_ms": _percentil(tiempos, 95),
+                "p99_ms": _percentil(tiempos, 99),
+                "req_s": len(valores) / duracion,
+                "consultas_por_peticion": statistics.fmean([c for _, c, _ in valores] or [0]),
+                "rss_pico_mb": rss_mb,
+            }
+            filas.append(fila)
+            self.stdout.write(
+                f"{usuarios:>8} {ruta:<8} {fila['peticiones']:>5} {fila['errores']:>4} {fila['p50_ms']:>8.1f} "
+                f"{fila['p95_ms']:>8.1f} {fila['p99_ms']:>8.1f} {fila['req_s']:>7.1f} "
+                f"{fila['consultas_por_peticion']:>8.1f} {rss_mb:>7.0f}"
+            )
+        return filas
+
+    @staticmethod
+    def _medir(peticion):
+        # la conexión es la del hilo: solo cuenta las consultas de esta petición
+        with CaptureQueriesContext(connection) as consultas:
+            t0 = time.perf_counter()
+            respuesta = peticion()
+            segundos = time.perf_counter() - t0
+        return segundos, len(consultas), respuesta.status_code < 400
+
+    @staticmethod
+    def _datos_subida(comercial_id, tipo, foto):
+        return {
+            "comercial_id": comercial_id,
+            "tipo_lectura": tipo,
+            "imagen": SimpleUploadedFile("foto.jpg", foto, "image/jpeg"),
+        }
+
+
+def _percentil(ordenados: list, p: int) -> float:
+    """
+    Percentil por el método del rango más cercano (0.0 si no hay datos).
+    """
+    if not ordenados:
+        return 0.0
+    indice = max(0, min(len(ordenados) - 1, math.ceil(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
@@ -0,0 +1,94 @@
+import base64
+import re
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lecturas.services.openai_km import (
+    PERFILES_PREPROCESADO,
+    _call_openai_vision,
+    _normalizar_km,
+    preprocesar_imagen,
+)
+
+
+EXTENSIONES = {".jpg", ".jpeg", ".png", ".webp", ".heic"}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara los perfiles de preprocesado de imagen: bytes enviados al modelo y, "
+        "con --con-ocr, acierto del OCR. Los km esperados se leen del nombre del fichero "
+        "(el último grupo de dígitos, p.ej. 'golf_235977.jpg')."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("directorio", help="Carpeta con fotos de cuentakilómetros.")
+        parser.add_argument(
+            "--perfiles",
+            nargs="+",
+            default=list(PERFILES_PREPROCESADO),
+            help="Perfiles a comparar (por defecto todos).",
+        )
+        parser.add_argument(
+            "--con-ocr",
+            action="store_true",
+            help="Llama de verdad al modelo para medir el acierto (cuesta dinero).",
+        )
+
+    def handle(self, *args, **options):
+        directorio = Path(options["directorio"])
+        if not directorio.is_dir():
+            raise CommandError(f"No existe el directorio {directorio}")
+
+        fotos = sorted(p for p in directorio.iterdir() if p.suffix.lower() in EXTENSIONES)
+        if not fotos:
+            raise CommandError(f"No hay fotos en {directorio}")
+
+        for nombre in options["perfiles"]:
+            if nombre not in PERFILES_PREPROCESADO:
+                raise CommandError(f"Perfil desconocido: {nombre}")
+
+        self.stdout.write(
+            f"{'perfil':<12} {'fotos':>5} {'bytes orig.':>12} {'bytes env.':>12} "
+            f"{'ratio':>6} {'ms prep.':>9} {'acierto':>8}"
+        )
+
+        for nombre in options["perfiles"]:
+            total_orig = total_env = 0
+            t_prep = 0.0
+            aciertos = evaluadas = 0
+
+            for foto in fotos:
+                original = foto.read_bytes()
+                t0 = time.perf_counter()
+                procesada, mime = preprocesar_imagen(original, nombre)
+                enviados = original if procesada is None else procesada
+                t_prep += time.perf_counter() - t0
+
+                total_orig += len(original)
+                # lo que viaja de verdad es el base64
+                total_env += len(base64.b64encode(enviados))
+
+                esperado = self._km_esperado(foto)
+                if options["con_ocr"] and esperado is not None:
+                    evaluadas += 1
+                    try:
+                        texto = _call_openai_vision(base64.b64encode(enviados).decode("utf-8"), mime)
+                        if _normalizar_km(texto) == esperado:
+                            aciertos += 1
+                    except Exception as e:
+                        self.stderr.write(f"  [{nombre}] {foto.name}: {e}")
+
+            ratio = total_env / total_orig if total_orig else 0
+            acierto = f"{100 * aciertos / evaluadas:.0f}%" if evaluadas else "-"
+            self.stdout.write(
+                f"{nombre:<12} {len(fotos):>5} {total_orig:>12} {total_env:>12} "
+                f"{ratio:>6.2f} {1000 * t_prep / len(fotos):>9.1f} {acierto:>8}"
+            )
+
+    @staticmethod
+    def _km_esperado(foto: Path):
+        grupos = re.findall(r"\d+", foto.stem)
+        return int(grupos[-1]) if grupos else None
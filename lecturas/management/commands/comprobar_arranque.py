@@ -0,0 +1,76 @@
+import os
+import re
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# "import time: self [us] | cumulative | imported package"
+LINEA_IMPORTTIME = re.compile(r"^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|( *)(\S+)")
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide con `python -X importtime` lo que tarda en arrancar la aplicación (settings, "
+        "apps, WSGI y URLconf, lo que paga la primera petición tras despertar la instancia) "
+        "y falla si supera el presupuesto. Muestra los módulos más lentos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--presupuesto-ms",
+            type=int,
+            default=getattr(settings, "CUENTAKM_ARRANQUE_PRESUPUESTO_MS", 800),
+            help="Máximo de milisegundos en imports.",
+        )
+        parser.add_argument("--top", type=int, default=15, help="Módulos más lentos a mostrar.")
+
+    def handle(self, *args, **options):
+        codigo = (
+            "import django; django.setup(); "
+            "from django.core.wsgi import get_wsgi_application; get_wsgi_application(); "
+            f"import {settings.ROOT_URLCONF}"
+        )
+        entorno = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE=os.environ.get("DJANGO_SETTINGS_MODULE", "config.settings"),
+            # el precalentado en hilo no retrasa el arranque: no se cuenta
+            CUENTAKM_OCR_PRECALENTAR="no",
+        )
+
+        t0 = time.perf_counter()
+        proceso = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", codigo],
+            cwd=settings.BASE_DIR,
+            env=entorno,
+            capture_output=True,
+            text=True,
+        )
+        total_proceso_ms = (time.perf_counter() - t0) * 1000
+        if proceso.returncode != 0:
+            raise CommandError(f"La aplicación no arranca:\n{proceso.stderr[-2000:]}")
+
+        total_us = 0
+        modulos = []
+        for linea in proceso.stderr.splitlines():
+            m = LINEA_IMPORTTIME.match(linea)
+            if not m:
+                continue
+            propio, acumulado, sangria, nombre = int(m[1]), int(m[2]), m[3], m[4]
+            if len(sangria) == 1:  # import de primer nivel: su acumulado incluye todo lo demás
+                total_us += acumulado
+            modulos.append((propio, nombre))
+
+        total_ms = total_us / 1000
+        self.stdout.write(f"Imports: {total_ms:.0f} ms ({len(modulos)} módulos) · proceso completo: {total_proceso_ms:.0f} ms")
+        self.stdout.write("Módulos más lentos (tiempo propio):")
+        for propio, nombre in sorted(modulos, reverse=True)[: options["top"]]:
+            self.stdout.write(f"  {propio / 1000:7.1f} ms  {nombre}")
+
+        presupuesto = options["presupuesto_ms"]
+        if total_ms > presupuesto:
+            raise CommandError(f"Arranque por encima del presupuesto: {total_ms:.0f} ms > {presupuesto} ms")
+        self.stdout.write(self.style.SUCCESS(f"Dentro del presupuesto ({presupuesto} ms)"))
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from lecturas.services.outbox import enviar_pendientes
+
+
+class Command(BaseCommand):
+    help = (
+        "Envía los emails pendientes de EmailOutbox reutilizando una sola conexión SMTP "
+        "por lote, con reintentos y espera exponencial. Ejecutar una sola instancia "
+        "(cron o con --bucle)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limite", type=int, default=100, help="Emails por lote.")
+        parser.add_argument("--max-intentos", type=int, default=5, help="Intentos antes de marcar ERROR.")
+        parser.add_argument(
+            "--backoff",
+            type=int,
+            default=60,
+            help="Segundos de espera tras el primer fallo (se duplica en cada intento).",
+        )
+        parser.add_argument("--bucle", action="store_true", help="No terminar: seguir sondeando la outbox.")
+        parser.add_argument("--espera", type=float, default=10.0, help="Segundos entre sondeos con --bucle.")
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                enviados, fallidos = enviar_pendientes(
+                    limite=options["limite"],
+                    max_intentos=options["max_intentos"],
+                    backoff_base=options["backoff"],
+                )
+            except Exception as e:
+                # p.ej. servidor SMTP caído al abrir la conexión: se reintenta en el siguiente sondeo
+                self.stderr.write(f"Error abriendo la conexión SMTP: {e}")
+                enviados, fallidos = 0, 0
+
+            if enviados or fallidos:
+                self.stdout.write(f"Enviados {enviados}, fallidos {fallidos}")
+
+            if not options["bucle"]:
+                break
+            time.sleep(options["espera"])
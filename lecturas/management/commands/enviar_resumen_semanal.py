@@ -0,0 +1,56 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from lecturas.services.emails import enviar_email_resumen_semanal
+from lecturas.services.procesamiento import iso_week_year
+from lecturas.services.resumen_semanal import (
+    borrar_fotos_semanas_cerradas,
+    construir_resumen,
+    hoja_de_contactos,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Envía a Administración UN email con el resumen semanal de todos los comerciales "
+        "(inicio, fin, km y avisos) y una hoja de contactos con las fotos. "
+        "Pensado para programarse el viernes por la tarde (o el lunes con --semana-anterior)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--anio", type=int, help="Año ISO (por defecto, el actual).")
+        parser.add_argument("--semana", type=int, help="Semana ISO (por defecto, la actual).")
+        parser.add_argument(
+            "--semana-anterior",
+            action="store_true",
+            help="Resumir la semana anterior a la actual.",
+        )
+        parser.add_argument("--sin-fotos", action="store_true", help="No adjuntar la hoja de contactos.")
+        parser.add_argument(
+            "--no-borrar-fotos",
+            action="store_true",
+            help="No borrar las fotos de las semanas cerradas tras enviar.",
+        )
+
+    def handle(self, *args, **options):
+        hoy = timezone.localdate()
+        if options["semana_anterior"]:
+            hoy -= timedelta(days=7)
+        semana, anio = iso_week_year(hoy)
+        semana = options["semana"] or semana
+        anio = options["anio"] or anio
+
+        filas = construir_resumen(anio, semana)
+        hoja = None if options["sin_fotos"] else hoja_de_contactos(filas)
+
+        enviar_email_resumen_semanal(anio, semana, filas, hoja)
+        self.stdout.write(
+            f"Resumen semana {semana}/{anio} enviado: {len(filas)} comerciales, "
+            f"hoja de contactos {len(hoja) if hoja else 0} bytes"
+        )
+
+        if not options["no_borrar_fotos"]:
+            borradas = borrar_fotos_semanas_cerradas(filas)
+            self.stdout.write(f"Borradas {borradas} foto(s) de semanas cerradas")
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from lecturas.models import LecturaCuentaKM
+from lecturas.services.miniaturas import generar_miniatura
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera las miniaturas que faltan de las lecturas que aún tienen foto (p.ej. las "
+        "subidas antes de existir las miniaturas). Las nuevas ya la generan al leer los km."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limite", type=int, default=0, help="Máximo de lecturas (0 = todas).")
+
+    def handle(self, *args, **options):
+        qs = (
+            LecturaCuentaKM.objects
+            .filter(imagen__gt="")
+            .filter(Q(miniatura__isnull=True) | Q(miniatura=""))
+            .only("pk", "imagen", "miniatura")
+            .order_by("pk")
+        )
+        if options["limite"]:
+            qs = qs[: options["limite"]]
+
+        generadas = fallidas = 0
+        for lectura in qs.iterator():
+            if generar_miniatura(lectura):
+                lectura.save(update_fields=["miniatura"])
+                generadas += 1
+            else:
+                fallidas += 1
+        self.stdout.write(f"Generadas {generadas} miniatura(s)" + (f", {fallidas} fallida(s)" if fallidas else ""))
@@ -0,0 +1,98 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from lecturas.services.cola_ocr import (
+    ejecutar_trabajo,
+    liberar_trabajos_colgados,
+    reclamar_siguiente_trabajo,
+)
+from lecturas.services.openai_km import precalentar_al_servir
+from lecturas.services.resiliencia import ServicioNoDisponible
+
+
+class Command(BaseCommand):
+    help = (
+        "Worker de la cola de OCR: lee los km de las lecturas subidas en modo asíncrono, "
+        "aplica las reglas de inicio/fin de semana y envía los emails."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrencia",
+            type=int,
+            default=getattr(settings, "CUENTAKM_OCR_WORKERS", 2),
+            help="Número de hilos procesando trabajos en paralelo.",
+        )
+        parser.add_argument(
+            "--espera",
+            type=float,
+            default=2.0,
+            help="Segundos entre sondeos de la cola cuando está vacía.",
+        )
+        parser.add_argument(
+            "--max-intentos",
+            type=int,
+            default=3,
+            help="Reintentos de OCR antes de descartar la lectura.",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=int,
+            default=300,
+            help="Segundos tras los que un trabajo EN_PROCESO se considera colgado y se reencola.",
+        )
+        parser.add_argument(
+            "--una-vez",
+            action="store_true",
+            help="Vacía la cola y termina (útil para cron).",
+        )
+
+    def handle(self, *args, **options):
+        concurrencia = max(1, options["concurrencia"])
+        max_intentos = options["max_intentos"]
+
+        self.stdout.write(f"Worker OCR arrancado con {concurrencia} hilo(s)")
+        # este comando sí hace OCR: el primer trabajo no paga el import del SDK
+        precalentar_al_servir()
+
+        with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+            while True:
+                liberados = liberar_trabajos_colgados(options["timeout"])
+                if liberados:
+                    self.stdout.write(f"Reencolados {liberados} trabajo(s) colgado(s)")
+
+                if concurrencia == 1:
+                    procesados = self._vaciar_cola(max_intentos)
+                else:
+                    procesados = sum(pool.map(self._vaciar_cola_en_hilo, [max_intentos] * concurrencia))
+                if procesados:
+                    self.stdout.write(f"Procesados {procesados} trabajo(s)")
+
+                if options["una_vez"]:
+                    break
+                time.sleep(options["espera"])
+
+    def _vaciar_cola(self, max_intentos):
+        procesados = 0
+        while True:
+            trabajo = reclamar_siguiente_trabajo()
+            if trabajo is None:
+                return procesados
+            try:
+                ejecutar_trabajo(trabajo, max_intentos=max_intentos)
+            except ServicioNoDisponible as e:
+                # proveedor caído: se deja la cola hasta el siguiente sondeo
+                self.stderr.write(f"OCR no disponible, se reintentará más tarde: {e}")
+                return procesados
+            procesados += 1
+
+    def _vaciar_cola_en_hilo(self, max_intentos):
+        try:
+            return self._vaciar_cola(max_intentos)
+        finally:
+            # cada hilo abre su propia conexión; la cerramos al terminar
+            connection.close()
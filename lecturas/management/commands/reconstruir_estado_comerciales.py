@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from lecturas.services.estado import reconstruir_todos
+
+
+class Command(BaseCommand):
+    help = (
+        "Regenera la tabla EstadoComercial (última lectura, último fin, último inicio "
+        "de cada comercial) a partir del historial de lecturas."
+    )
+
+    def handle(self, *args, **options):
+        total = reconstruir_todos()
+        self.stdout.write(f"Estado reconstruido para {total} comercial(es)")
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from lecturas.services.semanas import reconstruir
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula la tabla ResumenSemanal (km por comercial y semana cerrada) desde las "
+        "lecturas. Sin opciones, la regenera entera."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--desde", help="Fecha AAAA-MM-DD: desde su semana ISO.")
+        parser.add_argument("--hasta", help="Fecha AAAA-MM-DD: hasta su semana ISO.")
+        parser.add_argument("--comercial", type=int, help="Solo este comercial (id).")
+
+    def handle(self, *args, **options):
+        desde = self._fecha(options["desde"])
+        hasta = self._fecha(options["hasta"])
+
+        total = reconstruir(desde=desde, hasta=hasta, comercial_id=options["comercial"])
+        self.stdout.write(f"Resumen semanal reconstruido: {total} semana(s) cerrada(s)")
+
+    @staticmethod
+    def _fecha(valor):
+        if not valor:
+            return None
+        fecha = parse_date(valor)
+        if fecha is None:
+            raise CommandError(f"Fecha no válida: {valor} (formato AAAA-MM-DD)")
+        return fecha
@@ -0,0 +1,168 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import F
+from django.utils.dateparse import parse_date
+
+from lecturas.models import LecturaCuentaKM, PuntoControlReproceso
+from lecturas.services.ocr import get_backend_ocr
+from lecturas.services.resiliencia import ServicioNoDisponible
+from lecturas.services.reproceso import (
+    DIFERENTE,
+    LimiteRitmo,
+    reprocesar_lectura,
+    seleccionar_lecturas,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Vuelve a pasar el OCR por las lecturas que aún tienen foto (p.ej. tras cambiar el "
+        "modelo o el prompt) y guarda las diferencias en RevisionLectura para revisarlas en "
+        "el admin; no modifica las lecturas. Se puede interrumpir y relanzar: continúa "
+        "desde el último punto de control de la ejecución (--nombre), que solo vale para "
+        "los mismos filtros."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--desde", help="Fecha de subida AAAA-MM-DD.")
+        parser.add_argument("--hasta", help="Fecha de subida AAAA-MM-DD.")
+        parser.add_argument("--comercial", type=int, help="Solo este comercial (id).")
+        parser.add_argument("--tipo", choices=[LecturaCuentaKM.INICIO, LecturaCuentaKM.FIN])
+        parser.add_argument("--ids", type=int, nargs="+", help="Solo estas lecturas.")
+        parser.add_argument("--backend", help="Backend de OCR (por defecto CUENTAKM_OCR_BACKEND).")
+        parser.add_argument("--perfil", help="Perfil de preprocesado (por defecto CUENTAKM_OCR_PERFIL).")
+        parser.add_argument("--concurrencia", type=int, default=4, help="Llamadas de OCR en paralelo.")
+        parser.add_argument(
+            "--max-por-minuto",
+            type=float,
+            default=60,
+            help="Tope de llamadas de OCR por minuto (0 = sin tope).",
+        )
+        parser.add_argument(
+            "--nombre",
+            help="Nombre de la ejecución (punto de control y revisiones). Por defecto, la versión del backend.",
+        )
+        parser.add_argument("--reiniciar", action="store_true", help="Ignorar el punto de control y empezar de cero.")
+
+    def handle(self, *args, **options):
+        try:
+            self.backend = get_backend_ocr(options["backend"])
+        except ImportError as e:
+            raise CommandError(f"Backend de OCR desconocido: {options['backend']} ({e})")
+        self.perfil = options["perfil"]
+        nombre = (options["nombre"] or self.backend.version(self.perfil))[:100]
+        filtros = {
+            "desde": self._fecha(options["desde"]),
+            "hasta": self._fecha(options["hasta"]),
+            "comercial_id": options["comercial"],
+            "tipo": options["tipo"],
+            "ids": sorted(options["ids"]) if options["ids"] else None,
+        }
+        # tal cual se guardan en el punto de control (JSON)
+        filtros_json = {k: str(v) if k in ("desde", "hasta") else v for k, v in filtros.items() if v}
+
+        punto, _ = PuntoControlReproceso.objects.get_or_create(nombre=nombre, defaults={"filtros": filtros_json})
+        if options["reiniciar"]:
+            PuntoControlReproceso.objects.filter(pk=punto.pk).update(
+                ultimo_id=0, procesadas=0, diferencias=0, errores=0, filtros=filtros_json
+            )
+            punto.refresh_from_db()
+        elif punto.filtros != filtros_json:
+            if punto.ultimo_id:
+                # con otros filtros, continuar tras ultimo_id se saltaría lecturas
+                raise CommandError(
+                    f"La ejecución '{nombre}' se lanzó con otros filtros ({punto.filtros or 'ninguno'}). "
+                    "Usa otro --nombre, o --reiniciar para empezarla de cero con estos."
+                )
+            PuntoControlReproceso.objects.filter(pk=punto.pk).update(filtros=filtros_json)
+
+        qs = seleccionar_lecturas(**filtros, tras_id=punto.ultimo_id)
+        total = qs.count()
+        self.stdout.write(
+            f"Ejecución '{nombre}': {total} lectura(s) pendiente(s)"
+            + (f", continuando tras la #{punto.ultimo_id}" if punto.ultimo_id else "")
+        )
+        if not total:
+            return
+
+        concurrencia = max(1, options["concurrencia"])
+        self.ritmo = LimiteRitmo(options["max_por_minuto"])
+        self.nombre = nombre
+        bloque = concurrencia * 4
+
+        hechas = 0
+        t0 = time.monotonic()
+        ultimo_id = punto.ultimo_id
+        with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+            procesar = pool.map if concurrencia > 1 else self._procesar_todas
+            while True:
+                lecturas = list(qs.filter(id__gt=ultimo_id)[:bloque])
+                if not lecturas:
+                    break
+
+                try:
+                    resultados = list(procesar(self._procesar_en_hilo, lecturas))
+                except ServicioNoDisponible as e:
+                    # sin avanzar el punto de control: el bloque se repite al relanzar
+                    raise CommandError(f"OCR no disponible ({e}). Relanza el comando para continuar.")
+                ultimo_id = lecturas[-1].id
+
+                # el punto de control avanza por bloques completos: al relanzar
+                # no se pierde ni se repite nada salvo, como mucho, un bloque
+                PuntoControlReproceso.objects.filter(pk=punto.pk).update(
+                    ultimo_id=ultimo_id,
+                    procesadas=F("procesadas") + len(resultados),
+                    diferencias=F("diferencias") + resultados.count(DIFERENTE),
+                    errores=F("errores") + resultados.count(None),
+                )
+
+                hechas += len(resultados)
+                self._progreso(hechas, total, t0)
+
+        punto.refresh_from_db()
+        self.stdout.write(
+            f"Terminado: {punto.procesadas} procesada(s), {punto.diferencias} diferencia(s) "
+            f"pendientes de revisión, {punto.errores} error(es)"
+        )
+
+    def _procesar(self, lectura):
+        try:
+            self.ritmo.esperar()
+            return reprocesar_lectura(lectura, self.backend, self.nombre, self.perfil)
+        except ServicioNoDisponible:
+            raise
+        except Exception as e:
+            self.stderr.write(f"  Lectura #{lectura.id}: {e}")
+            return None
+
+    def _procesar_en_hilo(self, lectura):
+        try:
+            return self._procesar(lectura)
+        finally:
+            # cada hilo abre su propia conexión; la cerramos al terminar
+            connection.close()
+
+    def _procesar_todas(self, _, lecturas):
+        # --concurrencia 1: en el hilo principal, con su conexión
+        return [self._procesar(lectura) for lectura in lecturas]
+
+    def _progreso(self, hechas, total, t0):
+        segundos = time.monotonic() - t0
+        ritmo = hechas / segundos if segundos else 0
+        restante = (total - hechas) / ritmo if ritmo else 0
+        self.stdout.write(
+            f"  {hechas}/{total} ({100 * hechas / total:.0f}%) · {ritmo:.1f} lecturas/s · "
+            f"quedan ~{restante:.0f} s"
+        )
+
+    @staticmethod
+    def _fecha(valor):
+        if not valor:
+            return None
+        fecha = parse_date(valor)
+        if fecha is None:
+            raise CommandError(f"Fecha no válida: {valor} (formato AAAA-MM-DD)")
+        return fecha
@@ -0,0 +1,61 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .services import metricas
+
+
+class MetricasMiddleware:
+    """
+    Tiempo total, consultas SQL y código de cada petición, por ruta, para
+    /metrics; y la cabecera Server-Timing con las etapas medidas con
+    metricas.cronometro() (guardar la foto, OCR, emails, borrado...), que se
+    ve en la pestaña Network del navegador.
+
+    Va el primero de MIDDLEWARE para que el total incluya al resto.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        peticion, token = metricas.iniciar_peticion()
+        t0 = time.perf_counter()
+        try:
+            respuesta = self.get_response(request)
+        finally:
+            metricas.terminar_peticion(token)
+        return self._registrar(request, respuesta, peticion, time.perf_counter() - t0)
+
+    async def __acall__(self, request):
+        peticion, token = metricas.iniciar_peticion()
+        t0 = time.perf_counter()
+        try:
+            respuesta = await self.get_response(request)
+        finally:
+            metricas.terminar_peticion(token)
+        return self._registrar(request, respuesta, peticion, time.perf_counter() - t0)
+
+    @staticmethod
+    def _registrar(request, respuesta, peticion, segundos):
+        # nombre de la vista y no la URL: las URLs llevan ids y dispararían las series
+        match = getattr(request, "resolver_match", None)
+        ruta = match.view_name if match else "sin_ruta"
+
+        metricas.observar("peticion_segundos", segundos, {"ruta": ruta})
+        metricas.observar(
+            "consultas_por_peticion", peticion.consultas, {"ruta": ruta}, cubetas=metricas.CUBETAS_CONSULTAS
+        )
+        metricas.incrementar("peticiones", etiquetas={"ruta": ruta, "codigo": respuesta.status_code})
+
+        if getattr(settings, "CUENTAKM_SERVER_TIMING", True):
+            respuesta["Server-Timing"] = metricas.cabecera_server_timing(peticion, segundos)
+        return respuesta
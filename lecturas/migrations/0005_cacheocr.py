@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lecturas', '0004_trabajoocr'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheOCR',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=64, unique=True)),
+                ('kilometros', models.PositiveIntegerField()),
+                ('texto_modelo', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('expira_en', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lecturas', '0006_emailoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstadoComercial',
+            fields=[
+                ('comercial', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='estado', serialize=False, to='lecturas.comercial')),
+                ('ultimo_tipo', models.CharField(blank=True, choices=[('inicio_semana', 'Inicio de semana'), ('fin_semana', 'Fin de semana')], default='', max_length=20)),
+                ('ultimos_km', models.PositiveIntegerField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'estados de comerciales',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='lecturacuentakm',
+            index=models.Index(fields=['comercial', '-created_at'], name='lecturas_le_comerci_dbb43e_idx'),
+        ),
+        migrations.AddField(
+            model_name='estadocomercial',
+            name='ultima_lectura',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='lecturas.lecturacuentakm'),
+        ),
+        migrations.AddField(
+            model_name='estadocomercial',
+            name='ultimo_fin',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='lecturas.lecturacuentakm'),
+        ),
+        migrations.AddField(
+            model_name='estadocomercial',
+            name='ultimo_inicio',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='lecturas.lecturacuentakm'),
+        ),
+    ]
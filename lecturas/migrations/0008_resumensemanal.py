@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lecturas', '0007_estadocomercial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenSemanal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('anio', models.PositiveSmallIntegerField()),
+                ('semana', models.PositiveSmallIntegerField()),
+                ('km_inicio', models.PositiveIntegerField(blank=True, null=True)),
+                ('km_fin', models.PositiveIntegerField(blank=True, null=True)),
+                ('kms', models.IntegerField(blank=True, null=True)),
+                ('fin_fuera_de_plazo', models.BooleanField(default=False)),
+                ('inicio_no_cuadra', models.BooleanField(default=False)),
+                ('cerrada_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('comercial', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumenes_semanales', to='lecturas.comercial')),
+            ],
+            options={
+                'verbose_name_plural': 'resúmenes semanales',
+                'ordering': ['-anio', '-semana', 'comercial__nombre'],
+                'indexes': [models.Index(fields=['anio', 'semana'], name='lecturas_re_anio_a966a1_idx')],
+                'constraints': [models.UniqueConstraint(fields=('comercial', 'anio', 'semana'), name='resumen_semanal_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,101 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:04
+
+import logging
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+logger = logging.getLogger(__name__)
+
+
+def _recalcular_semana(LecturaCuentaKM, ResumenSemanal, comercial_id, anio, semana):
+    # como semanas.reconstruir, con los modelos históricos (ya hay como mucho
+    # una lectura de cada tipo en la semana)
+    lecturas = {
+        l.tipo_lectura: l
+        for l in LecturaCuentaKM.objects.filter(comercial_id=comercial_id, anio=anio, semana=semana)
+    }
+    inicio, fin = lecturas.get("inicio_semana"), lecturas.get("fin_semana")
+    if fin is None:
+        ResumenSemanal.objects.filter(comercial_id=comercial_id, anio=anio, semana=semana).delete()
+        return
+    km_inicio = inicio.kilometros if inicio else None
+    ResumenSemanal.objects.update_or_create(
+        comercial_id=comercial_id,
+        anio=anio,
+        semana=semana,
+        defaults={
+            "km_inicio": km_inicio,
+            "km_fin": fin.kilometros,
+            "kms": fin.kilometros - km_inicio if None not in (fin.kilometros, km_inicio) else None,
+            "fin_fuera_de_plazo": fin.fin_fuera_de_plazo,
+            "inicio_no_cuadra": bool(inicio and inicio.inicio_no_cuadra),
+            "cerrada_at": fin.created_at,
+        },
+    )
+
+
+def resolver_duplicados(apps, schema_editor):
+    """
+    Antes de la restricción podían colarse dos lecturas del mismo tipo para
+    un comercial y semana (subidas simultáneas). Se queda la más antigua con
+    km leídos (o la más antigua, si ninguna los tiene); las demás se borran
+    y se registra en el log cuáles eran. EstadoComercial pasa a apuntar a la
+    que queda y la fila de ResumenSemanal de esas semanas se recalcula.
+    """
+    LecturaCuentaKM = apps.get_model("lecturas", "LecturaCuentaKM")
+    EstadoComercial = apps.get_model("lecturas", "EstadoComercial")
+    ResumenSemanal = apps.get_model("lecturas", "ResumenSemanal")
+    campos = ("comercial_id", "anio", "semana", "tipo_lectura")
+
+    grupos = (
+        LecturaCuentaKM.objects
+        .values(*campos)
+        .annotate(n=Count("id"))
+        .filter(n__gt=1)
+    )
+    semanas = set()
+    for grupo in grupos:
+        lecturas = list(
+            LecturaCuentaKM.objects
+            .filter(**{campo: grupo[campo] for campo in campos})
+            .order_by("created_at", "id")
+        )
+        buena = next((l for l in lecturas if l.kilometros is not None), lecturas[0])
+        sobrantes = [l.pk for l in lecturas if l.pk != buena.pk]
+
+        for campo in ("ultima_lectura", "ultimo_fin", "ultimo_inicio"):
+            EstadoComercial.objects.filter(**{f"{campo}_id__in": sobrantes}).update(**{f"{campo}_id": buena.pk})
+        LecturaCuentaKM.objects.filter(pk__in=sobrantes).delete()
+        semanas.add((grupo["comercial_id"], grupo["anio"], grupo["semana"]))
+        logger.warning(
+            "Lecturas duplicadas (comercial %s, semana %s/%s, %s): se conserva %s, se borran %s",
+            grupo["comercial_id"], grupo["semana"], grupo["anio"], grupo["tipo_lectura"], buena.pk, sobrantes,
+        )
+
+    for comercial_id, anio, semana in semanas:
+        _recalcular_semana(LecturaCuentaKM, ResumenSemanal, comercial_id, anio, semana)
+
+    if schema_editor.connection.vendor == "postgresql":
+        # sin esto el ALTER TABLE de después falla con "pending trigger events"
+        schema_editor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lecturas', '0009_claveidempotencia'),
+    ]
+
+    operations = [
+        migrations.RunPython(resolver_duplicados, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='lecturacuentakm',
+            name='lecturas_le_comerci_493087_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='lecturacuentakm',
+            constraint=models.UniqueConstraint(fields=('comercial', 'anio', 'semana', 'tipo_lectura'), name='lectura_unica_por_semana'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lecturas', '0010_lectura_unica_por_semana'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PuntoControlReproceso',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=100, unique=True)),
+                ('ultimo_id', models.BigIntegerField(default=0)),
+                ('procesadas', models.PositiveIntegerField(default=0)),
+                ('diferencias', models.PositiveIntegerField(default=0)),
+                ('errores', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RevisionLectura',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ejecucion', models.CharField(max_length=100)),
+                ('km_actual', models.PositiveIntegerField(blank=True, null=True)),
+                ('km_nuevo', models.PositiveIntegerField()),
+                ('confianza', models.FloatField(blank=True, null=True)),
+                ('texto_modelo', models.TextField(blank=True, default='')),
+                ('backend', models.CharField(blank=True, default='', max_length=100)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('aplicada', 'Aplicada'), ('descartada', 'Descartada')], default='pendiente', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('lectura', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revisiones', to='lecturas.lecturacuentakm')),
+            ],
+            options={
+                'verbose_name_plural': 'revisiones de lecturas',
+                'ordering': ['-created_at'],
+                'constraints': [models.UniqueConstraint(fields=('lectura', 'ejecucion'), name='revision_unica_por_ejecucion')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lecturas', '0011_reproceso'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstadoServicioExterno',
+            fields=[
+                ('nombre', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('fichas', models.FloatField(default=0)),
+                ('fichas_at', models.DateTimeField(blank=True, null=True)),
+                ('fallos_seguidos', models.PositiveIntegerField(default=0)),
+                ('abierto_hasta', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'estados de servicios externos',
+            },
+        ),
+    ]
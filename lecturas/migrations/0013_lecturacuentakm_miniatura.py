@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lecturas', '0012_estadoservicioexterno'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lecturacuentakm',
+            name='miniatura',
+            field=models.ImageField(blank=True, null=True, upload_to='lecturas/'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lecturas', '0013_lecturacuentakm_miniatura'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trabajoocr',
+            name='no_antes_de',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
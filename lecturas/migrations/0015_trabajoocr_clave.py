@@ -0,0 +1,32 @@
+import uuid
+
+from django.db import migrations, models
+
+
+def generar_claves(apps, schema_editor):
+    TrabajoOCR = apps.get_model("lecturas", "TrabajoOCR")
+    for trabajo in TrabajoOCR.objects.filter(clave__isnull=True).only("pk"):
+        trabajo.clave = uuid.uuid4()
+        trabajo.save(update_fields=["clave"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lecturas', '0014_trabajoocr_no_antes_de'),
+    ]
+
+    # en tres pasos: un default callable en AddField daría la misma clave a todas las filas existentes
+    operations = [
+        migrations.AddField(
+            model_name='trabajoocr',
+            name='clave',
+            field=models.UUIDField(editable=False, null=True),
+        ),
+        migrations.RunPython(generar_claves, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='trabajoocr',
+            name='clave',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+    ]
@@ -1,4 +1,8 @@
+import uuid
+
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.utils import timezone
 
 
 class Comercial(models.Model):
@@ -26,6 +30,9 @@ class LecturaCuentaKM(models.Model):
 
     # OJO: solo queremos guardar temporalmente (inicio hasta cierre, luego borrar ambas)
     imagen = models.ImageField(upload_to="lecturas/", null=True, blank=True)
+    # miniatura JPEG junto a la original (emails y admin); sobrevive al cierre de semana
+    # hasta CUENTAKM_MINIATURA_RETENCION_DIAS (barrer_media)
+    miniatura = models.ImageField(upload_to="lecturas/", null=True, blank=True)
 
     # flags/incidencias
     fin_fuera_de_plazo = models.BooleanField(default=False)     # cierre subido fuera de viernes
@@ -35,10 +42,310 @@ class LecturaCuentaKM(models.Model):
 
     class Meta:
         ordering = ["-anio", "-semana", "-created_at"]
+        constraints = [
+            # una lectura de cada tipo por comercial y semana (también sirve de índice)
+            models.UniqueConstraint(
+                fields=["comercial", "anio", "semana", "tipo_lectura"], name="lectura_unica_por_semana"
+            ),
+        ]
         indexes = [
-            models.Index(fields=["comercial", "anio", "semana", "tipo_lectura"]),
             models.Index(fields=["created_at"]),
+            models.Index(fields=["comercial", "-created_at"]),
         ]
 
     def __str__(self):
         return f"{self.comercial.nombre} - {self.get_tipo_lectura_display()} - Semana {self.semana}/{self.anio}"
+
+
+class TrabajoOCR(models.Model):
+    """
+    Cola (en BD) de lecturas pendientes de OCR cuando la API trabaja en modo asíncrono.
+    La consume el comando `procesar_trabajos_ocr`.
+    """
+    PENDIENTE = "pendiente"
+    EN_PROCESO = "en_proceso"
+    COMPLETADO = "completado"
+    ERROR = "error"
+
+    ESTADO_CHOICES = (
+        (PENDIENTE, "Pendiente"),
+        (EN_PROCESO, "En proceso"),
+        (COMPLETADO, "Completado"),
+        (ERROR, "Error"),
+    )
+
+    # SET_NULL: si el OCR falla la lectura se borra, pero el trabajo queda para consultar el error
+    lectura = models.OneToOneField(
+        LecturaCuentaKM, on_delete=models.SET_NULL, null=True, blank=True, related_name="trabajo_ocr"
+    )
+    # identificador público (job_id de la API): el pk es correlativo y dejaría
+    # consultar los trabajos de otros comerciales
+    clave = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default=PENDIENTE)
+    intentos = models.PositiveSmallIntegerField(default=0)
+    # tras un fallo de OCR el trabajo no se reclama antes de esta hora (espera entre intentos)
+    no_antes_de = models.DateTimeField(null=True, blank=True)
+
+    # payload que habría devuelto la API en modo síncrono (o el error)
+    resultado = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default="")
+    http_status = models.PositiveSmallIntegerField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["created_at"]
+        indexes = [
+            models.Index(fields=["estado", "created_at"]),
+        ]
+
+    def __str__(self):
+        return f"Trabajo OCR #{self.pk} ({self.get_estado_display()})"
+
+
+class CacheOCR(models.Model):
+    """
+    Resultado de OCR indexado por hash de la foto + versión de modelo/prompt.
+    Backend "bd" de la caché de OCR (ver services/cache_ocr.py): compartido
+    entre todos los workers, a diferencia de la caché locmem.
+    """
+    clave = models.CharField(max_length=64, unique=True)
+    kilometros = models.PositiveIntegerField()
+    texto_modelo = models.TextField(blank=True, default="")
+
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    expira_en = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.clave[:12]}… => {self.kilometros} km"
+
+
+class EmailOutbox(models.Model):
+    """
+    Emails a Administración pendientes de envío. Las vistas solo escriben aquí;
+    el comando `enviar_emails` los manda reutilizando una única conexión SMTP.
+    """
+    PENDIENTE = "pendiente"
+    ENVIADO = "enviado"
+    ERROR = "error"
+
+    ESTADO_CHOICES = (
+        (PENDIENTE, "Pendiente"),
+        (ENVIADO, "Enviado"),
+        (ERROR, "Error"),
+    )
+
+    asunto = models.CharField(max_length=255)
+    cuerpo = models.TextField()
+    remitente = models.CharField(max_length=255, blank=True, default="")
+    destinatarios = models.JSONField(default=list)
+
+    # nombres en default_storage; se leen al enviar, no al encolar
+    adjuntos = models.JSONField(default=list, blank=True)
+    # borrar las fotos adjuntas (y vaciar LecturaCuentaKM.imagen) una vez enviado
+    borrar_adjuntos = models.BooleanField(default=False)
+
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default=PENDIENTE)
+    intentos = models.PositiveSmallIntegerField(default=0)
+    proximo_intento = models.DateTimeField(default=timezone.now)
+    ultimo_error = models.TextField(blank=True, default="")
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    enviado_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["created_at"]
+        indexes = [
+            models.Index(fields=["estado", "proximo_intento"]),
+        ]
+
+    def __str__(self):
+        return f"{self.asunto} ({self.get_estado_display()})"
+
+
+class EstadoComercial(models.Model):
+    """
+    Estado desnormalizado de cada comercial (última lectura, último fin de
+    semana, último inicio), para que /lecturas/estado/ y el POST de lecturas
+    respondan con una búsqueda por clave primaria en vez de ordenar su historial.
+    Se mantiene desde las señales de LecturaCuentaKM (ver services/estado.py);
+    `manage.py reconstruir_estado_comerciales` la regenera desde cero.
+    """
+    comercial = models.OneToOneField(
+        Comercial, on_delete=models.CASCADE, primary_key=True, related_name="estado"
+    )
+
+    ultima_lectura = models.ForeignKey(
+        LecturaCuentaKM, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    ultimo_tipo = models.CharField(max_length=20, choices=LecturaCuentaKM.TIPO_CHOICES, blank=True, default="")
+    ultimos_km = models.PositiveIntegerField(null=True, blank=True)
+
+    ultimo_fin = models.ForeignKey(
+        LecturaCuentaKM, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    # inicio de la semana en curso si ultimo_tipo == inicio_semana (semana abierta)
+    ultimo_inicio = models.ForeignKey(
+        LecturaCuentaKM, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "estados de comerciales"
+
+    def __str__(self):
+        return f"{self.comercial.nombre}: {self.ultimo_tipo or 'sin lecturas'}"
+
+
+class ResumenSemanal(models.Model):
+    """
+    Una fila ya agregada por comercial y semana cerrada (inicio + fin emparejados).
+    Se actualiza al procesar cada fin_semana y cuando se editan los km o la
+    lectura entera (ver services/semanas.py); `manage.py reconstruir_resumen_semanal`
+    la regenera para un rango de semanas.
+    """
+    comercial = models.ForeignKey(Comercial, on_delete=models.CASCADE, related_name="resumenes_semanales")
+    anio = models.PositiveSmallIntegerField()
+    semana = models.PositiveSmallIntegerField()
+
+    km_inicio = models.PositiveIntegerField(null=True, blank=True)
+    km_fin = models.PositiveIntegerField(null=True, blank=True)
+    kms = models.IntegerField(null=True, blank=True)  # puede salir negativo si el OCR falló
+
+    fin_fuera_de_plazo = models.BooleanField(default=False)
+    inicio_no_cuadra = models.BooleanField(default=False)
+
+    cerrada_at = models.DateTimeField(null=True, blank=True)  # subida del fin_semana
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-anio", "-semana", "comercial__nombre"]
+        verbose_name_plural = "resúmenes semanales"
+        constraints = [
+            models.UniqueConstraint(fields=["comercial", "anio", "semana"], name="resumen_semanal_unico"),
+        ]
+        indexes = [
+            models.Index(fields=["anio", "semana"]),
+        ]
+
+    def __str__(self):
+        return f"{self.comercial.nombre} - Semana {self.semana}/{self.anio}: {self.kms} km"
+
+
+class ClaveIdempotencia(models.Model):
+    """
+    Cabecera `Idempotency-Key` de POST /api/lecturas/: guarda la respuesta de
+    la primera petición para devolverla tal cual en los reintentos del móvil
+    (sin volver a subir la foto ni pagar otra vez el OCR).
+    """
+    EN_PROCESO = "en_proceso"
+    COMPLETADA = "completada"
+
+    ESTADO_CHOICES = (
+        (EN_PROCESO, "En proceso"),
+        (COMPLETADA, "Completada"),
+    )
+
+    clave = models.CharField(max_length=255, unique=True)
+    # hash de comercial + tipo + foto: la misma clave con otra petición es un error del cliente
+    huella = models.CharField(max_length=64)
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default=EN_PROCESO)
+
+    http_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    respuesta = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    expira_en = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name_plural = "claves de idempotencia"
+
+    def __str__(self):
+        return f"{self.clave} ({self.get_estado_display()})"
+
+
+class RevisionLectura(models.Model):
+    """
+    Diferencia encontrada al volver a pasar el OCR por una lectura guardada
+    (`manage.py reprocesar_lecturas`). No se toca la lectura: alguien la
+    revisa en el admin y aplica o descarta el km nuevo.
+    """
+    PENDIENTE = "pendiente"
+    APLICADA = "aplicada"
+    DESCARTADA = "descartada"
+
+    ESTADO_CHOICES = (
+        (PENDIENTE, "Pendiente"),
+        (APLICADA, "Aplicada"),
+        (DESCARTADA, "Descartada"),
+    )
+
+    lectura = models.ForeignKey(LecturaCuentaKM, on_delete=models.CASCADE, related_name="revisiones")
+    ejecucion = models.CharField(max_length=100)
+
+    km_actual = models.PositiveIntegerField(null=True, blank=True)
+    km_nuevo = models.PositiveIntegerField()
+    confianza = models.FloatField(null=True, blank=True)
+    texto_modelo = models.TextField(blank=True, default="")
+    backend = models.CharField(max_length=100, blank=True, default="")
+
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default=PENDIENTE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        verbose_name_plural = "revisiones de lecturas"
+        constraints = [
+            models.UniqueConstraint(fields=["lectura", "ejecucion"], name="revision_unica_por_ejecucion"),
+        ]
+
+    def __str__(self):
+        return f"Lectura #{self.lectura_id}: {self.km_actual} => {self.km_nuevo}"
+
+
+class PuntoControlReproceso(models.Model):
+    """
+    Progreso de una ejecución de `reprocesar_lecturas` (las lecturas se
+    recorren por id ascendente): al relanzarla continúa tras `ultimo_id`.
+    `filtros` son los de la ejecución: el punto de control solo vale para ellos.
+    """
+    nombre = models.CharField(max_length=100, unique=True)
+    ultimo_id = models.BigIntegerField(default=0)
+    filtros = models.JSONField(default=dict, blank=True)
+
+    procesadas = models.PositiveIntegerField(default=0)
+    diferencias = models.PositiveIntegerField(default=0)
+    errores = models.PositiveIntegerField(default=0)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.nombre} (hasta #{self.ultimo_id})"
+
+
+class EstadoServicioExterno(models.Model):
+    """
+    Estado compartido por todos los workers para un servicio remoto (p.ej. la
+    API de visión): fichas del limitador de ritmo y estado del cortacircuitos.
+    Ver services/resiliencia.py.
+    """
+    nombre = models.CharField(max_length=50, primary_key=True)
+
+    fichas = models.FloatField(default=0)
+    fichas_at = models.DateTimeField(null=True, blank=True)
+
+    fallos_seguidos = models.PositiveIntegerField(default=0)
+    # mientras sea futuro el circuito está abierto: se falla sin llamar
+    abierto_hasta = models.DateTimeField(null=True, blank=True)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "estados de servicios externos"
+
+    def __str__(self):
+        return self.nombre
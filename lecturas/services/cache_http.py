@@ -0,0 +1,163 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import HttpResponseNotModified, JsonResponse
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+
+# ============================================================
+# Versiones (se invalidan desde signals.py)
+# ============================================================
+# Cada "ámbito" (comerciales, estado de un comercial) tiene un contador de
+# versión en la caché de Django. Las señales de Comercial/LecturaCuentaKM lo
+# cambian al confirmar la transacción; mientras no cambie, el ETag es el
+# mismo y se puede responder 304 sin tocar la BD.
+# Las señales solo invalidan la caché del proceso que escribe: con una caché
+# local (locmem, la de por defecto) los demás workers, el worker de OCR, el
+# admin o un comando no se enteran. Por eso, con caché local las versiones
+# caducan a los CUENTAKM_HTTP_CACHE_TTL_LOCAL segundos (lo máximo que puede
+# servirse un estado viejo); con una caché compartida (Redis, BD...) no caducan.
+
+PREFIJO = "cuentakm:http:"
+
+
+def _cache():
+    return caches[getattr(settings, "CUENTAKM_HTTP_CACHE_ALIAS", "default")]
+
+
+def ttl_version():
+    if isinstance(_cache(), (LocMemCache, DummyCache)):
+        return getattr(settings, "CUENTAKM_HTTP_CACHE_TTL_LOCAL", 10)
+    return None
+
+
+def ambito_estado(comercial_id) -> str:
+    return f"estado:{comercial_id}"
+
+
+def obtener_version(ambito: str):
+    """
+    (version, timestamp) del ámbito. Si no existe (caché vacía o expulsada),
+    se crea una nueva: en el peor caso el cliente recibe un 200 de más.
+    """
+    clave = f"{PREFIJO}ver:{ambito}"
+    valor = _cache().get(clave)
+    if valor is None:
+        valor = _nueva_version()
+        # add: si otro proceso la acaba de crear, nos quedamos con la suya
+        if not _cache().add(clave, valor, timeout=ttl_version()):
+            valor = _cache().get(clave) or valor
+    return valor
+
+
+async def aobtener_version(ambito: str):
+    clave = f"{PREFIJO}ver:{ambito}"
+    valor = await _cache().aget(clave)
+    if valor is None:
+        valor = _nueva_version()
+        if not await _cache().aadd(clave, valor, timeout=ttl_version()):
+            valor = await _cache().aget(clave) or valor
+    return valor
+
+
+def invalidar(*ambitos):
+    for ambito in ambitos:
+        _cache().set(f"{PREFIJO}ver:{ambito}", _nueva_version(), timeout=ttl_version())
+
+
+def _nueva_version():
+    ahora = time.time()
+    return (f"{time.time_ns():x}", int(ahora))
+
+
+# ============================================================
+# Respuesta condicional
+# ============================================================
+def _no_modificado(request, etag, timestamp) -> bool:
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match:
+        return etag in [e.strip() for e in if_none_match.split(",")] or if_none_match.strip() == "*"
+    if_modified_since = parse_http_date_safe(request.headers.get("If-Modified-Since", ""))
+    return if_modified_since is not None and timestamp <= if_modified_since
+
+
+def _etag_y_cabeceras(ambito, version, timestamp, variante):
+    etag = quote_etag(f"{ambito}-{version}-{variante}")
+    return etag, {
+        "ETag": etag,
+        "Last-Modified": http_date(timestamp),
+        # el navegador guarda la respuesta pero revalida siempre (barato: 304)
+        "Cache-Control": "private, no-cache",
+    }
+
+
+def _clave_payload(ambito, version, variante):
+    return f"{PREFIJO}payload:{ambito}:{version}:{variante}"
+
+
+def respuesta_condicional(request, ambito: str, construir, variante: str = ""):
+    """
+    GET con ETag/Last-Modified y payload cacheado en servidor.
+
+    - Si el cliente ya tiene la versión actual => 304 sin ejecutar consultas.
+    - Si no, se sirve el payload cacheado para esa versión o se construye con
+      `construir()`, que devuelve (data, status). Solo se cachean los 200.
+
+    `variante` distingue payloads que dependen de algo más que los datos
+    (p.ej. la fecha de hoy en /lecturas/estado/).
+    """
+    version, timestamp = obtener_version(ambito)
+    etag, cabeceras = _etag_y_cabeceras(ambito, version, timestamp, variante)
+
+    if _no_modificado(request, etag, timestamp):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=cabeceras)
+
+    clave_payload = _clave_payload(ambito, version, variante)
+    data = _cache().get(clave_payload)
+    if data is None:
+        data, codigo = construir()
+        if codigo != status.HTTP_200_OK:
+            return Response(data, status=codigo)
+        _cache().set(clave_payload, data, timeout=getattr(settings, "CUENTAKM_HTTP_CACHE_TTL", 3600))
+
+    return Response(data, status=status.HTTP_200_OK, headers=cabeceras)
+
+
+async def arespuesta_condicional(request, ambito: str, aconstruir, variante: str = ""):
+    """
+    respuesta_condicional para las vistas async (Django puro, sin DRF):
+    `aconstruir()` es una corrutina y se devuelve un JsonResponse.
+    """
+    version, timestamp = await aobtener_version(ambito)
+    etag, cabeceras = _etag_y_cabeceras(ambito, version, timestamp, variante)
+
+    if _no_modificado(request, etag, timestamp):
+        return HttpResponseNotModified(headers=cabeceras)
+
+    clave_payload = _clave_payload(ambito, version, variante)
+    data = await _cache().aget(clave_payload)
+    if data is None:
+        data, codigo = await aconstruir()
+        if codigo != status.HTTP_200_OK:
+            return respuesta_json(data, status=codigo)
+        await _cache().aset(clave_payload, data, timeout=getattr(settings, "CUENTAKM_HTTP_CACHE_TTL", 3600))
+
+    return respuesta_json(data, status=status.HTTP_200_OK, headers=cabeceras)
+
+
+def respuesta_json(data, status=200, headers=None):
+    """
+    JsonResponse con el mismo encoder que DRF (fechas, decimales...), para
+    que las vistas async respondan exactamente lo mismo que las síncronas.
+    `.data` queda accesible como en un Response de DRF.
+    """
+    respuesta = JsonResponse(data, status=status, headers=headers, encoder=JSONEncoder, safe=False)
+    respuesta.data = data
+    return respuesta
@@ -0,0 +1,142 @@
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from ..models import CacheOCR
+
+
+# ============================================================
+# Clave
+# ============================================================
+def _hash_version(version: str):
+    h = hashlib.sha256()
+    h.update(version.encode("utf-8"))
+    h.update(b"\0")
+    return h
+
+
+def clave_cache_ocr(img_bytes: bytes, version: str) -> str:
+    """
+    SHA-256 de los bytes de la foto + versión (modelo, prompt, preprocesado).
+    Si cambia cualquiera de ellos, la clave cambia y no se reutilizan lecturas viejas.
+    """
+    h = _hash_version(version)
+    h.update(img_bytes)
+    return h.hexdigest()
+
+
+def clave_cache_ocr_fichero(ruta: str, version: str, bloque: int = 64 * 1024) -> str:
+    """
+    Igual que `clave_cache_ocr` pero leyendo el fichero por bloques.
+    """
+    h = _hash_version(version)
+    with open(ruta, "rb") as f:
+        for trozo in iter(lambda: f.read(bloque), b""):
+            h.update(trozo)
+    return h.hexdigest()
+
+
+# ============================================================
+# Backends
+# ============================================================
+class CacheOCRBase:
+    """
+    Interfaz de los backends de caché de OCR.
+    `get` devuelve {"km": int, "texto": str} o None.
+    """
+
+    def __init__(self, ttl: int, max_entradas: int):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+
+    def get(self, clave: str):
+        raise NotImplementedError
+
+    def set(self, clave: str, km: int, texto: str):
+        raise NotImplementedError
+
+
+class CacheOCRDjango(CacheOCRBase):
+    """
+    Usa el framework de caché de Django (alias CUENTAKM_OCR_CACHE_ALIAS).
+    El límite de tamaño lo pone el propio backend (MAX_ENTRIES en CACHES).
+    """
+    prefijo = "ocr:"
+
+    def __init__(self, ttl: int, max_entradas: int):
+        super().__init__(ttl, max_entradas)
+        self.cache = caches[getattr(settings, "CUENTAKM_OCR_CACHE_ALIAS", "default")]
+
+    def get(self, clave):
+        return self.cache.get(self.prefijo + clave)
+
+    def set(self, clave, km, texto):
+        self.cache.set(self.prefijo + clave, {"km": km, "texto": texto}, timeout=self.ttl)
+
+
+class CacheOCRBD(CacheOCRBase):
+    """
+    Tabla CacheOCR: compartida entre procesos. Al insertar se purgan las
+    entradas caducadas y, si se supera `max_entradas`, las más antiguas.
+    """
+
+    def get(self, clave):
+        fila = (
+            CacheOCR.objects
+            .filter(clave=clave, expira_en__gt=timezone.now())
+            .values("kilometros", "texto_modelo")
+            .first()
+        )
+        if not fila:
+            return None
+        return {"km": fila["kilometros"], "texto": fila["texto_modelo"]}
+
+    def set(self, clave, km, texto):
+        ahora = timezone.now()
+        CacheOCR.objects.update_or_create(
+            clave=clave,
+            defaults={
+                "kilometros": km,
+                "texto_modelo": texto or "",
+                "expira_en": ahora + timedelta(seconds=self.ttl),
+            },
+        )
+        self._desalojar(ahora)
+
+    def _desalojar(self, ahora):
+        CacheOCR.objects.filter(expira_en__lte=ahora).delete()
+        sobran = CacheOCR.objects.count() - self.max_entradas
+        if sobran > 0:
+            viejas = list(
+                CacheOCR.objects.order_by("created_at").values_list("pk", flat=True)[:sobran]
+            )
+            CacheOCR.objects.filter(pk__in=viejas).delete()
+
+
+BACKENDS_CACHE_OCR = {
+    "bd": CacheOCRBD,
+    "django": CacheOCRDjango,
+}
+
+
+def get_cache_ocr():
+    """
+    Backend configurado en CUENTAKM_OCR_CACHE: "bd", "django", una ruta
+    'paquete.modulo.Clase' a un backend propio, o vacío para desactivar la caché.
+    """
+    nombre = getattr(settings, "CUENTAKM_OCR_CACHE", "")
+    if not nombre:
+        return None
+
+    clase = BACKENDS_CACHE_OCR.get(nombre)
+    if clase is None:
+        clase = import_string(nombre)
+
+    return clase(
+        ttl=getattr(settings, "CUENTAKM_OCR_CACHE_TTL", 7 * 24 * 3600),
+        max_entradas=getattr(settings, "CUENTAKM_OCR_CACHE_MAX", 5000),
+    )
@@ -0,0 +1,148 @@
+import logging
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from ..models import TrabajoOCR
+from .procesamiento import InicioPendiente, LecturaRechazada, aplicar_reglas_semana, descartar_lectura, leer_km
+from .resiliencia import ServicioNoDisponible
+
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================================
+# Productor (vista)
+# ============================================================
+def encolar_lectura(lectura) -> TrabajoOCR:
+    """
+    Crea el trabajo de OCR para una lectura ya guardada (con su foto).
+    """
+    return TrabajoOCR.objects.create(lectura=lectura)
+
+
+# ============================================================
+# Consumidor (comando procesar_trabajos_ocr)
+# ============================================================
+def reclamar_siguiente_trabajo():
+    """
+    Marca como EN_PROCESO el trabajo pendiente más antiguo y lo devuelve
+    (o None si no hay ninguno listo: los que esperan su siguiente intento
+    no cuentan, ni los que tienen por delante otro del mismo comercial
+    sin terminar: el fin no se procesa antes que su inicio). El UPDATE
+    condicional hace que dos hilos/procesos no puedan quedarse con el
+    mismo trabajo, también en SQLite.
+    """
+    anterior_sin_terminar = TrabajoOCR.objects.filter(
+        estado__in=[TrabajoOCR.PENDIENTE, TrabajoOCR.EN_PROCESO],
+        lectura__comercial_id=OuterRef("lectura__comercial_id"),
+        created_at__lt=OuterRef("created_at"),
+    )
+    candidatos = (
+        TrabajoOCR.objects
+        .filter(estado=TrabajoOCR.PENDIENTE)
+        .filter(Q(no_antes_de__isnull=True) | Q(no_antes_de__lte=timezone.now()))
+        .exclude(Exists(anterior_sin_terminar))
+        .order_by("created_at")
+        .values_list("pk", flat=True)[:10]
+    )
+    for pk in candidatos:
+        reclamado = (
+            TrabajoOCR.objects
+            .filter(pk=pk, estado=TrabajoOCR.PENDIENTE)
+            .update(estado=TrabajoOCR.EN_PROCESO, intentos=F("intentos") + 1, updated_at=timezone.now())
+        )
+        if reclamado:
+            return TrabajoOCR.objects.select_related("lectura__comercial").get(pk=pk)
+    return None
+
+
+def liberar_trabajos_colgados(timeout_segundos: int) -> int:
+    """
+    Devuelve a PENDIENTE los trabajos que llevan demasiado tiempo EN_PROCESO
+    (worker muerto a mitad de OCR).
+    """
+    limite = timezone.now() - timedelta(seconds=timeout_segundos)
+    return (
+        TrabajoOCR.objects
+        .filter(estado=TrabajoOCR.EN_PROCESO, updated_at__lt=limite)
+        .update(estado=TrabajoOCR.PENDIENTE, updated_at=timezone.now())
+    )
+
+
+def _espera_reintento(intentos: int) -> timedelta:
+    """
+    Espera exponencial con jitter antes del siguiente intento: base,
+    2*base, 4*base... hasta CUENTAKM_OCR_COLA_ESPERA_MAX.
+    """
+    base = getattr(settings, "CUENTAKM_OCR_COLA_ESPERA_BASE", 30)
+    maximo = getattr(settings, "CUENTAKM_OCR_COLA_ESPERA_MAX", 600)
+    segundos = min(maximo, base * (2 ** max(0, intentos - 1)))
+    return timedelta(seconds=segundos * random.uniform(0.8, 1.2))
+
+
+def _finalizar(trabajo, estado, http_status, resultado=None, error=""):
+    trabajo.estado = estado
+    trabajo.http_status = http_status
+    trabajo.resultado = resultado
+    trabajo.error = error
+    trabajo.save(update_fields=["lectura", "estado", "http_status", "resultado", "error", "updated_at"])
+
+
+def ejecutar_trabajo(trabajo, max_intentos: int = 3):
+    """
+    Ejecuta OCR + reglas de semana + emails para un trabajo reclamado.
+    Si el OCR falla se reintenta hasta `max_intentos`, con una espera
+    creciente entre intentos (no_antes_de); después se descarta
+    la lectura igual que haría la vista síncrona. Si el servicio de OCR no
+    está disponible, el trabajo vuelve a la cola y se propaga ServicioNoDisponible.
+    """
+    lectura = trabajo.lectura
+    if lectura is None:
+        _finalizar(trabajo, TrabajoOCR.ERROR, 410, error="La lectura asociada ya no existe.")
+        return
+
+    try:
+        # un fin encolado por InicioPendiente ya tiene sus km: no se paga otro OCR
+        if lectura.kilometros is None:
+            leer_km(lectura)
+    except ServicioNoDisponible:
+        # no cuenta como intento: vuelve a la cola y el worker deja de vaciarla por ahora
+        trabajo.estado = TrabajoOCR.PENDIENTE
+        trabajo.intentos = F("intentos") - 1
+        trabajo.save(update_fields=["estado", "intentos", "updated_at"])
+        raise
+    except Exception as e:
+        logger.exception("[OCR] Error leyendo km (trabajo %s, intento %s)", trabajo.pk, trabajo.intentos)
+        if trabajo.intentos < max_intentos:
+            trabajo.estado = TrabajoOCR.PENDIENTE
+            trabajo.error = str(e)
+            trabajo.no_antes_de = timezone.now() + _espera_reintento(trabajo.intentos)
+            trabajo.save(update_fields=["estado", "error", "no_antes_de", "updated_at"])
+            return
+        descartar_lectura(lectura)
+        trabajo.lectura = None
+        _finalizar(trabajo, TrabajoOCR.ERROR, 500, error=f"Error leyendo kilómetros: {str(e)}")
+        return
+
+    try:
+        payload = aplicar_reglas_semana(lectura)
+    except LecturaRechazada as e:
+        if lectura.pk is None:
+            trabajo.lectura = None
+        _finalizar(trabajo, TrabajoOCR.ERROR, 400, error=str(e))
+        return
+    except InicioPendiente:
+        # reclamar_siguiente_trabajo ya espera al trabajo del inicio; si aun así
+        # no tiene km (inicio sin trabajo en cola), se aparca un rato en vez de
+        # reclamarlo otra vez en el mismo vaciado
+        trabajo.estado = TrabajoOCR.PENDIENTE
+        trabajo.intentos = F("intentos") - 1
+        trabajo.no_antes_de = timezone.now() + _espera_reintento(1)
+        trabajo.save(update_fields=["estado", "intentos", "no_antes_de", "updated_at"])
+        return
+
+    _finalizar(trabajo, TrabajoOCR.COMPLETADO, 201, resultado=payload)
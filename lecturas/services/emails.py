@@ -0,0 +1,180 @@
+import logging
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+
+from ..models import EmailOutbox
+from . import metricas
+from .miniaturas import foto_para_adjuntar
+
+
+logger = logging.getLogger(__name__)
+
+
+def _destinatarios_admin():
+    return ["ivallejo@tipsitpv.com"]
+
+
+def _remitente():
+    return getattr(settings, "DEFAULT_FROM_EMAIL", None) or getattr(settings, "EMAIL_HOST_USER", None)
+
+
+def _enviar(subject, body, adjuntos, borrar_adjuntos, log_msg, diferido=None) -> bool:
+    """
+    Con CUENTAKM_EMAIL_OUTBOX (o `diferido=True`) el mensaje se guarda en
+    EmailOutbox y lo envía el comando `enviar_emails`; si no, se envía aquí
+    mismo por SMTP.
+
+    `adjuntos` son pares (lectura, etiqueta). Devuelve True si el borrado de las
+    fotos queda delegado en el envío diferido (quien llama NO debe borrarlas).
+    """
+    to_email = _destinatarios_admin()
+    from_email = _remitente()
+
+    if diferido is None:
+        diferido = getattr(settings, "CUENTAKM_EMAIL_OUTBOX", False)
+    if diferido:
+        EmailOutbox.objects.create(
+            asunto=subject,
+            cuerpo=body,
+            remitente=from_email or "",
+            destinatarios=to_email,
+            adjuntos=[foto.name for foto in map(foto_para_adjuntar, (lectura for lectura, _ in adjuntos)) if foto],
+            borrar_adjuntos=borrar_adjuntos,
+        )
+        logger.info("[EMAIL] Encolado: %s", log_msg)
+        return borrar_adjuntos
+
+    email = EmailMessage(
+        subject=subject,
+        body=body,
+        from_email=from_email,
+        to=to_email,
+    )
+
+    # Adjuntar fotos: la miniatura (decenas de KB) si existe, si no la original
+    # IMPORTANTE: EmailMessage.attach_file necesita ruta absoluta en disco, no el "name" relativo.
+    # Si usas default_storage local, esto funciona con .path.
+    for lectura, label in adjuntos:
+        try:
+            foto = foto_para_adjuntar(lectura)
+            if foto:
+                # Para storage local:
+                email.attach_file(foto.path)
+        except Exception:
+            logger.exception("No se pudo adjuntar foto %s", label)
+
+    try:
+        email.send(fail_silently=False)
+    except Exception:
+        metricas.incrementar("emails_fallidos")
+        raise
+    logger.info("[EMAIL] Enviado %s", log_msg)
+    return False
+
+
+def enviar_email_admin_fin_semana(comercial, lectura_inicio, lectura_fin, kms_semana, warning=None, borrar_fotos=False,
+                                  diferido=None):
+    """
+    Envía email a admin con:
+    - medición inicio y fin
+    - diferencia
+    - warning (si aplica)
+    - adjunta las 2 fotos (si existen)
+
+    Con `borrar_fotos`, si el email va por la outbox las fotos se borran tras
+    enviarlo y la función devuelve True.
+    """
+    subject = f"[Cuentakm] {comercial.nombre} – Semana {lectura_fin.semana}/{lectura_fin.anio}"
+    lines = [
+        f"Comercial: {comercial.nombre}",
+        f"Semana: {lectura_fin.semana}/{lectura_fin.anio}",
+        "",
+        f"Inicio de semana: {lectura_inicio.kilometros} km  ({lectura_inicio.created_at})",
+        f"Fin de semana:    {lectura_fin.kilometros} km  ({lectura_fin.created_at})",
+        "",
+        f"Kilómetros realizados: {kms_semana} km",
+    ]
+    if warning:
+        lines += ["", f"AVISO: {warning}"]
+
+    body = "\n".join(lines)
+
+    with metricas.cronometro("email"):
+        return _enviar(
+            subject,
+            body,
+            [(lectura_inicio, "inicio"), (lectura_fin, "fin")],
+            borrar_fotos,
+            "resumen fin de semana a Administración",
+            diferido,
+        )
+
+
+def enviar_email_admin_mismatch_lunes(comercial, lectura_fin_anterior, lectura_inicio_nueva, warning, diferido=None):
+    """
+    Email específico cuando el lunes (inicio nueva semana) NO cuadra con el fin anterior.
+    Adjunta foto fin anterior y foto inicio nueva (si existen).
+    """
+    subject = f"[Cuentakm][AVISO] Posible uso fin de semana – {comercial.nombre}"
+    lines = [
+        f"Comercial: {comercial.nombre}",
+        "",
+        f"Fin semana anterior: {lectura_fin_anterior.kilometros} km  ({lectura_fin_anterior.created_at})",
+        f"Inicio semana nueva: {lectura_inicio_nueva.kilometros} km  ({lectura_inicio_nueva.created_at})",
+        "",
+        f"AVISO: {warning}",
+    ]
+    body = "\n".join(lines)
+
+    # La foto de inicio se necesita luego para el email de fin de semana: no se borra
+    with metricas.cronometro("email"):
+        return _enviar(
+            subject,
+            body,
+            [(lectura_fin_anterior, "fin_anterior"), (lectura_inicio_nueva, "inicio_nueva")],
+            False,
+            "aviso mismatch lunes a Administración",
+            diferido,
+        )
+
+
+def enviar_email_resumen_semanal(anio, semana, filas, hoja_contactos=None):
+    """
+    Resumen consolidado de la semana: una línea por comercial con inicio, fin,
+    km realizados y avisos. Adjunta (si hay fotos) UNA hoja de contactos con
+    las miniaturas en lugar de dos fotos originales por comercial.
+    """
+    subject = f"[Cuentakm] Resumen semana {semana}/{anio}"
+
+    def km(lectura):
+        return f"{lectura.kilometros} km" if lectura and lectura.kilometros is not None else "-"
+
+    lines = [f"Resumen de kilómetros – Semana {semana}/{anio}", ""]
+    total = 0
+    for fila in filas:
+        kms = fila["kms"]
+        if kms is not None:
+            total += kms
+        lines.append(
+            f"{fila['comercial'].nombre}: inicio {km(fila['inicio'])} | fin {km(fila['fin'])} | "
+            f"realizados {kms if kms is not None else '-'} km"
+            + (f"  [AVISO: {', '.join(fila['avisos'])}]" if fila["avisos"] else "")
+        )
+    lines += ["", f"Total equipo: {total} km"]
+
+    email = EmailMessage(
+        subject=subject,
+        body="\n".join(lines),
+        from_email=_remitente(),
+        to=_destinatarios_admin(),
+    )
+    if hoja_contactos:
+        email.attach(f"cuentakm_semana_{anio}_{semana:02d}.jpg", hoja_contactos, "image/jpeg")
+
+    try:
+        email.send(fail_silently=False)
+    except Exception:
+        metricas.incrementar("emails_fallidos")
+        raise
+    logger.info("[EMAIL] Enviado resumen semanal %s/%s a Administración", semana, anio)
@@ -0,0 +1,171 @@
+from asgiref.sync import sync_to_async
+from django.db import transaction
+
+from ..models import Comercial, EstadoComercial, LecturaCuentaKM
+
+
+# ============================================================
+# Mantenimiento de EstadoComercial
+# ============================================================
+def _valores_desde_historial(comercial_id) -> dict:
+    qs = LecturaCuentaKM.objects.filter(comercial_id=comercial_id).order_by("-created_at")
+    ultima = qs.first()
+    return {
+        "ultima_lectura": ultima,
+        "ultimo_tipo": ultima.tipo_lectura if ultima else "",
+        "ultimos_km": ultima.kilometros if ultima else None,
+        "ultimo_fin": qs.filter(tipo_lectura=LecturaCuentaKM.FIN).first(),
+        "ultimo_inicio": qs.filter(tipo_lectura=LecturaCuentaKM.INICIO).first(),
+    }
+
+
+def recalcular_estado(comercial_id, crear: bool = True):
+    """
+    Recalcula el estado de un comercial desde su historial. Solo se usa en
+    los casos raros (borrados, ediciones en el admin, estado que no existe todavía).
+    Con crear=False no inserta la fila si no existe (p.ej. mientras se borra
+    el propio comercial en cascada).
+    """
+    valores = _valores_desde_historial(comercial_id)
+    with transaction.atomic():
+        actualizadas = EstadoComercial.objects.filter(comercial_id=comercial_id).update(**valores)
+        if not actualizadas and crear:
+            # otra petición puede crearla a la vez: get_or_create absorbe el
+            # IntegrityError (que si no acabaría en crear_lectura como LecturaDuplicada)
+            _, creada = EstadoComercial.objects.get_or_create(comercial_id=comercial_id, defaults=valores)
+            if not creada:
+                EstadoComercial.objects.filter(comercial_id=comercial_id).update(**valores)
+
+
+def registrar_lectura(lectura):
+    """
+    Alta de una lectura: actualización O(1) del estado, sin recorrer el historial.
+    """
+    with transaction.atomic():
+        estado = EstadoComercial.objects.select_for_update().filter(comercial_id=lectura.comercial_id).first()
+        if estado is None:
+            recalcular_estado(lectura.comercial_id)
+            return
+
+        estado.ultima_lectura = lectura
+        estado.ultimo_tipo = lectura.tipo_lectura
+        estado.ultimos_km = lectura.kilometros
+        if lectura.tipo_lectura == LecturaCuentaKM.FIN:
+            estado.ultimo_fin = lectura
+        else:
+            estado.ultimo_inicio = lectura
+        estado.save()
+
+
+def actualizar_km(lectura):
+    """
+    Los km llegan después del alta (OCR): si es la última lectura, se copian.
+    """
+    EstadoComercial.objects.filter(
+        comercial_id=lectura.comercial_id, ultima_lectura_id=lectura.pk
+    ).update(ultimos_km=lectura.kilometros)
+
+
+def lectura_modificada(lectura, comercial_anterior=None):
+    """
+    Guardado completo de una lectura ya existente (el admin): puede haber
+    cambiado el tipo, la semana o el comercial, así que se recalcula desde el
+    historial. Si la lectura ha cambiado de comercial, también el anterior.
+    """
+    recalcular_estado(lectura.comercial_id)
+    if comercial_anterior is not None and comercial_anterior != lectura.comercial_id:
+        recalcular_estado(comercial_anterior, crear=False)
+
+
+def lectura_borrada(comercial_id):
+    """
+    Borrado de una lectura (poco frecuente: OCR fallido, admin). Para cuando
+    llega la señal, SET_NULL ya ha vaciado las referencias a ella, así que se
+    recalcula desde el historial.
+    """
+    recalcular_estado(comercial_id, crear=False)
+
+
+# ============================================================
+# Lectura
+# ============================================================
+def obtener_estado(comercial_id):
+    """
+    Estado del comercial con una sola consulta por clave primaria (con el
+    comercial y las lecturas referenciadas ya unidas).
+    Si el comercial existe pero aún no tiene fila de estado, se crea.
+    Lanza Comercial.DoesNotExist si el comercial no existe.
+    """
+    qs = EstadoComercial.objects.select_related("comercial", "ultima_lectura", "ultimo_fin", "ultimo_inicio")
+    try:
+        return qs.get(comercial_id=comercial_id)
+    except EstadoComercial.DoesNotExist:
+        comercial = Comercial.objects.get(id=comercial_id)
+        recalcular_estado(comercial.id)
+        return qs.get(comercial_id=comercial.id)
+
+
+async def aobtener_estado(comercial_id):
+    """
+    obtener_estado para las vistas async (ORM async: una consulta, sin hilo).
+    """
+    qs = EstadoComercial.objects.select_related("comercial", "ultima_lectura", "ultimo_fin", "ultimo_inicio")
+    try:
+        return await qs.aget(comercial_id=comercial_id)
+    except EstadoComercial.DoesNotExist:
+        comercial = await Comercial.objects.aget(id=comercial_id)
+        await sync_to_async(recalcular_estado)(comercial.id)
+        return await qs.aget(comercial_id=comercial.id)
+
+
+def bloquear_estado(comercial_id):
+    """
+    Como obtener_estado, pero con la fila bloqueada (SELECT ... FOR UPDATE)
+    hasta el final de la transacción en curso: serializa las altas de lecturas
+    de un mismo comercial. En SQLite no hay bloqueo de filas; ahí serializa
+    el BEGIN IMMEDIATE configurado en settings.
+    """
+    qs = (
+        EstadoComercial.objects
+        .select_related("comercial", "ultima_lectura", "ultimo_fin", "ultimo_inicio")
+        .select_for_update(of=("self",))
+    )
+    try:
+        return qs.get(comercial_id=comercial_id)
+    except EstadoComercial.DoesNotExist:
+        comercial = Comercial.objects.get(id=comercial_id)
+        recalcular_estado(comercial.id)
+        return qs.get(comercial_id=comercial.id)
+
+
+def reconstruir_todos() -> int:
+    """
+    Regenera la tabla completa en una pasada por LecturaCuentaKM (backfill).
+    """
+    valores = {c: {"ultima_lectura_id": None, "ultimo_tipo": "", "ultimos_km": None,
+                   "ultimo_fin_id": None, "ultimo_inicio_id": None}
+               for c in Comercial.objects.values_list("id", flat=True)}
+
+    lecturas = (
+        LecturaCuentaKM.objects
+        .order_by("created_at")
+        .values_list("id", "comercial_id", "tipo_lectura", "kilometros")
+        .iterator(chunk_size=2000)
+    )
+    for pk, comercial_id, tipo, km in lecturas:
+        v = valores[comercial_id]
+        v["ultima_lectura_id"] = pk
+        v["ultimo_tipo"] = tipo
+        v["ultimos_km"] = km
+        if tipo == LecturaCuentaKM.FIN:
+            v["ultimo_fin_id"] = pk
+        else:
+            v["ultimo_inicio_id"] = pk
+
+    with transaction.atomic():
+        EstadoComercial.objects.all().delete()
+        EstadoComercial.objects.bulk_create(
+            [EstadoComercial(comercial_id=c, **v) for c, v in valores.items()],
+            batch_size=500,
+        )
+    return len(valores)
@@ -0,0 +1,82 @@
+import csv
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from ..models import LecturaCuentaKM
+from .informes import informe_semanal_qs
+
+
+TAMANO_BLOQUE = 2000
+
+CABECERA_LECTURAS = [
+    "id", "comercial_id", "comercial", "tipo_lectura", "anio", "semana", "kilometros",
+    "fin_fuera_de_plazo", "inicio_no_cuadra", "created_at",
+]
+CABECERA_SEMANAL = [
+    "comercial_id", "comercial", "anio", "semana", "km_inicio", "km_fin", "kms",
+    "cerrada", "inicio_no_cuadra", "fin_fuera_de_plazo",
+]
+
+
+# ============================================================
+# Exportación CSV en streaming
+# ============================================================
+# Las filas se leen de la BD por bloques (.iterator) y se escriben según
+# salen: la memoria no crece con el número de lecturas y el navegador
+# empieza a recibir el fichero enseguida.
+# Separador ";" y BOM UTF-8 para que Excel en español lo abra directamente.
+
+class _Eco:
+    """
+    "Fichero" para csv.writer que devuelve la línea en vez de guardarla.
+    """
+    def write(self, valor):
+        return valor
+
+
+def _si_no(valor) -> str:
+    return "si" if valor else "no"
+
+
+def _fecha(valor) -> str:
+    return timezone.localtime(valor).strftime("%Y-%m-%d %H:%M:%S") if valor else ""
+
+
+def filas_lecturas(qs=None):
+    qs = LecturaCuentaKM.objects.all() if qs is None else qs
+    lecturas = (
+        qs.select_related("comercial")
+        .order_by("anio", "semana", "comercial_id", "created_at")
+        .iterator(chunk_size=TAMANO_BLOQUE)
+    )
+    for lectura in lecturas:
+        yield [
+            lectura.id, lectura.comercial_id, lectura.comercial.nombre, lectura.tipo_lectura,
+            lectura.anio, lectura.semana, "" if lectura.kilometros is None else lectura.kilometros,
+            _si_no(lectura.fin_fuera_de_plazo), _si_no(lectura.inicio_no_cuadra), _fecha(lectura.created_at),
+        ]
+
+
+def filas_semanales(base=None, **filtros):
+    for r in informe_semanal_qs(base=base, **filtros).iterator(chunk_size=TAMANO_BLOQUE):
+        yield [
+            r["comercial_id"], r["comercial__nombre"], r["anio"], r["semana"],
+            "" if r["km_inicio"] is None else r["km_inicio"],
+            "" if r["km_fin"] is None else r["km_fin"],
+            "" if r["kms"] is None else r["kms"],
+            _si_no(r["fin_at"] is not None), _si_no(r["avisos_inicio"]), _si_no(r["avisos_fin"]),
+        ]
+
+
+def respuesta_csv(nombre_fichero: str, cabecera, filas) -> StreamingHttpResponse:
+    escritor = csv.writer(_Eco(), delimiter=";")
+
+    def contenido():
+        yield "\ufeff" + escritor.writerow(cabecera)
+        for fila in filas:
+            yield escritor.writerow(fila)
+
+    respuesta = StreamingHttpResponse(contenido(), content_type="text/csv; charset=utf-8")
+    respuesta["Content-Disposition"] = f'attachment; filename="{nombre_fichero}"'
+    return respuesta
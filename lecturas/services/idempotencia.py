@@ -0,0 +1,132 @@
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.response import Response
+
+from ..models import ClaveIdempotencia
+
+
+MAX_LONGITUD_CLAVE = 255
+# una clave "en proceso" más antigua que esto se da por abandonada (worker muerto)
+COLGADA_TRAS = timedelta(minutes=5)
+
+
+# ============================================================
+# Idempotency-Key en POST /api/lecturas/
+# ============================================================
+def huella_peticion(request) -> str:
+    """
+    Hash de lo que define la petición (comercial, tipo y bytes de la foto).
+    """
+    h = hashlib.sha256()
+    # .POST (no .data): vale tanto para la Request de DRF como para las vistas async
+    h.update(f"{request.POST.get('comercial_id')}|{request.POST.get('tipo_lectura')}|".encode("utf-8"))
+    imagen = request.FILES.get("imagen")
+    if imagen:
+        for bloque in imagen.chunks():
+            h.update(bloque)
+        imagen.seek(0)
+    return h.hexdigest()
+
+
+def _ttl():
+    return timedelta(seconds=getattr(settings, "CUENTAKM_IDEMPOTENCIA_TTL", 24 * 3600))
+
+
+def _reclamar(clave, huella):
+    """
+    Intenta quedarse con la clave para procesar la petición.
+    Devuelve (True, None) si es nuestra o (False, registro existente).
+    """
+    ahora = timezone.now()
+    try:
+        with transaction.atomic():
+            ClaveIdempotencia.objects.create(clave=clave, huella=huella, expira_en=ahora + _ttl())
+        # de paso, limpieza de las caducadas (índice en expira_en)
+        ClaveIdempotencia.objects.filter(expira_en__lt=ahora).delete()
+        return True, None
+    except IntegrityError:
+        pass
+
+    # caducada, o "en proceso" de una petición que murió a medias: se reutiliza
+    tomada = (
+        ClaveIdempotencia.objects
+        .filter(clave=clave)
+        .filter(Q(expira_en__lt=ahora) | Q(estado=ClaveIdempotencia.EN_PROCESO, updated_at__lt=ahora - COLGADA_TRAS))
+        .update(
+            huella=huella,
+            estado=ClaveIdempotencia.EN_PROCESO,
+            http_status=None,
+            respuesta=None,
+            expira_en=ahora + _ttl(),
+            updated_at=ahora,
+        )
+    )
+    if tomada:
+        return True, None
+    return False, ClaveIdempotencia.objects.filter(clave=clave).first()
+
+
+def _repetir(registro, responder):
+    return responder(registro.respuesta, status=registro.http_status, headers={"Idempotent-Replayed": "true"})
+
+
+def responder_idempotente(request, clave: str, procesar, responder=Response):
+    """
+    Ejecuta `procesar()` (que devuelve un Response) una sola vez por clave.
+    `responder` construye las respuestas propias (Response de DRF o, en las
+    vistas async, cache_http.respuesta_json).
+
+    - Reintento de una petición terminada: se devuelve la respuesta guardada.
+    - Reintento mientras la primera sigue en curso (OCR lento): 409 en el acto,
+      con Retry-After (CUENTAKM_IDEMPOTENCIA_RETRY_AFTER). Esperar aquí
+      ocuparía un worker por cada reintento del móvil.
+    - Misma clave con otra petición (otro comercial, tipo o foto): 422.
+    - Errores 5xx no se guardan: la clave se libera y el reintento vuelve a procesar.
+    """
+    if len(clave) > MAX_LONGITUD_CLAVE:
+        return responder({"error": "Idempotency-Key demasiado larga"}, status=status.HTTP_400_BAD_REQUEST)
+
+    huella = huella_peticion(request)
+
+    while True:
+        propia, registro = _reclamar(clave, huella)
+        if propia:
+            break
+        if registro is None:
+            continue  # liberada justo ahora: se vuelve a intentar
+        if registro.huella != huella:
+            return responder(
+                {"error": "Idempotency-Key ya usada con otra petición"},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+        if registro.estado == ClaveIdempotencia.COMPLETADA:
+            return _repetir(registro, responder)
+        return responder(
+            {"error": "La petición original con esta Idempotency-Key sigue en curso"},
+            status=status.HTTP_409_CONFLICT,
+            headers={"Retry-After": str(getattr(settings, "CUENTAKM_IDEMPOTENCIA_RETRY_AFTER", 5))},
+        )
+
+    try:
+        respuesta = procesar()
+    except Exception:
+        ClaveIdempotencia.objects.filter(clave=clave).delete()
+        raise
+
+    if respuesta.status_code >= 500:
+        ClaveIdempotencia.objects.filter(clave=clave).delete()
+    else:
+        ClaveIdempotencia.objects.filter(clave=clave).update(
+            estado=ClaveIdempotencia.COMPLETADA,
+            http_status=respuesta.status_code,
+            respuesta=respuesta.data,
+            updated_at=timezone.now(),
+        )
+    return respuesta
@@ -0,0 +1,124 @@
+from django.db.models import Count, ExpressionWrapper, F, IntegerField, Max, Q
+
+from ..models import LecturaCuentaKM
+from .procesamiento import iso_week_year
+
+
+LIMITE_POR_DEFECTO = 500
+LIMITE_MAXIMO = 2000
+
+
+class ParametroInvalido(Exception):
+    pass
+
+
+# ============================================================
+# Informe semanal (km por comercial y semana, calculado en la BD)
+# ============================================================
+def _desde_semana(anio, semana):
+    return Q(anio__gt=anio) | Q(anio=anio, semana__gte=semana)
+
+
+def _hasta_semana(anio, semana):
+    return Q(anio__lt=anio) | Q(anio=anio, semana__lte=semana)
+
+
+def _despues_de(cursor):
+    anio, semana, comercial_id = cursor
+    return (
+        Q(anio__gt=anio)
+        | Q(anio=anio, semana__gt=semana)
+        | Q(anio=anio, semana=semana, comercial_id__gt=comercial_id)
+    )
+
+
+def lecturas_filtradas(desde=None, hasta=None, comercial_id=None, cursor=None, base=None):
+    """
+    Lecturas de las semanas ISO entre `desde` y `hasta` (fechas). Se filtra por
+    semana/año ISO, como se guardan, para que el inicio y el fin de una semana
+    nunca queden separados por el corte.
+    `cursor` = (anio, semana, comercial_id) de la última fila ya devuelta.
+    `base` permite partir de un queryset ya filtrado (p.ej. la selección del admin).
+    """
+    qs = LecturaCuentaKM.objects.all() if base is None else base
+    if comercial_id is not None:
+        qs = qs.filter(comercial_id=comercial_id)
+    if desde is not None:
+        semana, anio = iso_week_year(desde)
+        qs = qs.filter(_desde_semana(anio, semana))
+    if hasta is not None:
+        semana, anio = iso_week_year(hasta)
+        qs = qs.filter(_hasta_semana(anio, semana))
+    if cursor is not None:
+        qs = qs.filter(_despues_de(cursor))
+    return qs
+
+
+def informe_semanal_qs(**filtros):
+    """
+    Una fila por (comercial, año, semana) con los km de inicio y fin emparejados
+    por agregación condicional: un GROUP BY sobre LecturaCuentaKM, sin bucles
+    en Python ni consultas por comercial. Filtros: ver lecturas_filtradas.
+    """
+    qs = lecturas_filtradas(**filtros)
+
+    es_inicio = Q(tipo_lectura=LecturaCuentaKM.INICIO)
+    es_fin = Q(tipo_lectura=LecturaCuentaKM.FIN)
+
+    # Hay como mucho un inicio y un fin por semana (ver validar_nueva_lectura);
+    # si hubiera más, Max se queda con la lectura más alta del cuentakilómetros.
+    return (
+        qs.values("anio", "semana", "comercial_id", "comercial__nombre")
+        .annotate(
+            km_inicio=Max("kilometros", filter=es_inicio),
+            km_fin=Max("kilometros", filter=es_fin),
+            inicio_at=Max("created_at", filter=es_inicio),
+            fin_at=Max("created_at", filter=es_fin),
+            avisos_inicio=Count("id", filter=es_inicio & Q(inicio_no_cuadra=True)),
+            avisos_fin=Count("id", filter=es_fin & Q(fin_fuera_de_plazo=True)),
+        )
+        .annotate(kms=ExpressionWrapper(F("km_fin") - F("km_inicio"), output_field=IntegerField()))
+        .order_by("anio", "semana", "comercial_id")
+    )
+
+
+def _fila(r):
+    return {
+        "comercial": {"id": r["comercial_id"], "nombre": r["comercial__nombre"]},
+        "anio": r["anio"],
+        "semana": r["semana"],
+        "km_inicio": r["km_inicio"],
+        "km_fin": r["km_fin"],
+        "kms": r["kms"],
+        "cerrada": r["fin_at"] is not None,
+        "inicio_at": r["inicio_at"],
+        "fin_at": r["fin_at"],
+        "inicio_no_cuadra": r["avisos_inicio"] > 0,
+        "fin_fuera_de_plazo": r["avisos_fin"] > 0,
+    }
+
+
+def codificar_cursor(fila) -> str:
+    return f"{fila['anio']}-{fila['semana']}-{fila['comercial']['id']}"
+
+
+def decodificar_cursor(valor: str):
+    try:
+        anio, semana, comercial_id = (int(p) for p in valor.split("-"))
+    except ValueError:
+        raise ParametroInvalido("cursor inválido")
+    return anio, semana, comercial_id
+
+
+def pagina_informe_semanal(limite=LIMITE_POR_DEFECTO, **filtros):
+    """
+    Página del informe con paginación por clave (keyset): (filas, siguiente_cursor).
+    Se pide una fila de más para saber si hay página siguiente sin un COUNT.
+    """
+    limite = max(1, min(int(limite), LIMITE_MAXIMO))
+    filas = [_fila(r) for r in informe_semanal_qs(**filtros)[:limite + 1]]
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        siguiente = codificar_cursor(filas[-1])
+    return filas, siguiente
@@ -0,0 +1,167 @@
+import logging
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from ..models import EmailOutbox, LecturaCuentaKM
+from .outbox import retencion_error
+
+
+logger = logging.getLogger(__name__)
+
+CARPETA = "lecturas"  # upload_to de LecturaCuentaKM.imagen
+TAMANO_LOTE = 1000
+
+
+def _adjuntos_pendientes() -> set:
+    # fotos que aún tiene que leer la outbox; los emails en ERROR se pueden
+    # reencolar, pero solo durante CUENTAKM_OUTBOX_ERROR_RETENCION_DIAS
+    en_uso = Q(estado=EmailOutbox.PENDIENTE)
+    dias = retencion_error()
+    if dias > 0:
+        en_uso |= Q(estado=EmailOutbox.ERROR, created_at__gte=timezone.now() - timedelta(days=dias))
+    else:
+        en_uso |= Q(estado=EmailOutbox.ERROR)
+    nombres = set()
+    for adjuntos in EmailOutbox.objects.filter(en_uso).values_list("adjuntos", flat=True):
+        nombres.update(adjuntos or [])
+    return nombres
+
+
+def _fin_de_la_semana():
+    return LecturaCuentaKM.objects.filter(
+        comercial_id=OuterRef("comercial_id"),
+        anio=OuterRef("anio"),
+        semana=OuterRef("semana"),
+        tipo_lectura=LecturaCuentaKM.FIN,
+    )
+
+
+# ============================================================
+# Retención de fotos
+# ============================================================
+def caducar_fotos_antiguas(dias: int) -> int:
+    """
+    Desvincula (UPDATE imagen=NULL, miniatura=NULL) las fotos de lecturas
+    subidas hace más de `dias` días en semanas que nunca se cerraron (sin
+    lectura de fin). Las de semanas cerradas tienen su propia retención
+    (caducar_miniaturas_cerradas): la original ya se desvinculó al cerrarla.
+    Los ficheros quedan huérfanos y los borra barrer_huerfanos.
+    Con dias <= 0 no hace nada.
+    """
+    if dias <= 0:
+        return 0
+    pendientes = _adjuntos_pendientes()
+    return (
+        LecturaCuentaKM.objects
+        .filter(created_at__lt=timezone.now() - timedelta(days=dias))
+        .exclude(Exists(_fin_de_la_semana()))
+        .filter(Q(imagen__gt="") | Q(miniatura__gt=""))
+        .exclude(imagen__in=pendientes)
+        .exclude(miniatura__in=pendientes)
+        .update(imagen=None, miniatura=None)
+    )
+
+
+def caducar_miniaturas_cerradas(dias: int) -> int:
+    """
+    Desvincula las fotos que quedan (la miniatura y, si no se borró al cerrar,
+    la original) de las lecturas de semanas cerradas subidas hace más de
+    `dias` días: pasado ese plazo el admin ya no las necesita para revisar.
+    Igual que caducar_fotos_antiguas, respeta los adjuntos de la outbox y deja
+    los ficheros a barrer_huerfanos. Con dias <= 0 no hace nada.
+    """
+    if dias <= 0:
+        return 0
+    pendientes = _adjuntos_pendientes()
+    return (
+        LecturaCuentaKM.objects
+        .filter(created_at__lt=timezone.now() - timedelta(days=dias))
+        .filter(Exists(_fin_de_la_semana()))
+        .filter(Q(imagen__gt="") | Q(miniatura__gt=""))
+        .exclude(imagen__in=pendientes)
+        .exclude(miniatura__in=pendientes)
+        .update(imagen=None, miniatura=None)
+    )
+
+
+# ============================================================
+# Barrido de ficheros huérfanos
+# ============================================================
+def _recorrer(ruta):
+    with os.scandir(ruta) as entradas:
+        for entrada in entradas:
+            if entrada.is_dir(follow_symlinks=False):
+                yield from _recorrer(entrada.path)
+            elif entrada.is_file(follow_symlinks=False):
+                yield entrada
+
+
+def _referenciados(nombres) -> set:
+    # fotos originales y miniaturas (lecturas/foto_min.jpg) viven en la misma carpeta
+    referenciados = set()
+    for imagen, miniatura in (
+        LecturaCuentaKM.objects
+        .filter(Q(imagen__in=nombres) | Q(miniatura__in=nombres))
+        .values_list("imagen", "miniatura")
+    ):
+        referenciados.update((imagen, miniatura))
+    return referenciados & set(nombres)
+
+
+def barrer_huerfanos(gracia_minutos: int = 60, lote: int = TAMANO_LOTE, simular: bool = False) -> dict:
+    """
+    Recorre MEDIA_ROOT/lecturas/ y borra los ficheros que no referencia ninguna
+    LecturaCuentaKM.imagen o .miniatura (ni un email pendiente de la outbox).
+    Se comprueban en bloques de `lote` nombres: una consulta por bloque.
+    Los ficheros modificados hace menos de `gracia_minutos` se respetan: pueden
+    ser subidas cuya transacción aún no ha terminado.
+    Devuelve estadísticas: revisados, referenciados, borrados, bytes, errores.
+    """
+    raiz = os.fspath(settings.MEDIA_ROOT)
+    stats = {"revisados": 0, "referenciados": 0, "borrados": 0, "bytes": 0, "errores": 0}
+    carpeta = os.path.join(raiz, CARPETA)
+    if not os.path.isdir(carpeta):
+        return stats
+
+    limite = time.time() - gracia_minutos * 60
+    pendientes = _adjuntos_pendientes()
+
+    def procesar(bloque):
+        referenciados = _referenciados(list(bloque)) | (pendientes & bloque.keys())
+        stats["referenciados"] += len(referenciados)
+        for nombre, entrada in bloque.items():
+            if nombre in referenciados:
+                continue
+            try:
+                st = entrada.stat(follow_symlinks=False)
+                if st.st_mtime > limite:
+                    continue
+                if not simular:
+                    os.remove(entrada.path)
+            except FileNotFoundError:
+                continue
+            except OSError:
+                logger.exception("Error borrando archivo huérfano %s", nombre)
+                stats["errores"] += 1
+                continue
+            stats["borrados"] += 1
+            stats["bytes"] += st.st_size
+
+    bloque = {}
+    for entrada in _recorrer(carpeta):
+        # mismo formato que FieldFile.name: relativo a MEDIA_ROOT y con "/"
+        nombre = os.path.relpath(entrada.path, raiz).replace(os.sep, "/")
+        bloque[nombre] = entrada
+        stats["revisados"] += 1
+        if len(bloque) >= lote:
+            procesar(bloque)
+            bloque = {}
+    if bloque:
+        procesar(bloque)
+
+    return stats
@@ -0,0 +1,92 @@
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+
+from ..models import Comercial
+from .cola_ocr import encolar_lectura
+from .procesamiento import LecturaDuplicada, LecturaRechazada, crear_lectura, procesar_lectura
+
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================================
+# Subida por lotes (fotos recogidas por WhatsApp en la oficina)
+# ============================================================
+# Cada elemento sigue el mismo camino que POST /api/lecturas/ (alta con el
+# estado bloqueado, OCR, reglas de semana). Los de un mismo comercial van en
+# orden y en el mismo hilo (el fin necesita los km del inicio); los de
+# comerciales distintos, en paralelo en un pool acotado, así que un lote
+# tarda lo que las llamadas de OCR más lentas y no la suma de todas.
+
+def _procesar_elemento(elemento, asincrono):
+    """
+    Devuelve (http_status, data) igual que la API para una lectura suelta.
+    """
+    if elemento.get("error"):
+        return 400, {"error": elemento["error"]}
+
+    try:
+        lectura = crear_lectura(elemento["comercial_id"], elemento["tipo_lectura"], elemento["imagen"])
+    except Comercial.DoesNotExist:
+        return 404, {"error": "Comercial no encontrado"}
+    except LecturaDuplicada as e:
+        return 409, {"error": str(e)}
+    except LecturaRechazada as e:
+        return 400, {"error": str(e)}
+
+    if asincrono:
+        trabajo = encolar_lectura(lectura)
+        return 202, {"job_id": str(trabajo.clave), "estado": trabajo.estado}
+
+    return procesar_lectura(lectura)
+
+
+def _procesar_comercial(elementos, asincrono):
+    resultados = []
+    try:
+        for indice, elemento in elementos:
+            try:
+                codigo, data = _procesar_elemento(elemento, asincrono)
+            except Exception as e:
+                logger.exception("[LOTE] Error procesando el elemento %s", indice)
+                codigo, data = 500, {"error": str(e)}
+            resultados.append((indice, elemento, codigo, data))
+    finally:
+        # cada hilo del pool abre su propia conexión; la cerramos al terminar
+        connection.close()
+    return resultados
+
+
+def procesar_lote(elementos, asincrono: bool = False, hilos: int = None):
+    """
+    `elementos`: lista de dicts con comercial_id, tipo_lectura e imagen (o
+    `error` si ya venía mal en la petición). Devuelve una lista de resultados
+    en el mismo orden: {indice, comercial_id, tipo_lectura, status, resultado|error}.
+    """
+    por_comercial = OrderedDict()
+    for indice, elemento in enumerate(elementos):
+        por_comercial.setdefault(str(elemento.get("comercial_id")), []).append((indice, elemento))
+
+    hilos = hilos or getattr(settings, "CUENTAKM_LOTE_HILOS", 8)
+    with ThreadPoolExecutor(max_workers=max(1, min(hilos, len(por_comercial)))) as pool:
+        grupos = pool.map(lambda grupo: _procesar_comercial(grupo, asincrono), por_comercial.values())
+        planos = [r for grupo in grupos for r in grupo]
+
+    resultados = []
+    for indice, elemento, codigo, data in sorted(planos, key=lambda r: r[0]):
+        fila = {
+            "indice": indice,
+            "comercial_id": elemento.get("comercial_id"),
+            "tipo_lectura": elemento.get("tipo_lectura"),
+            "status": codigo,
+        }
+        if codigo >= 400:
+            fila["error"] = data.get("error")
+        else:
+            fila["resultado"] = data
+        resultados.append(fila)
+    return resultados
@@ -0,0 +1,219 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+# ============================================================
+# Contadores e histogramas en memoria (por proceso)
+# ============================================================
+# Con varios workers de gunicorn cada uno tiene los suyos: /metrics devuelve
+# los del worker que atiende el scrape (Prometheus los suma por instancia).
+_lock = threading.Lock()
+_contadores = defaultdict(int)  # (nombre, etiquetas) -> n
+_histogramas = {}               # (nombre, etiquetas) -> _Histograma
+
+PREFIJO = "cuentakm_"
+
+# Límites superiores de las cubetas (el +Inf va implícito)
+CUBETAS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+CUBETAS_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 250)
+
+
+def _clave(nombre: str, etiquetas) -> tuple:
+    return nombre, tuple(sorted((etiquetas or {}).items()))
+
+
+def incrementar(nombre: str, n: int = 1, etiquetas: dict = None):
+    with _lock:
+        _contadores[_clave(nombre, etiquetas)] += n
+
+
+def valor(nombre: str, etiquetas: dict = None) -> int:
+    with _lock:
+        return _contadores[_clave(nombre, etiquetas)]
+
+
+def snapshot() -> dict:
+    """
+    Copia de todos los contadores (para volcarlos en logs o exponerlos).
+    Los que tienen etiquetas aparecen como 'nombre{etiqueta="valor"}'.
+    """
+    with _lock:
+        return {nombre + _formatear_etiquetas(etiquetas): n for (nombre, etiquetas), n in _contadores.items()}
+
+
+class _Histograma:
+    __slots__ = ("limites", "cubetas", "suma", "cuenta")
+
+    def __init__(self, limites):
+        self.limites = limites
+        self.cubetas = [0] * len(limites)
+        self.suma = 0.0
+        self.cuenta = 0
+
+    def observar(self, valor):
+        for i, limite in enumerate(self.limites):
+            if valor <= limite:
+                self.cubetas[i] += 1
+                break
+        self.suma += valor
+        self.cuenta += 1
+
+
+def observar(nombre: str, valor: float, etiquetas: dict = None, cubetas=CUBETAS_SEGUNDOS):
+    """
+    Añade una observación al histograma `nombre`. Las cubetas se fijan con
+    la primera observación de cada serie.
+    """
+    clave = _clave(nombre, etiquetas)
+    with _lock:
+        histograma = _histogramas.get(clave)
+        if histograma is None:
+            histograma = _histogramas[clave] = _Histograma(cubetas)
+        histograma.observar(valor)
+
+
+def reiniciar():
+    """
+    Pone todo a cero (tests y benchmarks).
+    """
+    with _lock:
+        _contadores.clear()
+        _histogramas.clear()
+
+
+# ============================================================
+# Tiempos por etapa de la petición en curso (cabecera Server-Timing)
+# ============================================================
+# MetricasMiddleware abre una _Peticion en un ContextVar; asgiref copia el
+# contexto a los hilos de sync_to_async, así que las etapas y las consultas
+# de las vistas async también se apuntan en la petición que las origina.
+class _Peticion:
+    __slots__ = ("etapas", "consultas", "segundos_bd")
+
+    def __init__(self):
+        self.etapas = defaultdict(float)  # etapa -> segundos
+        self.consultas = 0
+        self.segundos_bd = 0.0
+
+
+_peticion_actual = ContextVar("cuentakm_peticion", default=None)
+
+
+def iniciar_peticion():
+    """
+    Devuelve (peticion, token); el token es para terminar_peticion().
+    """
+    peticion = _Peticion()
+    return peticion, _peticion_actual.set(peticion)
+
+
+def terminar_peticion(token):
+    _peticion_actual.reset(token)
+
+
+@contextmanager
+def cronometro(etapa: str):
+    """
+    Mide el bloque: va al histograma etapa_segundos{etapa=...} y, dentro de
+    una petición, a su cabecera Server-Timing.
+    """
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        segundos = time.perf_counter() - t0
+        observar("etapa_segundos", segundos, {"etapa": etapa})
+        peticion = _peticion_actual.get()
+        if peticion is not None:
+            peticion.etapas[etapa] += segundos
+
+
+def contar_consulta(execute, sql, params, many, context):
+    """
+    Envoltorio de cursor (connection.execute_wrappers, ver signals.py):
+    cuenta las consultas SQL de la petición en curso y su tiempo.
+    """
+    peticion = _peticion_actual.get()
+    if peticion is None:
+        return execute(sql, params, many, context)
+    t0 = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        peticion.consultas += 1
+        peticion.segundos_bd += time.perf_counter() - t0
+
+
+def cabecera_server_timing(peticion, total_segundos: float) -> str:
+    partes = [f"{etapa};dur={1000 * segundos:.1f}" for etapa, segundos in peticion.etapas.items()]
+    partes.append(f'db;dur={1000 * peticion.segundos_bd:.1f};desc="{peticion.consultas} consultas"')
+    partes.append(f"total;dur={1000 * total_segundos:.1f}")
+    return ", ".join(partes)
+
+
+# ============================================================
+# Formato de exposición de Prometheus (texto 0.0.4)
+# ============================================================
+CONTENT_TYPE_PROMETHEUS = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _formatear_etiquetas(etiquetas, extra=()) -> str:
+    pares = list(etiquetas) + list(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in pares) + "}"
+
+
+def _numero(valor) -> str:
+    return repr(valor) if isinstance(valor, float) else str(valor)
+
+
+def exportar_prometheus(medidores=()) -> str:
+    """
+    Contadores (con sufijo _total) e histogramas en el formato de texto que
+    lee Prometheus. `medidores`: (nombre, etiquetas, valor) calculados en el
+    momento (gauges), p.ej. a partir de la BD.
+    """
+    with _lock:
+        contadores = sorted(_contadores.items())
+        histogramas = sorted(
+            (clave, (h.limites, list(h.cubetas), h.suma, h.cuenta)) for clave, h in _histogramas.items()
+        )
+
+    lineas = []
+    anterior = None
+    for (nombre, etiquetas), n in contadores:
+        metrica = f"{PREFIJO}{nombre}_total"
+        if metrica != anterior:
+            lineas.append(f"# TYPE {metrica} counter")
+            anterior = metrica
+        lineas.append(f"{metrica}{_formatear_etiquetas(etiquetas)} {n}")
+
+    for (nombre, etiquetas), (limites, cubetas, suma, cuenta) in histogramas:
+        metrica = f"{PREFIJO}{nombre}"
+        if metrica != anterior:
+            lineas.append(f"# TYPE {metrica} histogram")
+            anterior = metrica
+        acumulado = 0
+        for limite, n in zip(limites, cubetas):
+            acumulado += n
+            lineas.append(f"{metrica}_bucket{_formatear_etiquetas(etiquetas, [('le', _numero(limite))])} {acumulado}")
+        lineas.append(f"{metrica}_bucket{_formatear_etiquetas(etiquetas, [('le', '+Inf')])} {cuenta}")
+        lineas.append(f"{metrica}_sum{_formatear_etiquetas(etiquetas)} {_numero(suma)}")
+        lineas.append(f"{metrica}_count{_formatear_etiquetas(etiquetas)} {cuenta}")
+
+    for (nombre, etiquetas), valor in sorted((_clave(n, e), v) for n, e, v in medidores):
+        metrica = f"{PREFIJO}{nombre}"
+        if metrica != anterior:
+            lineas.append(f"# TYPE {metrica} gauge")
+            anterior = metrica
+        lineas.append(f"{metrica}{_formatear_etiquetas(etiquetas)} {_numero(valor)}")
+
+    return "\n".join(lineas) + "\n"
@@ -0,0 +1,72 @@
+import io
+import logging
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+
+logger = logging.getLogger(__name__)
+
+
+def _lado():
+    return getattr(settings, "CUENTAKM_MINIATURA_LADO", 480)
+
+
+def _calidad():
+    return getattr(settings, "CUENTAKM_MINIATURA_CALIDAD", 70)
+
+
+def nombre_miniatura(nombre_imagen: str) -> str:
+    # junto a la original: lecturas/foto.jpg -> lecturas/foto_min.jpg
+    base, _ = os.path.splitext(nombre_imagen)
+    return f"{base}_min.jpg"
+
+
+def miniatura_jpeg(origen) -> bytes:
+    """
+    JPEG reducido (lado mayor CUENTAKM_MINIATURA_LADO, orientación EXIF
+    aplicada) de `origen` (ruta o fichero abierto). Con ~480 px el
+    cuentakilómetros sigue siendo legible y pesa decenas de KB, no MB.
+    """
+    with Image.open(origen) as img:
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((_lado(), _lado()), Image.LANCZOS)
+        out = io.BytesIO()
+        img.convert("RGB").save(out, format="JPEG", quality=_calidad(), optimize=True)
+    return out.getvalue()
+
+
+def generar_miniatura(lectura) -> bool:
+    """
+    Genera y asigna `lectura.miniatura` si tiene foto y aún no la tiene.
+    No guarda el registro (quien llama incluye "miniatura" en update_fields).
+    Devuelve True si la ha generado; un fallo se registra y no interrumpe
+    el procesamiento de la lectura.
+    """
+    if lectura.miniatura or not lectura.imagen:
+        return False
+    try:
+        with default_storage.open(lectura.imagen.name, "rb") as f:
+            contenido = miniatura_jpeg(f)
+        lectura.miniatura.name = default_storage.save(
+            nombre_miniatura(lectura.imagen.name), ContentFile(contenido)
+        )
+    except Exception:
+        logger.exception("No se pudo generar la miniatura de %s", lectura.imagen.name)
+        return False
+    return True
+
+
+def foto_para_adjuntar(lectura):
+    """
+    FieldFile a usar en emails y vistas previas: la miniatura si existe,
+    si no la original. None si no queda ninguna.
+    """
+    if lectura.miniatura and lectura.miniatura.name:
+        return lectura.miniatura
+    if lectura.imagen and lectura.imagen.name:
+        return lectura.imagen
+    return None
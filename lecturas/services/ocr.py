@@ -0,0 +1,246 @@
+import logging
+import re
+from collections import namedtuple
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import metricas
+from .cache_ocr import clave_cache_ocr_fichero, get_cache_ocr
+from .openai_km import aleer_km_openai, leer_km_openai, version_ocr
+
+
+logger = logging.getLogger(__name__)
+
+
+ResultadoOCR = namedtuple("ResultadoOCR", ["km", "confianza", "texto", "backend"])
+
+
+# ============================================================
+# Backends de OCR
+# ============================================================
+class BackendOCR:
+    """
+    Interfaz de los backends de OCR (se eligen con CUENTAKM_OCR_BACKEND).
+    `leer` devuelve un ResultadoOCR o lanza Exception si no puede leer los km.
+    `version` identifica todo lo que influye en el resultado (clave de caché).
+    """
+    nombre = ""
+
+    def version(self, perfil: str = None) -> str:
+        raise NotImplementedError
+
+    def leer(self, ruta_imagen: str, perfil: str = None) -> ResultadoOCR:
+        raise NotImplementedError
+
+    async def aleer(self, ruta_imagen: str, perfil: str = None) -> ResultadoOCR:
+        """
+        Para las vistas async. Por defecto `leer` en un hilo aparte (válido
+        para backends que solo usan CPU); los que esperan a la red o usan la
+        BD lo sobrescriben.
+        """
+        return await sync_to_async(self.leer, thread_sensitive=False)(ruta_imagen, perfil)
+
+
+class OpenAIBackend(BackendOCR):
+    """
+    Modelo de visión remoto (ver openai_km.py).
+    """
+    nombre = "openai"
+
+    def version(self, perfil=None):
+        return f"openai|{version_ocr(perfil)}"
+
+    def leer(self, ruta_imagen, perfil=None):
+        km, texto = leer_km_openai(ruta_imagen, perfil)
+        return ResultadoOCR(km, 1.0, texto, self.nombre)
+
+    async def aleer(self, ruta_imagen, perfil=None):
+        km, texto = await aleer_km_openai(ruta_imagen, perfil)
+        return ResultadoOCR(km, 1.0, texto, self.nombre)
+
+
+class LocalBackend(BackendOCR):
+    """
+    Reconocedor local de 7 segmentos (ver ocr_local.py). Sin red ni coste,
+    pero solo fiable con displays digitales limpios: por debajo de
+    CUENTAKM_OCR_LOCAL_CONFIANZA se considera que no ha podido leer.
+    """
+    nombre = "local"
+    VERSION = "local|v1"
+
+    def version(self, perfil=None):
+        return self.VERSION
+
+    def umbral(self) -> float:
+        return getattr(settings, "CUENTAKM_OCR_LOCAL_CONFIANZA", 0.85)
+
+    def reconocer(self, ruta_imagen) -> ResultadoOCR:
+        # import diferido: numpy solo hace falta si se usa el reconocedor local
+        from .ocr_local import reconocer_km
+
+        km, confianza, texto = reconocer_km(ruta_imagen)
+        return ResultadoOCR(km, confianza, texto, self.nombre)
+
+    def leer(self, ruta_imagen, perfil=None):
+        resultado = self.reconocer(ruta_imagen)
+        if resultado.km is None or resultado.confianza < self.umbral():
+            raise Exception(
+                f"Lectura local poco fiable (confianza {resultado.confianza:.2f}, texto {resultado.texto!r})"
+            )
+        return resultado
+
+
+class LocalConRespaldoBackend(BackendOCR):
+    """
+    Primero el reconocedor local; solo si su confianza es baja se llama al
+    modelo remoto. La mayoría de cuentakilómetros digitales se resuelven en
+    milisegundos y sin coste de API.
+    """
+    nombre = "local+openai"
+
+    def __init__(self):
+        self.local = LocalBackend()
+        self.remoto = OpenAIBackend()
+
+    def version(self, perfil=None):
+        return f"{self.local.version(perfil)}+{self.remoto.version(perfil)}"
+
+    def _local(self, ruta_imagen):
+        try:
+            resultado = self.local.reconocer(ruta_imagen)
+        except Exception:
+            logger.exception("[OCR] Error en el reconocedor local")
+            return None
+
+        if resultado.km is not None and resultado.confianza >= self.local.umbral():
+            metricas.incrementar("ocr_local_resueltas")
+            return resultado
+        return None
+
+    def leer(self, ruta_imagen, perfil=None):
+        resultado = self._local(ruta_imagen)
+        if resultado is not None:
+            return resultado
+        metricas.incrementar("ocr_local_respaldo_remoto")
+        return self.remoto.leer(ruta_imagen, perfil)
+
+    async def aleer(self, ruta_imagen, perfil=None):
+        resultado = await sync_to_async(self._local, thread_sensitive=False)(ruta_imagen)
+        if resultado is not None:
+            return resultado
+        metricas.incrementar("ocr_local_respaldo_remoto")
+        return await self.remoto.aleer(ruta_imagen, perfil)
+
+
+class FakeBackend(BackendOCR):
+    """
+    Para tests y desarrollo sin API key: devuelve el último grupo de 3-8
+    dígitos del nombre del fichero o, si no hay, CUENTAKM_OCR_FAKE_KM.
+    """
+    nombre = "fake"
+
+    def version(self, perfil=None):
+        return "fake"
+
+    def leer(self, ruta_imagen, perfil=None):
+        grupos = re.findall(r"\d{3,8}", Path(ruta_imagen).stem)
+        km = int(grupos[-1]) if grupos else int(getattr(settings, "CUENTAKM_OCR_FAKE_KM", 100000))
+        return ResultadoOCR(km, 1.0, str(km), self.nombre)
+
+
+BACKENDS_OCR = {
+    OpenAIBackend.nombre: OpenAIBackend,
+    LocalBackend.nombre: LocalBackend,
+    LocalConRespaldoBackend.nombre: LocalConRespaldoBackend,
+    FakeBackend.nombre: FakeBackend,
+}
+
+_instancias = {}
+
+
+def get_backend_ocr(nombre: str = None) -> BackendOCR:
+    """
+    Backend configurado en CUENTAKM_OCR_BACKEND: "openai", "local",
+    "local+openai", "fake" o una ruta 'paquete.modulo.Clase' a uno propio.
+    """
+    nombre = nombre or getattr(settings, "CUENTAKM_OCR_BACKEND", OpenAIBackend.nombre)
+    if nombre not in _instancias:
+        clase = BACKENDS_OCR.get(nombre) or import_string(nombre)
+        _instancias[nombre] = clase()
+    return _instancias[nombre]
+
+
+# ============================================================
+# API pública
+# ============================================================
+def _leer_cache(cache, clave):
+    try:
+        hit = cache.get(clave)
+    except Exception:
+        logger.exception("[OCR] Error leyendo la caché de OCR")
+        hit = None
+    metricas.incrementar("ocr_cache_hits" if hit is not None else "ocr_cache_misses")
+    return hit
+
+
+def _guardar_cache(cache, clave, resultado):
+    try:
+        cache.set(clave, resultado.km, resultado.texto)
+    except Exception:
+        logger.exception("[OCR] Error guardando en la caché de OCR")
+
+
+def extraer_km_desde_imagen(ruta_imagen: str, perfil: str = None) -> int:
+    """
+    Lee los km de la foto del cuentakilómetros con el backend configurado y
+    devuelve SOLO un int con los km.
+
+    Resultado cacheado por hash de la foto: los reintentos del móvil con la
+    misma imagen no vuelven a pasar por el OCR.
+    """
+    backend = get_backend_ocr()
+
+    # sin caché no se lee la foto entera solo para calcular el hash
+    cache = get_cache_ocr()
+    if cache is not None:
+        clave = clave_cache_ocr_fichero(ruta_imagen, backend.version(perfil))
+        hit = _leer_cache(cache, clave)
+        if hit is not None:
+            return hit["km"]
+
+    # solo el backend (local y/o remoto): los aciertos de caché no cuentan
+    with metricas.cronometro("ocr"):
+        resultado = backend.leer(ruta_imagen, perfil)
+
+    if cache is not None:
+        _guardar_cache(cache, clave, resultado)
+
+    return resultado.km
+
+
+async def aextraer_km_desde_imagen(ruta_imagen: str, perfil: str = None) -> int:
+    """
+    Versión async de extraer_km_desde_imagen (vistas async): misma caché,
+    con el OCR vía `backend.aleer`.
+    """
+    backend = get_backend_ocr()
+
+    cache = get_cache_ocr()
+    if cache is not None:
+        clave = await sync_to_async(clave_cache_ocr_fichero, thread_sensitive=False)(
+            ruta_imagen, backend.version(perfil)
+        )
+        hit = await sync_to_async(_leer_cache)(cache, clave)
+        if hit is not None:
+            return hit["km"]
+
+    with metricas.cronometro("ocr"):
+        resultado = await backend.aleer(ruta_imagen, perfil)
+
+    if cache is not None:
+        await sync_to_async(_guardar_cache)(cache, clave, resultado)
+
+    return resultado.km
@@ -0,0 +1,172 @@
+import numpy as np
+from PIL import Image, ImageOps
+
+
+# ============================================================
+# Reconocedor local de displays de 7 segmentos
+# ============================================================
+# Pensado para cuentakilómetros digitales "limpios": binariza la foto, busca
+# la franja horizontal con una fila de dígitos, separa los dígitos por
+# columnas vacías y compara cada uno con plantillas de 7 segmentos.
+# No sustituye al modelo: devuelve una confianza y, si es baja, el backend
+# "local+openai" pregunta al remoto.
+
+ANCHO_TRABAJO = 640           # px: se reduce la foto a este ancho antes de analizar
+PROPORCION_DIGITO = 0.55      # ancho/alto típico de un dígito de 7 segmentos
+MIN_DIGITOS = 4
+MAX_DIGITOS = 8
+UMBRAL_SEGMENTO = 0.3         # fracción de tinta para dar un segmento por encendido
+
+#   aaa
+#  f   b
+#   ggg
+#  e   c
+#   ddd
+SEGMENTOS_POR_DIGITO = {
+    0: "abcdef",
+    1: "bc",
+    2: "abdeg",
+    3: "abcdg",
+    4: "bcfg",
+    5: "acdfg",
+    6: "acdefg",
+    7: "abc",
+    8: "abcdefg",
+    9: "abcdfg",
+}
+
+# Zona (filas y columnas, en fracción del recorte) donde se mira cada segmento.
+# Se evitan las esquinas, que comparten tinta entre segmentos.
+ZONAS_SEGMENTO = {
+    "a": ((0.00, 0.20), (0.25, 0.75)),
+    "g": ((0.40, 0.60), (0.25, 0.75)),
+    "d": ((0.80, 1.00), (0.25, 0.75)),
+    "f": ((0.15, 0.40), (0.00, 0.30)),
+    "b": ((0.15, 0.40), (0.70, 1.00)),
+    "e": ((0.60, 0.85), (0.00, 0.30)),
+    "c": ((0.60, 0.85), (0.70, 1.00)),
+}
+
+# Plantillas: vector encendido/apagado de los 7 segmentos por dígito
+ORDEN_SEGMENTOS = "abcdefg"
+PLANTILLAS = {
+    d: np.array([seg in segs for seg in ORDEN_SEGMENTOS]) for d, segs in SEGMENTOS_POR_DIGITO.items()
+}
+
+
+def _binarizar(gris: np.ndarray) -> np.ndarray:
+    """
+    Umbral de Otsu. Devuelve una máscara True = tinta (dígito), asumiendo que
+    los dígitos ocupan menos superficie que el fondo (sirve para LCD claro
+    sobre oscuro y al revés).
+    """
+    hist = np.bincount(gris.ravel(), minlength=256).astype(np.float64)
+    total = gris.size
+    pesos = np.cumsum(hist)
+    medias = np.cumsum(hist * np.arange(256))
+    media_total = medias[-1]
+
+    fondo = pesos[:-1]
+    frente = total - fondo
+    valido = (fondo > 0) & (frente > 0)
+    varianza = np.zeros(255)
+    varianza[valido] = (
+        (media_total * fondo[valido] / total - medias[:-1][valido]) ** 2
+        / (fondo[valido] * frente[valido])
+    )
+    umbral = int(np.argmax(varianza))
+
+    mascara = gris > umbral
+    if mascara.mean() > 0.5:
+        mascara = ~mascara
+    return mascara
+
+
+def _tramos(perfil: np.ndarray, minimo: int = 1):
+    """
+    Tramos consecutivos donde `perfil` > 0, como (inicio, fin) semiabiertos.
+    """
+    activo = np.concatenate(([0], (perfil > 0).astype(np.int8), [0]))
+    cambios = np.flatnonzero(np.diff(activo))
+    return [(a, b) for a, b in zip(cambios[::2], cambios[1::2]) if b - a >= minimo]
+
+
+def _clasificar_digito(recorte: np.ndarray):
+    """
+    Devuelve (digito, confianza): mide la tinta en la zona de cada segmento y
+    compara el vector encendido/apagado con las plantillas. La confianza baja
+    si algún segmento está en el límite o si no coincide exactamente con
+    ninguna plantilla. Los "1" son estrechos: se alinean a la derecha de una
+    celda de ancho normal.
+    """
+    h, w = recorte.shape
+    ancho_celda = int(h * PROPORCION_DIGITO)
+    if w < ancho_celda * 0.45:
+        celda = np.zeros((h, max(ancho_celda, w)), dtype=bool)
+        celda[:, celda.shape[1] - w:] = recorte
+        recorte = celda
+        w = celda.shape[1]
+
+    encendidos = []
+    claridad = []
+    for seg in ORDEN_SEGMENTOS:
+        (f0, f1), (c0, c1) = ZONAS_SEGMENTO[seg]
+        zona = recorte[int(f0 * h):max(int(f1 * h), int(f0 * h) + 1), int(c0 * w):max(int(c1 * w), int(c0 * w) + 1)]
+        tinta = float(zona.mean())
+        encendidos.append(tinta >= UMBRAL_SEGMENTO)
+        claridad.append(min(1.0, abs(tinta - UMBRAL_SEGMENTO) / UMBRAL_SEGMENTO))
+
+    vector = np.array(encendidos)
+    distancia, digito = min((int((vector != t).sum()), d) for d, t in PLANTILLAS.items())
+    confianza = float(np.mean(claridad)) * (0.5 ** distancia)
+    return digito, confianza
+
+
+def _leer_fila(mascara: np.ndarray):
+    alto = mascara.shape[0]
+    columnas = _tramos(mascara.sum(axis=0), minimo=max(1, alto // 20))
+    if not (MIN_DIGITOS <= len(columnas) <= MAX_DIGITOS * 2):
+        return None, 0.0
+
+    digitos = []
+    confianzas = []
+    for x0, x1 in columnas:
+        # se clasifica con el alto de toda la fila: un "1" de 7 segmentos no
+        # tiene tinta arriba ni abajo y recortarlo descuadraría las zonas
+        recorte = mascara[:, x0:x1]
+        filas = np.flatnonzero(recorte.any(axis=1))
+        if filas[-1] - filas[0] + 1 < alto * 0.6:
+            # ruido (puntos, separadores...): se ignora pero penaliza
+            confianzas.append(0.5)
+            continue
+        d, c = _clasificar_digito(recorte)
+        digitos.append(str(d))
+        confianzas.append(c)
+
+    if not (MIN_DIGITOS <= len(digitos) <= MAX_DIGITOS):
+        return None, 0.0
+    return "".join(digitos), min(confianzas)
+
+
+def reconocer_km(origen):
+    """
+    Intenta leer el odómetro de una foto (ruta o fichero) sin llamar a nadie.
+    Devuelve (km, confianza 0..1, texto); km es None si no encuentra una fila
+    de dígitos plausible.
+    """
+    img = Image.open(origen)
+    img.draft("L", (ANCHO_TRABAJO * 2, ANCHO_TRABAJO * 2))
+    img = ImageOps.exif_transpose(img).convert("L")
+    if img.width > ANCHO_TRABAJO:
+        img = img.resize((ANCHO_TRABAJO, max(1, round(img.height * ANCHO_TRABAJO / img.width))))
+
+    mascara = _binarizar(np.asarray(img))
+
+    mejor = (None, 0.0, "")
+    alto_min = max(8, mascara.shape[0] // 30)
+    for y0, y1 in _tramos(mascara.sum(axis=1), minimo=alto_min):
+        texto, confianza = _leer_fila(mascara[y0:y1])
+        if texto and confianza > mejor[1]:
+            mejor = (int(texto), confianza, texto)
+
+    return mejor
@@ -1,17 +1,154 @@
+import asyncio
 import base64
+import importlib
+import io
+import logging
 import os
 import re
-from pathlib import Path
+import threading
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from . import metricas
+from .resiliencia import allamar_con_proteccion, llamar_con_proteccion
+
+
+logger = logging.getLogger(__name__)
 
-from dotenv import load_dotenv
 
 # ============================================================
-# Cargar .env
+# Configuración (se lee de settings al usarla, no al importar)
 # ============================================================
-ENV_PATH = Path(__file__).resolve().parent.parent.parent / ".env"
-load_dotenv(dotenv_path=ENV_PATH)
+def _conf(nombre, defecto=None):
+    return getattr(settings, f"CUENTAKM_OCR_{nombre}", defecto)
+
+
+def perfil_por_defecto() -> str:
+    return _conf("PERFIL", "equilibrado")
+
+# Si cambian modelo o prompt, subir PROMPT_VERSION invalida la caché de OCR
+MODELO_RESPONSES = "gpt-4.1-mini"
+MODELO_LEGACY = "gpt-4o-mini"
+PROMPT_VERSION = "1"
+
+
+# ============================================================
+# Preprocesado de imagen (antes de mandarla al modelo)
+# ============================================================
+# Las fotos del móvil llegan con 4-12 MB; al modelo le basta con mucho menos
+# para leer un odómetro. Menos bytes => menos subida y menos tokens.
+#   max_lado: lado mayor en px tras redimensionar (None = sin redimensionar)
+#   modo:     "color" | "gris" | "contraste" (gris + autocontraste)
+#   formato:  "JPEG" | "WEBP"
+#   calidad:  calidad de recompresión
+PERFILES_PREPROCESADO = {
+    "original": None,  # se manda el fichero tal cual
+    "equilibrado": {"max_lado": 1600, "modo": "color", "formato": "JPEG", "calidad": 85},
+    "gris": {"max_lado": 1280, "modo": "gris", "formato": "JPEG", "calidad": 80},
+    "contraste": {"max_lado": 1280, "modo": "contraste", "formato": "JPEG", "calidad": 80},
+    "agresivo": {"max_lado": 1024, "modo": "contraste", "formato": "WEBP", "calidad": 70},
+}
+
+MIME_POR_FORMATO = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+def _perfil_activo(nombre: str = None):
+    por_defecto = perfil_por_defecto()
+    nombre = nombre or por_defecto
+    if nombre not in PERFILES_PREPROCESADO:
+        raise Exception(f"Perfil de preprocesado desconocido: {nombre!r}")
+    perfil = PERFILES_PREPROCESADO[nombre]
+    if perfil is None:
+        return None
+    perfil = dict(perfil)
+    # CUENTAKM_OCR_MAX_LADO / _CALIDAD sobrescriben los del perfil por defecto
+    if _conf("MAX_LADO") and nombre == por_defecto:
+        perfil["max_lado"] = int(_conf("MAX_LADO"))
+    if _conf("CALIDAD") and nombre == por_defecto:
+        perfil["calidad"] = int(_conf("CALIDAD"))
+    return perfil
+
+
+def preprocesar_imagen(origen, perfil: str = None):
+    """
+    Prepara la foto para el OCR:
+    - corrige la orientación EXIF (las fotos del móvil vienen "tumbadas")
+    - reduce el lado mayor a `max_lado`
+    - pasa a gris / aumenta contraste según el perfil
+    - recomprime en JPEG/WebP
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+    `origen` es la ruta del fichero o sus bytes. Devuelve (bytes, mime), o
+    (None, mime) si conviene mandar el original tal cual (perfil "original",
+    formato que no se puede abrir, o foto ya más pequeña que la recomprimida).
+    No toca el fichero original en disco: ese se sigue usando para los emails
+    a Administración.
+    """
+    conf = _perfil_activo(perfil)
+    if conf is None:
+        return None, "image/jpeg"
+
+    if isinstance(origen, (bytes, bytearray)):
+        tam_original = len(origen)
+        origen = io.BytesIO(origen)
+    else:
+        tam_original = os.path.getsize(origen)
+
+    max_lado = conf.get("max_lado")
+    modo = conf.get("modo", "color")
+
+    try:
+        img = Image.open(origen)
+        if max_lado:
+            # JPEG: decodifica directamente a escala reducida (1/2, 1/4, 1/8),
+            # sin llegar a tener en memoria los píxeles de la foto completa
+            img.draft("L" if modo in ("gris", "contraste") else "RGB", (max_lado, max_lado))
+        img = ImageOps.exif_transpose(img)
+    except Exception:
+        # formato raro: mejor mandarla tal cual que fallar la lectura
+        return None, "image/jpeg"
+
+    if max_lado and max(img.size) > max_lado:
+        img.thumbnail((max_lado, max_lado), Image.LANCZOS)
+
+    if modo == "gris":
+        img = img.convert("L")
+    elif modo == "contraste":
+        img = ImageOps.autocontrast(img.convert("L"), cutoff=1)
+    elif img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+
+    formato = conf.get("formato", "JPEG")
+    out = io.BytesIO()
+    img.save(out, format=formato, quality=conf.get("calidad", 85), optimize=True)
+    procesada = out.getvalue()
+
+    # Si por lo que sea la "optimizada" pesa más (foto ya pequeña), usamos la original
+    if len(procesada) >= tam_original:
+        return None, "image/jpeg"
+
+    return procesada, MIME_POR_FORMATO.get(formato, "image/jpeg")
+
+
+# Múltiplo de 3: cada bloque se codifica en base64 sin relleno intermedio
+BLOQUE_B64 = 3 * 64 * 1024
+
+
+def b64_desde_fichero(ruta: str) -> str:
+    """
+    Codifica en base64 leyendo el fichero por bloques: nunca están a la vez
+    en memoria los bytes completos de la foto y su copia en base64.
+    """
+    partes = []
+    with open(ruta, "rb") as f:
+        while True:
+            bloque = f.read(BLOQUE_B64)
+            if not bloque:
+                break
+            partes.append(base64.b64encode(bloque).decode("ascii"))
+    return "".join(partes)
 
 
 # ============================================================
@@ -32,12 +169,14 @@ def _normalizar_km(texto: str) -> int:
     """
 
     if not texto:
+        metricas.incrementar("ocr_normalizacion", etiquetas={"paso": "vacia"})
         raise Exception("Respuesta vacía del modelo.")
 
     t = texto.strip()
 
     # 1) Caso ideal: solo dígitos
     if re.fullmatch(r"\d{3,8}", t):
+        metricas.incrementar("ocr_normalizacion", etiquetas={"paso": "directo"})
         return int(t)
 
     # 2) Buscar patrones con separadores: 123.456 / 123 456 / 1,234,567
@@ -49,6 +188,7 @@ def _normalizar_km(texto: str) -> int:
         best = max(sep_pat, key=len)
         digits = re.sub(r"\D", "", best)
         if 3 <= len(digits) <= 8:
+            metricas.incrementar("ocr_normalizacion", etiquetas={"paso": "separadores"})
             return int(digits)
 
     # 3) Fallback: quedarnos con el número "más plausible"
@@ -56,104 +196,336 @@ def _normalizar_km(texto: str) -> int:
     # - priorizamos longitudes 4..8
     nums = re.findall(r"\d+", t)
     if not nums:
+        metricas.incrementar("ocr_normalizacion", etiquetas={"paso": "sin_numeros"})
         raise Exception(f"No se encontraron números en la respuesta: {texto!r}")
 
     candidates = [n for n in nums if 4 <= len(n) <= 8]
     if candidates:
         # si hay varios, nos quedamos con el más largo; empate => el mayor
         best = max(candidates, key=lambda x: (len(x), int(x)))
+        metricas.incrementar("ocr_normalizacion", etiquetas={"paso": "candidatos"})
         return int(best)
 
     # 4) Último recurso: si solo hay números cortos, cogemos el mayor (pero es menos fiable)
     best = max(nums, key=lambda x: int(x))
+    metricas.incrementar("ocr_normalizacion", etiquetas={"paso": "ultimo_recurso"})
     return int(best)
 
 
 # ============================================================
-# Cliente OpenAI: nuevo SDK si existe, si no, legacy
+# Cliente OpenAI: UNO por proceso, con pool de conexiones
 # ============================================================
-def _call_openai_vision(img_b64: str) -> str:
-    """
-    Devuelve texto del modelo con el km.
-    Compatible con openai>=1.0 (OpenAI client) y con legacy openai.ChatCompletion.
-    """
-    if not OPENAI_API_KEY:
-        raise Exception("OPENAI_API_KEY no está definido en el .env")
+# Antes se creaba un cliente (y una conexión TLS nueva) en cada petición y,
+# ante cualquier error (incluido un timeout), se repetía la llamada con el SDK
+# legacy: un fallo costaba dos llamadas remotas seguidas. Ahora el SDK se
+# elige UNA vez, según lo que haya instalado, y cada petición tiene su propio
+# timeout de conexión/lectura sin reintentos ocultos (los reintentos, con
+# espera exponencial, los decide resiliencia.py).
+PROMPT_SYSTEM = (
+    "Eres un sistema OCR especializado en leer CUENTAKILÓMETROS de coches/motos. "
+    "Devuelve SOLO el valor del odómetro como ENTERO (sin puntos, sin comas, sin espacios). "
+    "No devuelvas texto adicional."
+)
 
-    prompt_system = (
-        "Eres un sistema OCR especializado en leer CUENTAKILÓMETROS de coches/motos. "
-        "Devuelve SOLO el valor del odómetro como ENTERO (sin puntos, sin comas, sin espacios). "
-        "No devuelvas texto adicional."
-    )
+PROMPT_USER = (
+    "Lee el CUENTAKILÓMETROS (odómetro total) de la imagen y devuelve SOLO el número entero."
+)
 
-    prompt_user = (
-        "Lee el CUENTAKILÓMETROS (odómetro total) de la imagen y devuelve SOLO el número entero."
-    )
 
-    # ---- Intento SDK NUEVO (openai>=1.0) ----
-    try:
-        from openai import OpenAI
+def _base_url():
+    # OPENAI_BASE_URL apunta a un proxy o a un servidor falso (benchmark_carga);
+    # sin definir, la URL por defecto del SDK
+    return getattr(settings, "OPENAI_BASE_URL", None) or None
 
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        resp = client.responses.create(
-            model="gpt-4.1-mini",
-            input=[
-                {
-                    "role": "system",
-                    "content": prompt_system,
-                },
+
+def _entrada_responses(img_b64: str, mime: str) -> list:
+    return [
+        {
+            "role": "system",
+            "content": PROMPT_SYSTEM,
+        },
+        {
+            "role": "user",
+            "content": [
+                {"type": "input_text", "text": PROMPT_USER},
+                {"type": "input_image", "image_url": f"data:{mime};base64,{img_b64}"},
+            ],
+        },
+    ]
+
+
+def _mensajes_legacy(img_b64: str, mime: str) -> list:
+    return [
+        {"role": "system", "content": PROMPT_SYSTEM},
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": PROMPT_USER},
                 {
-                    "role": "user",
-                    "content": [
-                        {"type": "input_text", "text": prompt_user},
-                        {"type": "input_image", "image_base64": img_b64},
-                    ],
+                    "type": "image_url",
+                    "image_url": {"url": f"data:{mime};base64,{img_b64}"},
                 },
             ],
+        },
+    ]
+
+
+class _ClienteResponses:
+    """
+    SDK nuevo (openai>=1.0): cliente httpx persistente con keep-alive.
+    """
+
+    def __init__(self, openai_mod):
+        import httpx
+
+        pool = _conf("POOL", 10)
+        self.client = openai_mod.OpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            base_url=_base_url(),
+            max_retries=0,
+            timeout=httpx.Timeout(_conf("READ_TIMEOUT", 30.0), connect=_conf("CONNECT_TIMEOUT", 5.0)),
+            http_client=httpx.Client(
+                limits=httpx.Limits(max_connections=pool, max_keepalive_connections=pool),
+            ),
         )
+
+    def leer(self, img_b64: str, mime: str) -> str:
+        resp = self.client.responses.create(model=MODELO_RESPONSES, input=_entrada_responses(img_b64, mime))
         return (resp.output_text or "").strip()
 
-    except Exception:
-        # ---- Fallback LEGACY (openai<1.0) ----
-        import openai
-        openai.api_key = OPENAI_API_KEY
-
-        response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": prompt_system},
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt_user},
-                        {
-                            "type": "image_url",
-                            "image_url": {"url": f"data:image/jpeg;base64,{img_b64}"},
-                        },
-                    ],
-                },
-            ],
+
+class _ClienteLegacy:
+    """
+    SDK legacy (openai<1.0): una requests.Session compartida con pool de conexiones.
+    """
+
+    def __init__(self, openai_mod):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        pool = _conf("POOL", 10)
+        adapter = HTTPAdapter(pool_connections=pool, pool_maxsize=pool, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+        openai_mod.api_key = settings.OPENAI_API_KEY
+        if _base_url():
+            openai_mod.api_base = _base_url()
+        openai_mod.requestssession = session
+        self.openai = openai_mod
+        self.timeout = (_conf("CONNECT_TIMEOUT", 5.0), _conf("READ_TIMEOUT", 30.0))
+
+    def leer(self, img_b64: str, mime: str) -> str:
+        response = self.openai.ChatCompletion.create(
+            model=MODELO_LEGACY,
+            messages=_mensajes_legacy(img_b64, mime),
             temperature=0,
+            request_timeout=self.timeout,
         )
+        return response["choices"][0]["message"]["content"].strip()
+
 
+class _ClienteResponsesAsync:
+    """
+    SDK nuevo, para las vistas async: AsyncOpenAI con un httpx.AsyncClient.
+    """
+
+    def __init__(self, openai_mod):
+        import httpx
+
+        pool = _conf("POOL", 10)
+        self.client = openai_mod.AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            base_url=_base_url(),
+            max_retries=0,
+            timeout=httpx.Timeout(_conf("READ_TIMEOUT", 30.0), connect=_conf("CONNECT_TIMEOUT", 5.0)),
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=pool, max_keepalive_connections=pool),
+            ),
+        )
+
+    async def aleer(self, img_b64: str, mime: str) -> str:
+        resp = await self.client.responses.create(model=MODELO_RESPONSES, input=_entrada_responses(img_b64, mime))
+        return (resp.output_text or "").strip()
+
+
+class _ClienteLegacyAsync:
+    """
+    SDK legacy, para las vistas async: ChatCompletion.acreate sobre una
+    aiohttp.ClientSession propia con pool (sin ella, el SDK abre una sesión
+    y una conexión TLS nuevas en cada llamada).
+    """
+
+    def __init__(self, openai_mod):
+        import aiohttp
+
+        openai_mod.api_key = settings.OPENAI_API_KEY
+        if _base_url():
+            openai_mod.api_base = _base_url()
+        self.openai = openai_mod
+        self.sesion = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=_conf("POOL", 10)),
+            timeout=aiohttp.ClientTimeout(connect=_conf("CONNECT_TIMEOUT", 5.0)),
+        )
+        # el SDK legacy solo admite un timeout total por petición
+        self.timeout = _conf("CONNECT_TIMEOUT", 5.0) + _conf("READ_TIMEOUT", 30.0)
+
+    async def aleer(self, img_b64: str, mime: str) -> str:
+        token = self.openai.aiosession.set(self.sesion)
+        try:
+            response = await self.openai.ChatCompletion.acreate(
+                model=MODELO_LEGACY,
+                messages=_mensajes_legacy(img_b64, mime),
+                temperature=0,
+                request_timeout=self.timeout,
+            )
+        finally:
+            self.openai.aiosession.reset(token)
         return response["choices"][0]["message"]["content"].strip()
 
 
+_cliente = None
+_cliente_lock = threading.Lock()
+
+
+def get_cliente_ocr():
+    """
+    Cliente OCR del proceso. Se crea la primera vez (después del fork de
+    gunicorn, así cada worker tiene su propio pool) y se reutiliza siempre.
+    """
+    global _cliente
+    if _cliente is None:
+        with _cliente_lock:
+            if _cliente is None:
+                import openai
+
+                if hasattr(openai, "OpenAI"):
+                    _cliente = _ClienteResponses(openai)
+                else:
+                    _cliente = _ClienteLegacy(openai)
+    return _cliente
+
+
+# Las conexiones de un cliente async pertenecen a su bucle de eventos: uno por
+# bucle (con uvicorn, uno por worker).
+_clientes_async = weakref.WeakKeyDictionary()
+
+
+async def aget_cliente_ocr():
+    """
+    Cliente OCR async del bucle de eventos actual. Se crea la primera vez y
+    se reutiliza en todas las peticiones que atiende ese bucle.
+    """
+    bucle = asyncio.get_running_loop()
+    cliente = _clientes_async.get(bucle)
+    if cliente is None:
+        # el import del SDK (si no se ha precalentado) no bloquea el bucle
+        openai = await sync_to_async(importlib.import_module, thread_sensitive=False)("openai")
+        cliente = _clientes_async.get(bucle)
+        if cliente is None:
+            if hasattr(openai, "AsyncOpenAI"):
+                cliente = _ClienteResponsesAsync(openai)
+            else:
+                cliente = _ClienteLegacyAsync(openai)
+            _clientes_async[bucle] = cliente
+    return cliente
+
+
+def reiniciar_cliente_ocr():
+    """
+    Descarta los clientes creados (p.ej. tras cambiar OPENAI_BASE_URL en un
+    benchmark o un test): la siguiente lectura crea uno nuevo.
+    """
+    global _cliente
+    with _cliente_lock:
+        _cliente = None
+    _clientes_async.clear()
+
+
+def precalentar_cliente_ocr(en_hilo: bool = True):
+    """
+    Importa el SDK (~0,25 s) y crea el cliente antes de la primera lectura.
+    Con `en_hilo` no retrasa el arranque. Sin OPENAI_API_KEY no hace nada.
+    """
+    if not settings.OPENAI_API_KEY:
+        return
+
+    def calentar():
+        try:
+            get_cliente_ocr()
+        except Exception:
+            # no es grave: se reintentará en la primera lectura
+            logger.exception("No se pudo precalentar el cliente OCR")
+
+    if en_hilo:
+        threading.Thread(target=calentar, name="precalentar-ocr", daemon=True).start()
+    else:
+        calentar()
+
+
+def precalentar_al_servir():
+    """
+    Precalentado según CUENTAKM_OCR_PRECALENTAR ("hilo", "arranque" o "no").
+    Lo llaman config/wsgi.py, config/asgi.py y el worker de la cola: solo los
+    procesos que van a hacer OCR. Sin --preload, gunicorn importa el módulo WSGI en cada worker
+    ya forkeado, así que el cliente (y su pool de conexiones) es del worker.
+    """
+    modo = getattr(settings, "CUENTAKM_OCR_PRECALENTAR", "hilo")
+    if modo in ("hilo", "arranque"):
+        precalentar_cliente_ocr(en_hilo=(modo == "hilo"))
+
+
+def _call_openai_vision(img_b64: str, mime: str = "image/jpeg") -> str:
+    """
+    Devuelve texto del modelo con el km.
+    Compatible con openai>=1.0 (OpenAI client) y con legacy openai.ChatCompletion.
+    Límite de ritmo, reintentos y cortacircuitos compartidos: ver resiliencia.py
+    (lanza ServicioNoDisponible si el proveedor no responde).
+    """
+    if not settings.OPENAI_API_KEY:
+        raise Exception("OPENAI_API_KEY no está definido en el .env")
+
+    cliente = get_cliente_ocr()
+    return llamar_con_proteccion("openai", lambda: cliente.leer(img_b64, mime))
+
+
+async def _acall_openai_vision(img_b64: str, mime: str = "image/jpeg") -> str:
+    """
+    Como _call_openai_vision, sin bloquear el bucle de eventos mientras
+    responde el modelo.
+    """
+    if not settings.OPENAI_API_KEY:
+        raise Exception("OPENAI_API_KEY no está definido en el .env")
+
+    cliente = await aget_cliente_ocr()
+    return await allamar_con_proteccion("openai", lambda: cliente.aleer(img_b64, mime))
+
+
 # ============================================================
 # API pública
 # ============================================================
-def extraer_km_desde_imagen(ruta_imagen: str) -> int:
+def version_ocr(perfil: str = None) -> str:
     """
-    Abre la imagen del cuentakilómetros, la manda a OpenAI y devuelve
-    SOLO un int con los km.
+    Todo lo que influye en el resultado del OCR remoto (para la clave de caché),
+    con el preprocesado que de verdad se aplica: MAX_LADO/CALIDAD cambian el
+    perfil por defecto sin cambiar su nombre.
     """
-    with open(ruta_imagen, "rb") as f:
-        img_bytes = f.read()
+    nombre = perfil or perfil_por_defecto()
+    conf = _perfil_activo(nombre)
+    if conf is not None:
+        nombre += ":" + ",".join(f"{k}={conf[k]}" for k in sorted(conf))
+    return f"{MODELO_RESPONSES}|{MODELO_LEGACY}|p{PROMPT_VERSION}|{nombre}"
+
 
-    img_b64 = base64.b64encode(img_bytes).decode("utf-8")
+def _imagen_b64(ruta_imagen: str, perfil: str = None):
+    procesada, mime = preprocesar_imagen(ruta_imagen, perfil)
+    if procesada is None:
+        return b64_desde_fichero(ruta_imagen), mime
+    return base64.b64encode(procesada).decode("utf-8"), mime
 
-    texto = _call_openai_vision(img_b64)
 
+def _km_desde_texto(texto: str):
     km = _normalizar_km(texto)
 
     # Validación suave (ajusta si quieres):
@@ -161,4 +533,22 @@ def extraer_km_desde_imagen(ruta_imagen: str) -> int:
     if km < 0 or km > 9_999_999:
         raise Exception(f"KM fuera de rango: {km} (texto modelo: {texto!r})")
 
-    return km
+    return km, texto
+
+
+def leer_km_openai(ruta_imagen: str, perfil: str = None):
+    """
+    Preprocesa la foto (ver `preprocesar_imagen`), la manda a OpenAI y
+    devuelve (km, texto del modelo).
+    """
+    img_b64, mime = _imagen_b64(ruta_imagen, perfil)
+    return _km_desde_texto(_call_openai_vision(img_b64, mime))
+
+
+async def aleer_km_openai(ruta_imagen: str, perfil: str = None):
+    """
+    Versión async de leer_km_openai: el preprocesado (CPU) va a un hilo y la
+    llamada al modelo no ocupa ninguno.
+    """
+    img_b64, mime = await sync_to_async(_imagen_b64, thread_sensitive=False)(ruta_imagen, perfil)
+    return _km_desde_texto(await _acall_openai_vision(img_b64, mime))
@@ -0,0 +1,155 @@
+import logging
+import mimetypes
+import os
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from ..models import EmailOutbox, LecturaCuentaKM
+from . import metricas
+from .procesamiento import borrar_fotos
+
+
+logger = logging.getLogger(__name__)
+
+
+def retencion_error() -> int:
+    return getattr(settings, "CUENTAKM_OUTBOX_ERROR_RETENCION_DIAS", 14)
+
+
+def _backoff(intentos: int, base: int, maximo: int) -> timedelta:
+    """
+    Espera exponencial con jitter: base, 2*base, 4*base... hasta `maximo`.
+    """
+    segundos = min(maximo, base * (2 ** max(0, intentos - 1)))
+    return timedelta(seconds=segundos * random.uniform(0.8, 1.2))
+
+
+def _construir_email(msg, connection) -> EmailMessage:
+    email = EmailMessage(
+        subject=msg.asunto,
+        body=msg.cuerpo,
+        from_email=msg.remitente or None,
+        to=msg.destinatarios,
+        connection=connection,
+    )
+    # Los adjuntos se leen AHORA, no al encolar: la fila solo guarda el nombre
+    for nombre in msg.adjuntos:
+        try:
+            with default_storage.open(nombre, "rb") as f:
+                contenido = f.read()
+            mimetype = mimetypes.guess_type(nombre)[0] or "application/octet-stream"
+            email.attach(os.path.basename(nombre), contenido, mimetype)
+        except Exception:
+            logger.exception("No se pudo adjuntar %s", nombre)
+    return email
+
+
+def _borrar_adjuntos(msg):
+    # los adjuntos suelen ser miniaturas: se desvinculan las originales de esas
+    # lecturas (las miniaturas se conservan para el admin)
+    lecturas = LecturaCuentaKM.objects.filter(Q(imagen__in=msg.adjuntos) | Q(miniatura__in=msg.adjuntos))
+    borrar_fotos(list(lecturas.only("pk", "imagen")))
+
+
+def enviar_pendientes(limite: int = 100, max_intentos: int = 5, backoff_base: int = 60, backoff_max: int = 3600):
+    """
+    Envía los emails pendientes cuyo `proximo_intento` ya ha llegado, todos por
+    la MISMA conexión SMTP (un solo handshake TLS + login para todo el lote).
+    Devuelve (enviados, fallidos).
+    """
+    ahora = timezone.now()
+    pendientes = list(
+        EmailOutbox.objects
+        .filter(estado=EmailOutbox.PENDIENTE, proximo_intento__lte=ahora)
+        .order_by("created_at")[:limite]
+    )
+    if not pendientes:
+        return 0, 0
+
+    enviados = fallidos = 0
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+        for msg in pendientes:
+            try:
+                _construir_email(msg, connection).send(fail_silently=False)
+            except Exception as e:
+                logger.exception("[EMAIL] Error enviando outbox #%s", msg.pk)
+                fallidos += 1
+                metricas.incrementar("emails_fallidos")
+                msg.intentos += 1
+                msg.ultimo_error = str(e)
+                if msg.intentos >= max_intentos:
+                    msg.estado = EmailOutbox.ERROR
+                    metricas.incrementar("emails_descartados")
+                else:
+                    msg.proximo_intento = timezone.now() + _backoff(msg.intentos, backoff_base, backoff_max)
+                msg.save(update_fields=["intentos", "ultimo_error", "estado", "proximo_intento"])
+                # la conexión puede haber quedado rota: la reabrimos para el resto del lote
+                connection.close()
+                try:
+                    connection.open()
+                except Exception:
+                    logger.exception("[EMAIL] No se pudo reabrir la conexión SMTP; se reintentará luego")
+                    break
+                continue
+
+            enviados += 1
+            msg.estado = EmailOutbox.ENVIADO
+            msg.enviado_at = timezone.now()
+            msg.intentos += 1
+            msg.save(update_fields=["estado", "enviado_at", "intentos"])
+            if msg.borrar_adjuntos:
+                _borrar_adjuntos(msg)
+    finally:
+        connection.close()
+
+    return enviados, fallidos
+
+
+def liberar_adjuntos_en_error(dias: int) -> int:
+    """
+    Emails en ERROR de hace más de `dias` días que tenían que borrar sus fotos
+    al enviarse: como ya no se van a enviar, se borran ahora (si no, las
+    originales se quedarían en media/ para siempre). Se pueden seguir
+    reencolando desde el admin, ya sin esas fotos.
+    Devuelve cuántos mensajes se han liberado. Con dias <= 0 no hace nada.
+    """
+    if dias <= 0:
+        return 0
+    caducados = list(
+        EmailOutbox.objects.filter(
+            estado=EmailOutbox.ERROR,
+            borrar_adjuntos=True,
+            created_at__lt=timezone.now() - timedelta(days=dias),
+        )
+    )
+    for msg in caducados:
+        _borrar_adjuntos(msg)
+    EmailOutbox.objects.filter(pk__in=[msg.pk for msg in caducados]).update(borrar_adjuntos=False)
+    return len(caducados)
+
+
+def reencolar(queryset) -> int:
+    """
+    Vuelve a poner en cola (intentos a cero, sin espera) los emails no enviados.
+    """
+    return queryset.exclude(estado=EmailOutbox.ENVIADO).update(
+        estado=EmailOutbox.PENDIENTE, intentos=0, proximo_intento=timezone.now(), ultimo_error=""
+    )
+
+
+def mensajes_por_estado() -> dict:
+    """
+    Número de mensajes de la outbox por estado (para /metrics: el envío va en
+    otro proceso, el de `enviar_emails`, y sus contadores no llegan al web).
+    """
+    por_estado = dict.fromkeys((EmailOutbox.PENDIENTE, EmailOutbox.ENVIADO, EmailOutbox.ERROR), 0)
+    por_estado.update(EmailOutbox.objects.values_list("estado").annotate(n=Count("id")).order_by())
+    return por_estado
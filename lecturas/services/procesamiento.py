@@ -0,0 +1,453 @@
+import logging
+from datetime import date
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from ..models import LecturaCuentaKM
+from .estado import bloquear_estado, obtener_estado
+from .emails import enviar_email_admin_fin_semana, enviar_email_admin_mismatch_lunes
+from .miniaturas import generar_miniatura
+from . import metricas
+from .ocr import aextraer_km_desde_imagen, extraer_km_desde_imagen
+from .resiliencia import ServicioNoDisponible
+from .semanas import registrar_semana
+
+
+logger = logging.getLogger(__name__)
+
+
+class LecturaRechazada(Exception):
+    """
+    La lectura no cumple las reglas de inicio/fin de semana.
+    El mensaje se devuelve tal cual al cliente (HTTP 400).
+    """
+
+
+class LecturaDuplicada(LecturaRechazada):
+    """
+    Otra subida simultánea ya registró esa lectura (HTTP 409).
+    """
+
+
+class InicioPendiente(Exception):
+    """
+    El fin de semana llega con el inicio aún en la cola de OCR (sin km):
+    el fin se encola detrás y se calcula cuando el inicio esté leído.
+    """
+
+
+# -------------------------
+# Helpers
+# -------------------------
+
+def iso_week_year(d: date):
+    iso = d.isocalendar()
+    return iso.week, iso.year
+
+
+def is_monday(d: date) -> bool:
+    return d.weekday() == 0  # Monday=0
+
+
+def is_friday(d: date) -> bool:
+    return d.weekday() == 4  # Friday=4
+
+
+def borrado_diferido() -> bool:
+    """
+    True => las vistas solo desvinculan las fotos (UPDATE imagen=NULL) y los
+    ficheros, ya huérfanos, los borra en bloque `manage.py barrer_media`.
+    """
+    return getattr(settings, "CUENTAKM_BORRADO_DIFERIDO", False)
+
+
+def delete_image_field_file(instance, field_name: str):
+    """
+    Deja vacío el ImageField/FileField (sin borrar el registro) y borra el
+    archivo: en el momento o, con borrado diferido, en el siguiente barrido.
+    """
+    f = getattr(instance, field_name, None)
+    if not f:
+        return
+    with metricas.cronometro("borrado"):
+        if not borrado_diferido():
+            try:
+                if f.name and default_storage.exists(f.name):
+                    default_storage.delete(f.name)
+            except Exception:
+                logger.exception("Error borrando archivo %s", f.name)
+        try:
+            setattr(instance, field_name, None)
+            instance.save(update_fields=[field_name])
+        except Exception:
+            logger.exception("Error limpiando campo %s del modelo", field_name)
+
+
+def borrar_fotos(lecturas) -> int:
+    """
+    delete_image_field_file para varias lecturas con UNA sola UPDATE.
+    La miniatura se conserva (vista previa del admin).
+    Devuelve cuántas fotos se han desvinculado.
+    """
+    nombres = {lectura.pk: lectura.imagen.name for lectura in lecturas if lectura.imagen}
+    if not nombres:
+        return 0
+    with metricas.cronometro("borrado"):
+        LecturaCuentaKM.objects.filter(pk__in=nombres).update(imagen=None)
+        for lectura in lecturas:
+            lectura.imagen = None
+        if not borrado_diferido():
+            for nombre in nombres.values():
+                try:
+                    default_storage.delete(nombre)
+                except Exception:
+                    logger.exception("Error borrando archivo %s", nombre)
+    return len(nombres)
+
+
+def descartar_lectura(lectura):
+    """
+    Borra la foto y el registro de una lectura que no se puede aprovechar
+    (OCR fallido, falta el inicio de semana...). Con borrado diferido la foto
+    queda huérfana y la borra el barrido.
+    """
+    if not borrado_diferido():
+        delete_image_field_file(lectura, "imagen")
+        delete_image_field_file(lectura, "miniatura")
+    lectura.delete()
+
+
+# -------------------------
+# Reglas de negocio
+# -------------------------
+
+def emails_por_lectura() -> bool:
+    """
+    False => no se manda un email por cada lectura; Administración recibe
+    solo el resumen semanal consolidado.
+    """
+    return getattr(settings, "CUENTAKM_EMAIL_POR_LECTURA", True)
+
+
+def tipos_permitidos(estado):
+    """
+    Regla de allowed types, a partir del EstadoComercial (sin consultar el historial):
+    1) Si NO hay lecturas: solo "inicio_semana"
+    2) Si la ÚLTIMA lectura es "inicio_semana": solo "fin_semana"
+    3) Si la ÚLTIMA lectura es "fin_semana": solo "inicio_semana"
+    Devuelve (allowed, last).
+    """
+    last = estado.ultima_lectura
+
+    if not last:
+        allowed = [LecturaCuentaKM.INICIO]
+    else:
+        allowed = [LecturaCuentaKM.FIN] if last.tipo_lectura == LecturaCuentaKM.INICIO else [LecturaCuentaKM.INICIO]
+
+    return allowed, last
+
+
+def inicio_de_semana(estado, semana, anio):
+    """
+    Lectura de inicio de la semana indicada, si es el último inicio del comercial.
+    """
+    inicio = estado.ultimo_inicio
+    if inicio and inicio.semana == semana and inicio.anio == anio:
+        return inicio
+    return None
+
+
+def validar_nueva_lectura(estado, tipo_lectura, semana, anio):
+    """
+    Comprueba, ANTES de guardar la foto y de pagar el OCR, que la lectura
+    se puede registrar. Lanza LecturaRechazada si no.
+    """
+    allowed, _ = tipos_permitidos(estado)
+    if tipo_lectura not in allowed:
+        raise LecturaRechazada(f"Tipo de lectura no permitido ahora. Permitidos: {allowed}")
+
+    if tipo_lectura == LecturaCuentaKM.FIN and not inicio_de_semana(estado, semana, anio):
+        raise LecturaRechazada(
+            "No tenemos la lectura de inicio de semana para esta semana. "
+            "No podemos calcular los km."
+        )
+
+    # Una lectura de cada tipo por semana (también lo impone la BD)
+    anterior = estado.ultimo_inicio if tipo_lectura == LecturaCuentaKM.INICIO else estado.ultimo_fin
+    if anterior and anterior.semana == semana and anterior.anio == anio:
+        raise LecturaRechazada(f"Ya hay una lectura de {tipo_lectura} para la semana {semana}/{anio}.")
+
+
+def crear_lectura(comercial_id, tipo_lectura, imagen):
+    """
+    Valida y da de alta la lectura con el estado del comercial bloqueado, para
+    que dos subidas simultáneas no pasen las dos la validación. El OCR (lento)
+    se hace después, fuera del bloqueo.
+
+    Lanza Comercial.DoesNotExist, LecturaRechazada o LecturaDuplicada (si la
+    restricción única de la BD detecta una carrera que el bloqueo no cubrió;
+    el alta concurrente del EstadoComercial no llega aquí, ver recalcular_estado).
+    """
+    semana, anio = iso_week_year(timezone.localdate())
+    lectura = None
+    try:
+        with transaction.atomic():
+            estado = bloquear_estado(comercial_id)
+            validar_nueva_lectura(estado, tipo_lectura, semana, anio)
+            # la señal post_save actualiza EstadoComercial en esta misma transacción
+            lectura = LecturaCuentaKM(
+                comercial=estado.comercial,
+                tipo_lectura=tipo_lectura,
+                semana=semana,
+                anio=anio,
+                imagen=imagen,
+            )
+            # el FileField mueve la foto subida a MEDIA_ROOT al guardar
+            with metricas.cronometro("guardar_imagen"):
+                lectura.save()
+    except IntegrityError:
+        # la foto ya se había guardado en disco antes del INSERT
+        if lectura is not None and lectura.imagen:
+            lectura.imagen.delete(save=False)
+        raise LecturaDuplicada(
+            f"Ya se ha registrado una lectura de {tipo_lectura} para la semana {semana}/{anio}."
+        )
+    return lectura
+
+
+def leer_km(lectura):
+    """
+    Extrae los km de la foto con OpenAI y los guarda en la lectura.
+    Si falla, propaga la excepción (quien llama decide si descartar la lectura).
+    """
+    lectura.kilometros = extraer_km_desde_imagen(lectura.imagen.path)
+    update_fields = ["kilometros"]
+    # una vez por lectura, con el OCR ya bueno: la usan los emails y el admin
+    with metricas.cronometro("miniatura"):
+        if generar_miniatura(lectura):
+            update_fields.append("miniatura")
+    lectura.save(update_fields=update_fields)
+
+
+async def aleer_km(lectura):
+    """
+    Versión async de leer_km: ni el OCR ni la miniatura bloquean el bucle.
+    """
+    lectura.kilometros = await aextraer_km_desde_imagen(lectura.imagen.path)
+    update_fields = ["kilometros"]
+    with metricas.cronometro("miniatura"):
+        if await sync_to_async(generar_miniatura, thread_sensitive=False)(lectura):
+            update_fields.append("miniatura")
+    await lectura.asave(update_fields=update_fields)
+
+
+def _encolar(lectura, warning):
+    # import diferido: cola_ocr depende de este módulo
+    from .cola_ocr import encolar_lectura
+
+    trabajo = encolar_lectura(lectura)
+    return 202, {"job_id": str(trabajo.clave), "estado": trabajo.estado, "warning": warning}
+
+
+def _ocr_fallido(lectura, error):
+    """
+    Respuesta (http_status, data) cuando no se han podido leer los km.
+    """
+    if isinstance(error, ServicioNoDisponible):
+        # el proveedor está caído o nos limita: la foto es buena, no se tira
+        logger.warning("OCR no disponible para la lectura %s: %s", lectura.pk, error)
+        if getattr(settings, "CUENTAKM_OCR_ENCOLAR_SI_NO_DISPONIBLE", True):
+            return _encolar(
+                lectura,
+                "El servicio de lectura de km no está disponible ahora; "
+                "la lectura se procesará en cuanto vuelva.",
+            )
+        descartar_lectura(lectura)
+        return 503, {"error": f"Servicio de lectura de km no disponible: {str(error)}"}
+
+    logger.error("Error leyendo km con OpenAI", exc_info=error)
+    # si falla, borramos la foto que acabamos de subir para no acumular basura
+    descartar_lectura(lectura)
+    return 500, {"error": f"Error leyendo kilómetros: {str(error)}"}
+
+
+AVISO_INICIO_PENDIENTE = (
+    "La lectura de inicio de semana aún se está procesando; "
+    "los km de la semana se calcularán en cuanto termine."
+)
+
+
+def procesar_lectura(lectura):
+    """
+    OCR + reglas de semana de una lectura recién creada (modo síncrono).
+    Devuelve (http_status, data) tal como los responde la API. Si el servicio
+    de OCR no está disponible, la lectura se encola (202) en vez de perderse.
+    """
+    try:
+        leer_km(lectura)
+    except Exception as e:
+        return _ocr_fallido(lectura, e)
+
+    try:
+        return 201, aplicar_reglas_semana(lectura)
+    except LecturaRechazada as e:
+        return 400, {"error": str(e)}
+    except InicioPendiente:
+        return _encolar(lectura, AVISO_INICIO_PENDIENTE)
+
+
+async def aprocesar_lectura(lectura):
+    """
+    Como procesar_lectura, para las vistas async: mientras responde el OCR la
+    petición no ocupa ningún hilo, y los emails van siempre a la outbox.
+    """
+    try:
+        await aleer_km(lectura)
+    except Exception as e:
+        return await sync_to_async(_ocr_fallido)(lectura, e)
+
+    try:
+        return 201, await sync_to_async(aplicar_reglas_semana)(lectura, emails_diferidos=True)
+    except LecturaRechazada as e:
+        return 400, {"error": str(e)}
+    except InicioPendiente:
+        return await sync_to_async(_encolar)(lectura, AVISO_INICIO_PENDIENTE)
+
+
+def aplicar_reglas_semana(lectura, emails_diferidos=None) -> dict:
+    """
+    Con los km ya leídos, aplica las comprobaciones de inicio/fin de semana,
+    envía los emails a Administración y borra las fotos al cerrar la semana.
+    Devuelve el payload de respuesta de la API.
+
+    `emails_diferidos=True` manda los emails a la outbox aunque
+    CUENTAKM_EMAIL_OUTBOX esté desactivado (vistas async: sin SMTP en la petición).
+    """
+    comercial = lectura.comercial
+    tipo_lectura = lectura.tipo_lectura
+    estado = obtener_estado(lectura.comercial_id)
+    # Fecha de subida (no la de procesado): en modo asíncrono pueden diferir
+    hoy = timezone.localdate(lectura.created_at)
+
+    warning = None
+    kms_semana = None
+
+    # -------------------------
+    # CASO A: inicio_semana
+    # -------------------------
+    if tipo_lectura == LecturaCuentaKM.INICIO:
+        # Si existe un fin_semana anterior, y esto NO es la primera vez:
+        lectura_fin_anterior = estado.ultimo_fin
+
+        # Regla: si hay cierre anterior, el inicio nuevo debería ser IGUAL al fin anterior.
+        if lectura_fin_anterior:
+            if lectura.kilometros != lectura_fin_anterior.kilometros:
+                warning = (
+                    "La lectura del lunes (inicio de semana) no coincide con el fin de semana anterior. "
+                    "Se avisará a Administración."
+                )
+                try:
+                    lectura.inicio_no_cuadra = True
+                    lectura.save(update_fields=["inicio_no_cuadra"])
+                except Exception:
+                    pass
+                if emails_por_lectura():
+                    try:
+                        enviar_email_admin_mismatch_lunes(
+                            comercial=comercial,
+                            lectura_fin_anterior=lectura_fin_anterior,
+                            lectura_inicio_nueva=lectura,
+                            warning=warning,
+                            diferido=emails_diferidos,
+                        )
+                    except Exception:
+                        logger.exception("[EMAIL] Error enviando aviso mismatch lunes")
+
+        # Nota: NO borramos la foto de inicio, porque la necesitamos para el email del fin de semana.
+        return _payload(lectura, kms_semana, warning)
+
+    # -------------------------
+    # CASO B: fin_semana
+    # -------------------------
+    # Debe existir inicio_semana (para poder calcular)
+    lectura_inicio = inicio_de_semana(estado, lectura.semana, lectura.anio)
+
+    if not lectura_inicio:
+        # no podemos calcular; borramos esta foto (fin) para no acumular
+        descartar_lectura(lectura)
+        raise LecturaRechazada(
+            "No tenemos la lectura de inicio de semana para esta semana. "
+            "No podemos calcular los km."
+        )
+
+    if lectura_inicio.kilometros is None:
+        # el inicio se encoló con el OCR caído y todavía no tiene km
+        raise InicioPendiente()
+
+    kms_semana = lectura.kilometros - lectura_inicio.kilometros
+    if kms_semana < 0:
+        warning = "Los kilómetros de fin de semana son menores que los de inicio. Revisar posible error de lectura."
+
+    # Warning por “fin fuera de plazo” (si no se hace en viernes)
+    if not is_friday(hoy):
+        warning_extra = (
+            "La lectura de fin de semana se ha subido fuera de plazo (no es viernes). "
+            "Se notificará a Administración."
+        )
+        warning = f"{warning} | {warning_extra}" if warning else warning_extra
+        try:
+            lectura.fin_fuera_de_plazo = True
+            lectura.save(update_fields=["fin_fuera_de_plazo"])
+        except Exception:
+            pass
+
+    try:
+        registrar_semana(lectura_inicio, lectura, kms_semana)
+    except Exception:
+        logger.exception("Error actualizando ResumenSemanal")
+
+    # Sin emails por lectura, el resumen semanal (enviar_resumen_semanal) informa
+    # de esta semana y borra las fotos después de adjuntarlas.
+    if not emails_por_lectura():
+        return _payload(lectura, kms_semana, warning)
+
+    # Email a admin en fin de semana, con las dos fotos
+    fotos_delegadas = False
+    try:
+        fotos_delegadas = enviar_email_admin_fin_semana(
+            comercial=comercial,
+            lectura_inicio=lectura_inicio,
+            lectura_fin=lectura,
+            kms_semana=kms_semana,
+            warning=warning,
+            borrar_fotos=True,
+            diferido=emails_diferidos,
+        )
+    except Exception:
+        logger.exception("[EMAIL] Error enviando email fin de semana")
+
+    # ✅ BORRADO DE FOTOS: tras fin de semana, borramos foto de inicio y foto de fin
+    # (así no peta media/). Si el email va por la outbox, las borra el envío.
+    if not fotos_delegadas:
+        try:
+            borrar_fotos([lectura_inicio, lectura])
+        except Exception:
+            logger.exception("Error borrando fotos tras fin de semana")
+
+    return _payload(lectura, kms_semana, warning)
+
+
+def _payload(lectura, kms_semana, warning) -> dict:
+    return {
+        "comercial": lectura.comercial.nombre,
+        "tipo_lectura": lectura.tipo_lectura,
+        "kilometros": lectura.kilometros,
+        "semana": lectura.semana,
+        "anio": lectura.anio,
+        "kms_semana": kms_semana,
+        "warning": warning,
+    }
@@ -0,0 +1,113 @@
+import threading
+import time
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from ..models import LecturaCuentaKM, RevisionLectura
+
+
+IGUAL = "igual"
+DIFERENTE = "diferente"
+SIN_FOTO = "sin_foto"
+
+
+# ============================================================
+# Ritmo de llamadas (por proceso)
+# ============================================================
+class LimiteRitmo:
+    """
+    Cubo de fichas en memoria: como mucho `por_minuto` llamadas por minuto,
+    repartidas entre todos los hilos del proceso. `esperar()` bloquea hasta
+    que hay ficha. Con por_minuto=0 no limita.
+    """
+
+    def __init__(self, por_minuto: float, rafaga: int = 1):
+        self.por_segundo = por_minuto / 60.0
+        self.capacidad = max(1, rafaga)
+        self.fichas = float(self.capacidad)
+        self.ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def esperar(self):
+        if self.por_segundo <= 0:
+            return
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self.fichas = min(self.capacidad, self.fichas + (ahora - self.ultimo) * self.por_segundo)
+                self.ultimo = ahora
+                if self.fichas >= 1:
+                    self.fichas -= 1
+                    return
+                falta = (1 - self.fichas) / self.por_segundo
+            time.sleep(falta)
+
+
+# ============================================================
+# Reproceso de lecturas guardadas
+# ============================================================
+def seleccionar_lecturas(desde=None, hasta=None, comercial_id=None, tipo=None, ids=None, tras_id=0):
+    """
+    Lecturas que aún tienen foto, por id ascendente (el orden del punto de control).
+    `desde`/`hasta` son fechas de subida.
+    """
+    qs = (
+        LecturaCuentaKM.objects
+        .exclude(imagen="")
+        .exclude(imagen__isnull=True)
+        .filter(id__gt=tras_id)
+    )
+    if desde is not None:
+        qs = qs.filter(created_at__date__gte=desde)
+    if hasta is not None:
+        qs = qs.filter(created_at__date__lte=hasta)
+    if comercial_id is not None:
+        qs = qs.filter(comercial_id=comercial_id)
+    if tipo:
+        qs = qs.filter(tipo_lectura=tipo)
+    if ids:
+        qs = qs.filter(id__in=ids)
+    return qs.order_by("id")
+
+
+def reprocesar_lectura(lectura, backend, ejecucion: str, perfil: str = None) -> str:
+    """
+    Vuelve a leer los km de la foto con `backend` (sin caché de OCR: la idea
+    es precisamente repetir la lectura). Si no coinciden con los guardados,
+    deja una RevisionLectura; la lectura NO se modifica.
+    Lanza Exception si el OCR falla.
+    """
+    if not default_storage.exists(lectura.imagen.name):
+        return SIN_FOTO
+
+    resultado = backend.leer(lectura.imagen.path, perfil)
+    if resultado.km == lectura.kilometros:
+        return IGUAL
+
+    RevisionLectura.objects.update_or_create(
+        lectura=lectura,
+        ejecucion=ejecucion,
+        defaults={
+            "km_actual": lectura.kilometros,
+            "km_nuevo": resultado.km,
+            "confianza": resultado.confianza,
+            "texto_modelo": resultado.texto or "",
+            "backend": backend.version(perfil),
+            "estado": RevisionLectura.PENDIENTE,
+        },
+    )
+    return DIFERENTE
+
+
+def aplicar_revision(revision):
+    """
+    Copia el km revisado a la lectura (las señales actualizan EstadoComercial
+    y recalculan su fila de ResumenSemanal).
+    """
+    lectura = revision.lectura
+    with transaction.atomic():
+        lectura.kilometros = revision.km_nuevo
+        lectura.save(update_fields=["kilometros"])
+        revision.estado = RevisionLectura.APLICADA
+        revision.save(update_fields=["estado"])
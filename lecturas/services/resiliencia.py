@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from ..models import EstadoServicioExterno
+from . import metricas
+
+
+logger = logging.getLogger(__name__)
+
+
+class ServicioNoDisponible(Exception):
+    """
+    El servicio remoto no está disponible ahora (circuito abierto, límite de
+    ritmo o errores transitorios tras los reintentos). La lectura no es
+    inválida: hay que reintentarla más tarde, no descartar la foto.
+    """
+
+
+class CircuitoAbierto(ServicioNoDisponible):
+    pass
+
+
+# ============================================================
+# Configuración
+# ============================================================
+def _conf(nombre, defecto):
+    return getattr(settings, f"CUENTAKM_OCR_{nombre}", defecto)
+
+
+ESTADOS_TRANSITORIOS = {408, 429, 500, 502, 503, 504}
+# excepciones de openai (legacy y >=1.0), requests, httpx y aiohttp que indican fallo transitorio
+NOMBRES_TRANSITORIOS = {
+    "RateLimitError", "ServiceUnavailableError", "TryAgain", "Timeout", "APITimeoutError",
+    "APIConnectionError", "ConnectTimeout", "ReadTimeout", "ConnectError", "ReadError",
+    "ClientConnectorError", "ServerDisconnectedError",
+}
+
+
+def _estado_http(error):
+    for atributo in ("status_code", "http_status"):
+        valor = getattr(error, atributo, None)
+        if isinstance(valor, int):
+            return valor
+    return getattr(getattr(error, "response", None), "status_code", None)
+
+
+# timeouts de lectura: la petición ya llegó y el modelo puede estar trabajando;
+# repetirla dentro de la misma petición HTTP solo multiplica la espera del usuario
+NOMBRES_TIMEOUT_LECTURA = {"Timeout", "APITimeoutError", "ReadTimeout", "ServerTimeoutError"}
+
+
+def es_error_transitorio(error) -> bool:
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return _estado_http(error) in ESTADOS_TRANSITORIOS or type(error).__name__ in NOMBRES_TRANSITORIOS
+
+
+def es_reintentable(error) -> bool:
+    """
+    Transitorio y seguro de repetir enseguida: 429, 5xx y errores de
+    conexión. Los timeouts de lectura cuentan para el cortacircuitos
+    pero no se reintentan.
+    """
+    if isinstance(error, TimeoutError) or type(error).__name__ in NOMBRES_TIMEOUT_LECTURA:
+        return False
+    return es_error_transitorio(error)
+
+
+def _espera_reintento(intento: int, error) -> float:
+    """
+    Espera exponencial con jitter completo (que los workers no reintenten a la
+    vez); si el servidor manda Retry-After, como mínimo eso.
+    """
+    base = _conf("BACKOFF_BASE", 0.5)
+    espera = random.uniform(0, min(_conf("BACKOFF_MAX", 8.0), base * 2 ** intento))
+    cabeceras = getattr(error, "headers", None) or getattr(getattr(error, "response", None), "headers", None)
+    try:
+        espera = max(espera, float((cabeceras or {}).get("retry-after")))
+    except (TypeError, ValueError):
+        pass
+    return min(espera, _conf("BACKOFF_MAX", 8.0))
+
+
+# ============================================================
+# Limitador de ritmo + cortacircuitos (estado en BD, compartido)
+# ============================================================
+# Una fila de EstadoServicioExterno por servicio, bloqueada durante unos
+# milisegundos para tomar ficha y comprobar el circuito: todos los workers de
+# gunicorn (y el worker de la cola) respetan el mismo ritmo y, cuando el
+# proveedor falla, dejan de llamarle todos a la vez.
+
+def _tomar_turno(nombre: str) -> float:
+    """
+    Comprueba el circuito y toma una ficha. Devuelve 0 si se puede llamar ya
+    o los segundos que hay que esperar a la siguiente ficha.
+    Lanza CircuitoAbierto si el circuito está abierto.
+    """
+    por_minuto = _conf("MAX_POR_MINUTO", 0)
+    capacidad = max(1, _conf("RAFAGA", 10))
+
+    if por_minuto <= 0:
+        # sin limitador solo importa el circuito: con él cerrado basta leer,
+        # sin bloquear ni reescribir la fila en cada llamada
+        abierto_hasta = (
+            EstadoServicioExterno.objects.filter(nombre=nombre).values_list("abierto_hasta", flat=True).first()
+        )
+        if abierto_hasta is None:
+            return 0.0
+
+    with transaction.atomic():
+        estado, _ = (
+            EstadoServicioExterno.objects
+            .select_for_update()
+            .get_or_create(nombre=nombre, defaults={"fichas": capacidad})
+        )
+        ahora = timezone.now()
+
+        if estado.abierto_hasta:
+            if ahora < estado.abierto_hasta:
+                segundos = (estado.abierto_hasta - ahora).total_seconds()
+                raise CircuitoAbierto(f"Servicio {nombre} no disponible (reintentar en {segundos:.0f} s)")
+            # semiabierto: esta llamada es la de prueba; las demás siguen fallando rápido
+            estado.abierto_hasta = ahora + timedelta(seconds=_conf("CIRCUITO_PAUSA", 60))
+            cambios = ["abierto_hasta"]
+        else:
+            cambios = []
+
+        espera = 0.0
+        if por_minuto > 0:
+            por_segundo = por_minuto / 60.0
+            if estado.fichas_at is not None:
+                transcurrido = (ahora - estado.fichas_at).total_seconds()
+                estado.fichas = min(capacidad, estado.fichas + transcurrido * por_segundo)
+            estado.fichas_at = ahora
+            if estado.fichas >= 1:
+                estado.fichas -= 1
+            else:
+                espera = (1 - estado.fichas) / por_segundo
+            cambios += ["fichas", "fichas_at"]
+
+        if cambios:
+            estado.save(update_fields=[*cambios, "updated_at"])
+        return espera
+
+
+def _esperar_turno(nombre: str):
+    limite = time.monotonic() + _conf("ESPERA_MAX", 10.0)
+    while True:
+        espera = _tomar_turno(nombre)
+        if espera <= 0:
+            return
+        if time.monotonic() + espera > limite:
+            metricas.incrementar("ocr_limite_ritmo")
+            raise ServicioNoDisponible(f"Límite de ritmo de {nombre} alcanzado")
+        time.sleep(espera)
+
+
+def _registrar_respuesta(nombre: str):
+    # el servicio ha respondido (bien o con un error no transitorio): se cierra el circuito.
+    # Se mira antes de escribir: un UPDATE, aunque no toque filas, bloquea la BD en SQLite
+    pendiente = (
+        EstadoServicioExterno.objects
+        .filter(nombre=nombre)
+        .exclude(fallos_seguidos=0, abierto_hasta__isnull=True)
+    )
+    if pendiente.exists():
+        pendiente.update(fallos_seguidos=0, abierto_hasta=None)
+
+
+def _registrar_fallo(nombre: str):
+    with transaction.atomic():
+        # sin limitador la fila puede no existir aún (ver _tomar_turno)
+        estado, _ = (
+            EstadoServicioExterno.objects
+            .select_for_update()
+            .get_or_create(nombre=nombre, defaults={"fichas": max(1, _conf("RAFAGA", 10))})
+        )
+        estado.fallos_seguidos += 1
+        if estado.fallos_seguidos >= _conf("CIRCUITO_FALLOS", 5):
+            if not estado.abierto_hasta or estado.abierto_hasta <= timezone.now():
+                logger.warning("[%s] Circuito abierto tras %s fallos seguidos", nombre, estado.fallos_seguidos)
+                metricas.incrementar("ocr_circuito_abierto")
+            estado.abierto_hasta = timezone.now() + timedelta(seconds=_conf("CIRCUITO_PAUSA", 60))
+        estado.save()
+
+
+def llamar_con_proteccion(nombre: str, funcion):
+    """
+    Ejecuta `funcion()` (una llamada al servicio remoto) respetando el límite
+    de ritmo y el cortacircuitos compartidos, y reintentando con espera
+    exponencial los errores transitorios (429, 5xx, conexión). Un timeout
+    de lectura no se reintenta: ya ha costado READ_TIMEOUT segundos de la
+    petición. Los demás errores se propagan tal cual. Si no se consigue,
+    lanza ServicioNoDisponible.
+    """
+    reintentos = max(0, _conf("REINTENTOS", 2))
+    for intento in range(reintentos + 1):
+        _esperar_turno(nombre)
+        try:
+            resultado = funcion()
+        except Exception as e:
+            if not es_error_transitorio(e):
+                _registrar_respuesta(nombre)
+                raise
+            _registrar_fallo(nombre)
+            if intento == reintentos or not es_reintentable(e):
+                raise ServicioNoDisponible(f"Servicio {nombre} no disponible: {e}") from e
+            metricas.incrementar("ocr_reintentos")
+            logger.warning("[%s] Error transitorio (intento %s): %s", nombre, intento + 1, e)
+            time.sleep(_espera_reintento(intento, e))
+            continue
+        _registrar_respuesta(nombre)
+        return resultado
+
+
+def _tomar_turno_y_soltar_conexion(nombre: str) -> float:
+    espera = _tomar_turno(nombre)
+    if espera <= 0 and not connection.in_atomic_block:
+        # la llamada remota puede tardar segundos: mientras, la petición no
+        # ocupa una conexión a la BD (se reabre sola en la siguiente consulta)
+        connection.close()
+    return espera
+
+
+async def _aesperar_turno(nombre: str):
+    limite = time.monotonic() + _conf("ESPERA_MAX", 10.0)
+    while True:
+        espera = await sync_to_async(_tomar_turno_y_soltar_conexion)(nombre)
+        if espera <= 0:
+            return
+        if time.monotonic() + espera > limite:
+            metricas.incrementar("ocr_limite_ritmo")
+            raise ServicioNoDisponible(f"Límite de ritmo de {nombre} alcanzado")
+        await asyncio.sleep(espera)
+
+
+async def allamar_con_proteccion(nombre: str, funcion):
+    """
+    Versión async de llamar_con_proteccion: `funcion()` devuelve una corrutina.
+    Mismo limitador, cortacircuitos y reintentos (el estado sigue en BD), pero
+    las esperas no bloquean el bucle de eventos.
+    """
+    reintentos = max(0, _conf("REINTENTOS", 2))
+    for intento in range(reintentos + 1):
+        await _aesperar_turno(nombre)
+        try:
+            resultado = await funcion()
+        except Exception as e:
+            if not es_error_transitorio(e):
+                await sync_to_async(_registrar_respuesta)(nombre)
+                raise
+            await sync_to_async(_registrar_fallo)(nombre)
+            if intento == reintentos or not es_reintentable(e):
+                raise ServicioNoDisponible(f"Servicio {nombre} no disponible: {e}") from e
+            metricas.incrementar("ocr_reintentos")
+            logger.warning("[%s] Error transitorio (intento %s): %s", nombre, intento + 1, e)
+            await asyncio.sleep(_espera_reintento(intento, e))
+            continue
+        await sync_to_async(_registrar_respuesta)(nombre)
+        return resultado
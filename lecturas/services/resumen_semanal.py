@@ -0,0 +1,126 @@
+import io
+import logging
+
+from django.core.files.storage import default_storage
+from PIL import Image, ImageDraw, ImageOps
+
+from ..models import Comercial, LecturaCuentaKM
+from .miniaturas import foto_para_adjuntar
+from .procesamiento import borrar_fotos
+
+
+logger = logging.getLogger(__name__)
+
+
+# Hoja de contactos: miniaturas en rejilla con una etiqueta debajo
+MINIATURA_LADO = 240
+HOJA_COLUMNAS = 4
+ETIQUETA_ALTO = 28
+
+
+def construir_resumen(anio: int, semana: int):
+    """
+    Una fila por comercial con su inicio/fin de la semana, km hechos y avisos.
+    Dos consultas en total (comerciales + lecturas de la semana), sin N+1.
+    """
+    lecturas = (
+        LecturaCuentaKM.objects
+        .filter(anio=anio, semana=semana)
+        .select_related("comercial")
+        .order_by("created_at")
+    )
+
+    # El fin se empareja con el último inicio ANTERIOR a él (misma regla que
+    # la vista al cerrar la semana); sin fin, vale el último inicio.
+    por_comercial = {}
+    for lectura in lecturas:
+        par = por_comercial.setdefault(lectura.comercial_id, {"inicio": None, "fin": None, "abierto": None})
+        if lectura.tipo_lectura == LecturaCuentaKM.INICIO:
+            par["abierto"] = lectura
+        else:
+            par["inicio"], par["fin"] = par["abierto"], lectura
+
+    filas = []
+    for comercial in Comercial.objects.order_by("nombre"):
+        par = por_comercial.get(comercial.id, {})
+        fin = par.get("fin")
+        inicio = par.get("inicio") if fin else par.get("abierto")
+
+        kms = None
+        if inicio and fin and inicio.kilometros is not None and fin.kilometros is not None:
+            kms = fin.kilometros - inicio.kilometros
+
+        avisos = []
+        if not inicio and not fin:
+            avisos.append("sin lecturas")
+        elif not fin:
+            avisos.append("semana sin cerrar")
+        if inicio and inicio.inicio_no_cuadra:
+            avisos.append("inicio_no_cuadra")
+        if fin and fin.fin_fuera_de_plazo:
+            avisos.append("fin_fuera_de_plazo")
+        if kms is not None and kms < 0:
+            avisos.append("km negativos")
+
+        filas.append({
+            "comercial": comercial,
+            "inicio": inicio,
+            "fin": fin,
+            "kms": kms,
+            "avisos": avisos,
+        })
+
+    return filas
+
+
+def hoja_de_contactos(filas):
+    """
+    Compone las fotos de la semana en una única imagen JPEG (bytes) con
+    miniaturas etiquetadas. None si no hay ninguna foto.
+    """
+    fotos = []
+    for fila in filas:
+        for lectura, etiqueta in [(fila["inicio"], "inicio"), (fila["fin"], "fin")]:
+            foto = foto_para_adjuntar(lectura) if lectura else None
+            if foto:
+                fotos.append((foto, f"{fila['comercial'].nombre} - {etiqueta}"))
+
+    if not fotos:
+        return None
+
+    columnas = min(HOJA_COLUMNAS, len(fotos))
+    filas_hoja = (len(fotos) + columnas - 1) // columnas
+    celda_alto = MINIATURA_LADO + ETIQUETA_ALTO
+    hoja = Image.new("RGB", (columnas * MINIATURA_LADO, filas_hoja * celda_alto), "white")
+    draw = ImageDraw.Draw(hoja)
+
+    for i, (foto, etiqueta) in enumerate(fotos):
+        x = (i % columnas) * MINIATURA_LADO
+        y = (i // columnas) * celda_alto
+        try:
+            with default_storage.open(foto.name, "rb") as f:
+                img = ImageOps.exif_transpose(Image.open(f))
+                img.thumbnail((MINIATURA_LADO, MINIATURA_LADO))
+                img = img.convert("RGB")
+            hoja.paste(img, (x + (MINIATURA_LADO - img.width) // 2, y + (MINIATURA_LADO - img.height) // 2))
+        except Exception:
+            logger.exception("No se pudo generar la miniatura de %s", foto.name)
+        draw.text((x + 4, y + MINIATURA_LADO + 6), etiqueta[:36], fill="black")
+
+    out = io.BytesIO()
+    hoja.save(out, format="JPEG", quality=70, optimize=True)
+    return out.getvalue()
+
+
+def borrar_fotos_semanas_cerradas(filas) -> int:
+    """
+    Tras enviar el resumen, borra las fotos de las semanas ya cerradas
+    (con inicio y fin). Las de semanas abiertas se conservan.
+    """
+    lecturas = [
+        lectura
+        for fila in filas
+        if fila["inicio"] and fila["fin"]
+        for lectura in (fila["inicio"], fila["fin"])
+    ]
+    return borrar_fotos(lecturas)
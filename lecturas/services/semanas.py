@@ -0,0 +1,92 @@
+from datetime import date
+
+from django.db import transaction
+
+from ..models import LecturaCuentaKM, ResumenSemanal
+
+
+# ============================================================
+# Mantenimiento de ResumenSemanal
+# ============================================================
+def registrar_semana(lectura_inicio, lectura_fin, kms_semana):
+    """
+    Upsert de la semana que cierra `lectura_fin` (se llama desde
+    aplicar_reglas_semana, ya con los km y los avisos calculados).
+    """
+    ResumenSemanal.objects.update_or_create(
+        comercial_id=lectura_fin.comercial_id,
+        anio=lectura_fin.anio,
+        semana=lectura_fin.semana,
+        defaults={
+            "km_inicio": lectura_inicio.kilometros,
+            "km_fin": lectura_fin.kilometros,
+            "kms": kms_semana,
+            "fin_fuera_de_plazo": lectura_fin.fin_fuera_de_plazo,
+            "inicio_no_cuadra": lectura_inicio.inicio_no_cuadra,
+            "cerrada_at": lectura_fin.created_at,
+        },
+    )
+
+
+def lectura_modificada(lectura, antes=None):
+    """
+    Cambian los km (OCR, revisión, admin) o la lectura entera (admin): se
+    recalcula su semana. `antes` = (comercial_id, anio, semana) previos; si la
+    lectura se ha movido de comercial o de semana, también se recalcula aquella.
+    """
+    afectadas = {(lectura.comercial_id, lectura.anio, lectura.semana)}
+    if antes is not None:
+        afectadas.add(tuple(antes))
+    for comercial_id, anio, semana in afectadas:
+        lunes = date.fromisocalendar(anio, semana, 1)
+        reconstruir(desde=lunes, hasta=lunes, comercial_id=comercial_id)
+
+
+def lectura_borrada(lectura):
+    """
+    Si se borra el fin de una semana, la semana deja de estar cerrada.
+    """
+    if lectura.tipo_lectura == LecturaCuentaKM.FIN:
+        ResumenSemanal.objects.filter(
+            comercial_id=lectura.comercial_id, anio=lectura.anio, semana=lectura.semana
+        ).delete()
+
+
+def reconstruir(desde=None, hasta=None, comercial_id=None) -> int:
+    """
+    Recalcula en bloque las semanas cerradas del rango (fechas, por semana ISO)
+    con la misma consulta agregada que el informe semanal, y sustituye las
+    filas existentes del rango en una transacción. Devuelve las filas creadas.
+    """
+    # import diferido: informes depende de procesamiento, que usa este módulo
+    from .informes import informe_semanal_qs, lecturas_filtradas
+
+    filas = (
+        informe_semanal_qs(desde=desde, hasta=hasta, comercial_id=comercial_id)
+        .filter(fin_at__isnull=False)
+        .iterator(chunk_size=2000)
+    )
+    resumenes = [
+        ResumenSemanal(
+            comercial_id=r["comercial_id"],
+            anio=r["anio"],
+            semana=r["semana"],
+            km_inicio=r["km_inicio"],
+            km_fin=r["km_fin"],
+            kms=r["kms"],
+            fin_fuera_de_plazo=r["avisos_fin"] > 0,
+            inicio_no_cuadra=r["avisos_inicio"] > 0,
+            cerrada_at=r["fin_at"],
+        )
+        for r in filas
+    ]
+
+    # mismos filtros por (comercial, anio, semana) que las lecturas
+    existentes = lecturas_filtradas(
+        desde=desde, hasta=hasta, comercial_id=comercial_id, base=ResumenSemanal.objects.all()
+    )
+
+    with transaction.atomic():
+        existentes.delete()
+        ResumenSemanal.objects.bulk_create(resumenes, batch_size=500)
+    return len(resumenes)
@@ -0,0 +1,64 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Comercial, LecturaCuentaKM
+from .services import cache_http, estado, metricas, semanas
+
+
+def _invalidar_al_confirmar(*ambitos):
+    # después del commit: si se invalidara antes, una petición concurrente
+    # podría cachear los datos viejos con la versión nueva
+    transaction.on_commit(lambda: cache_http.invalidar(*ambitos))
+
+
+@receiver(pre_save, sender=LecturaCuentaKM)
+def lectura_por_guardar(sender, instance, update_fields=None, **kwargs):
+    # guardado completo de una lectura existente (p.ej. el admin): se anota de
+    # qué comercial y semana era, por si se han cambiado
+    if update_fields is None and not instance._state.adding:
+        instance._antes = (
+            LecturaCuentaKM.objects.filter(pk=instance.pk).values_list("comercial_id", "anio", "semana").first()
+        )
+
+
+@receiver(post_save, sender=LecturaCuentaKM)
+def lectura_guardada(sender, instance, created, update_fields=None, **kwargs):
+    ambitos = [cache_http.ambito_estado(instance.comercial_id)]
+    if created:
+        estado.registrar_lectura(instance)
+    elif update_fields is None:
+        # puede haber cambiado cualquier campo (tipo, semana, comercial...)
+        antes = getattr(instance, "_antes", None)
+        anterior = antes[0] if antes else None
+        estado.lectura_modificada(instance, anterior)
+        semanas.lectura_modificada(instance, antes)
+        if anterior is not None and anterior != instance.comercial_id:
+            ambitos.append(cache_http.ambito_estado(anterior))
+    elif "kilometros" in update_fields:
+        estado.actualizar_km(instance)
+        semanas.lectura_modificada(instance)
+    else:
+        # p.ej. solo se ha vaciado la imagen: no cambia nada de lo que sirve la API
+        return
+    _invalidar_al_confirmar(*ambitos)
+
+
+@receiver(post_delete, sender=LecturaCuentaKM)
+def lectura_eliminada(sender, instance, **kwargs):
+    estado.lectura_borrada(instance.comercial_id)
+    semanas.lectura_borrada(instance)
+    _invalidar_al_confirmar(cache_http.ambito_estado(instance.comercial_id))
+
+
+@receiver(post_save, sender=Comercial)
+@receiver(post_delete, sender=Comercial)
+def comercial_modificado(sender, instance, **kwargs):
+    _invalidar_al_confirmar("comerciales", cache_http.ambito_estado(instance.pk))
+
+
+@receiver(connection_created)
+def conexion_creada(sender, connection, **kwargs):
+    # cada conexión (una por hilo) cuenta sus consultas en la petición en curso
+    connection.execute_wrappers.append(metricas.contar_consulta)
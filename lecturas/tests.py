@@ -1,3 +1,1504 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import AsyncRequestFactory, LiveServerTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+
+from config import urls as config_urls
+
+from .management.commands._simulacion import ServidorVisionFalso, foto_cuentakm
+from .models import (
+    CacheOCR,
+    ClaveIdempotencia,
+    Comercial,
+    EmailOutbox,
+    EstadoComercial,
+    EstadoServicioExterno,
+    LecturaCuentaKM,
+    PuntoControlReproceso,
+    ResumenSemanal,
+    RevisionLectura,
+    TrabajoOCR,
+)
+from .services import cache_http, metricas, semanas
+from .services.cache_ocr import CacheOCRBD
+from .services.cola_ocr import ejecutar_trabajo, reclamar_siguiente_trabajo
+from .services.estado import recalcular_estado
+from .services.limpieza_media import caducar_fotos_antiguas, caducar_miniaturas_cerradas
+from .services.miniaturas import foto_para_adjuntar, nombre_miniatura
+from .services.ocr import FakeBackend, ResultadoOCR, extraer_km_desde_imagen
+from .services.ocr_local import reconocer_km
+from .services.openai_km import (
+    get_cliente_ocr,
+    precalentar_al_servir,
+    preprocesar_imagen,
+    reiniciar_cliente_ocr,
+    version_ocr,
+)
+from .services.outbox import enviar_pendientes
+from .services.procesamiento import iso_week_year
+from .services.reproceso import aplicar_revision
+from .services.resiliencia import ServicioNoDisponible, llamar_con_proteccion
+from .uploads import LimiteTamanoUploadHandler
+from .views import EstadoLecturasAsyncView, LecturasAsyncView
+
+
+def _foto_jpeg() -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (640, 480), "white").save(buf, "JPEG")
+    return buf.getvalue()
+
+
+def _lectura(comercial, tipo=LecturaCuentaKM.INICIO, semana=1, anio=2026, km=None, *, con_fotos=False, **campos):
+    if con_fotos:
+        # solo los nombres: los tests que las usan no abren los ficheros
+        campos.setdefault("imagen", f"lecturas/{comercial.pk}_{tipo}_{semana}.jpg")
+        campos.setdefault("miniatura", f"lecturas/{comercial.pk}_{tipo}_{semana}_min.jpg")
+    return LecturaCuentaKM.objects.create(
+        comercial=comercial, tipo_lectura=tipo, semana=semana, anio=anio, kilometros=km, **campos
+    )
+
+
+def _ocr_lento(ruta_imagen, perfil=None):
+    time.sleep(0.5)
+    return 123456
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    CUENTAKM_OCR_ASYNC=False,
+    CUENTAKM_OCR_CACHE="",
+)
+class SubidasConcurrentesTests(LiveServerTestCase):
+    """
+    Subidas simultáneas contra un servidor real (varios hilos, una conexión a
+    la BD por hilo): la validación + alta de la lectura no debe dejar pasar dos.
+    """
+
+    def _subir(self, comercial_id, tipo, resultados):
+        r = requests.post(
+            f"{self.live_server_url}/api/lecturas/",
+            data={"comercial_id": comercial_id, "tipo_lectura": tipo},
+            files={"imagen": ("foto.jpg", _foto_jpeg(), "image/jpeg")},
+            timeout=30,
+        )
+        resultados.append(r.status_code)
+
+    def _en_paralelo(self, peticiones):
+        resultados = []
+        hilos = [threading.Thread(target=self._subir, args=(*p, resultados)) for p in peticiones]
+        inicio = time.monotonic()
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+        return resultados, time.monotonic() - inicio
+
+    @mock.patch("lecturas.services.procesamiento.extraer_km_desde_imagen", side_effect=_ocr_lento)
+    def test_solo_una_lectura_por_comercial_y_semana(self, _ocr):
+        comercial = Comercial.objects.create(nombre="Concurrente")
+
+        resultados, _ = self._en_paralelo([(comercial.id, LecturaCuentaKM.INICIO)] * 8)
+
+        self.assertEqual(resultados.count(201), 1, resultados)
+        self.assertTrue(all(codigo in (201, 400, 409) for codigo in resultados), resultados)
+        self.assertEqual(LecturaCuentaKM.objects.filter(comercial=comercial).count(), 1)
+
+    @mock.patch("lecturas.services.procesamiento.extraer_km_desde_imagen", side_effect=_ocr_lento)
+    def test_ocr_fuera_del_bloqueo(self, _ocr):
+        comerciales = [Comercial.objects.create(nombre=f"Comercial {i}") for i in range(4)]
+
+        resultados, duracion = self._en_paralelo([(c.id, LecturaCuentaKM.INICIO) for c in comerciales])
+
+        self.assertEqual(resultados, [201] * 4)
+        # con el OCR dentro del bloqueo tardaría 4 x 0,5 s
+        self.assertLess(duracion, 1.5)
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    CUENTAKM_OCR_ASYNC=False,
+    CUENTAKM_OCR_CACHE="",
+    CUENTAKM_LOTE_HILOS=8,
+)
+class SubidaPorLotesTests(LiveServerTestCase):
+
+    def test_lote_en_paralelo(self):
+        en_vuelo, pico, leidos = 0, 0, []
+        lock = threading.Lock()
+
+        def ocr(ruta_imagen, perfil=None):
+            nonlocal en_vuelo, pico
+            with lock:
+                en_vuelo += 1
+                pico = max(pico, en_vuelo)
+            with open(ruta_imagen, "rb") as f:
+                leidos.append(len(f.read()))
+            time.sleep(0.2)
+            with lock:
+                en_vuelo -= 1
+            return 123456
+
+        comerciales = [Comercial.objects.create(nombre=f"Lote {i}") for i in range(6)]
+        items = [
+            {"comercial_id": c.id, "tipo_lectura": LecturaCuentaKM.INICIO, "imagen": f"foto{i}"}
+            for i, c in enumerate(comerciales)
+        ]
+        # el mismo comercial abre y cierra la semana en el lote: van en orden
+        items.append({"comercial_id": comerciales[0].id, "tipo_lectura": LecturaCuentaKM.FIN, "imagen": "foto_fin"})
+        items.append({"comercial_id": comerciales[1].id, "tipo_lectura": LecturaCuentaKM.INICIO, "imagen": "no_existe"})
+        foto = _foto_jpeg()
+        ficheros = {item["imagen"]: (f"{item['imagen']}.jpg", foto, "image/jpeg") for item in items[:-1]}
+
+        with mock.patch("lecturas.services.procesamiento.extraer_km_desde_imagen", side_effect=ocr):
+            r = requests.post(
+                f"{self.live_server_url}/api/lecturas/lote/",
+                data={"items": json.dumps(items)},
+                files=ficheros,
+                timeout=30,
+            )
+
+        self.assertEqual(r.status_code, 200, r.text)
+        resultados = r.json()["resultados"]
+        self.assertEqual([f["status"] for f in resultados], [201] * 7 + [400])
+        self.assertEqual(resultados[6]["resultado"]["kms_semana"], 0)
+        self.assertEqual(resultados[7]["error"], "Falta imagen")
+        # cada foto llega entera al OCR, y varias a la vez (sin medir tiempos)
+        self.assertEqual(leidos, [len(foto)] * 7)
+        self.assertGreater(pico, 1)
+
+
+async def _aocr_lento(ruta_imagen, perfil=None):
+    await asyncio.sleep(0.5)
+    return 123456
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    CUENTAKM_OCR_ASYNC=False,
+    CUENTAKM_OCR_CACHE="",
+    CUENTAKM_EMAIL_OUTBOX=False,
+)
+class VistasAsyncTests(TestCase):
+    """
+    LecturasAsyncView: las esperas al OCR se solapan en un solo hilo y los
+    emails van a la outbox en vez de enviarse durante la petición.
+    """
+
+    def setUp(self):
+        # la BD de tests reutiliza ids: que no se cuele el estado cacheado por otro test
+        cache.clear()
+
+    async def _subir(self, comercial_id, tipo):
+        request = AsyncRequestFactory().post(
+            "/api/lecturas/",
+            {
+                "comercial_id": comercial_id,
+                "tipo_lectura": tipo,
+                "imagen": SimpleUploadedFile("foto.jpg", _foto_jpeg(), "image/jpeg"),
+            },
+        )
+        respuesta = await LecturasAsyncView.as_view()(request)
+        # lo que hace el handler ASGI al terminar (cierra los temporales subidos)
+        request.close()
+        return respuesta.status_code, json.loads(respuesta.content)
+
+    @mock.patch("lecturas.services.procesamiento.aextraer_km_desde_imagen", side_effect=_aocr_lento)
+    async def test_subidas_en_vuelo_en_un_hilo(self, _ocr):
+        comerciales = [await Comercial.objects.acreate(nombre=f"Async {i}") for i in range(8)]
+
+        inicio = time.monotonic()
+        resultados = await asyncio.gather(*(self._subir(c.id, LecturaCuentaKM.INICIO) for c in comerciales))
+        duracion = time.monotonic() - inicio
+
+        self.assertEqual([codigo for codigo, _ in resultados], [201] * 8)
+        # 8 OCR de 0,5 s esperando a la vez, no uno tras otro
+        self.assertLess(duracion, 1.5)
+
+    @mock.patch("lecturas.services.procesamiento.aextraer_km_desde_imagen", side_effect=_aocr_lento)
+    async def test_fin_de_semana_encola_el_email(self, _ocr):
+        comercial = await Comercial.objects.acreate(nombre="Async fin")
+
+        await self._subir(comercial.id, LecturaCuentaKM.INICIO)
+        codigo, data = await self._subir(comercial.id, LecturaCuentaKM.FIN)
+
+        self.assertEqual(codigo, 201, data)
+        self.assertEqual(data["kms_semana"], 0)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(await EmailOutbox.objects.acount(), 1)
+
+        # mismo formato que la vista DRF, ETag incluido
+        request = AsyncRequestFactory().get("/api/lecturas/estado/", {"comercial_id": comercial.id})
+        respuesta = await EstadoLecturasAsyncView.as_view()(request)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(json.loads(respuesta.content)["allowed_types"], [LecturaCuentaKM.INICIO])
+        self.assertIn("ETag", respuesta)
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    OPENAI_API_KEY="x",
+    CUENTAKM_OCR_BACKEND="openai",
+    CUENTAKM_OCR_ASYNC=False,
+    CUENTAKM_OCR_CACHE="",
+    CUENTAKM_OCR_MAX_POR_MINUTO=0,
+)
+class SimulacionTests(TestCase):
+    """
+    Los sustitutos de benchmark_carga: el cliente OCR real habla con el
+    servidor falso y la foto sintética la lee también el OCR local.
+    """
+
+    def test_subida_contra_vision_falsa(self):
+        comercial = Comercial.objects.create(nombre="Bench")
+        with ServidorVisionFalso(latencia=0, respuestas=["Km: {km}"], km_inicial=235977) as servidor:
+            with override_settings(OPENAI_BASE_URL=servidor.url):
+                reiniciar_cliente_ocr()
+                try:
+                    respuesta = self.client.post(
+                        "/api/lecturas/",
+                        {
+                            "comercial_id": comercial.id,
+                            "tipo_lectura": LecturaCuentaKM.INICIO,
+                            "imagen": SimpleUploadedFile("foto.jpg", foto_cuentakm(235977), "image/jpeg"),
+                        },
+                    )
+                finally:
+                    reiniciar_cliente_ocr()
+
+        self.assertEqual(respuesta.status_code, 201, respuesta.content)
+        self.assertEqual(respuesta.json()["kilometros"], 235977)
+        self.assertEqual(servidor.peticiones, 1)
+
+    def test_foto_sintetica_legible_en_local(self):
+        self.assertEqual(reconocer_km(io.BytesIO(foto_cuentakm(48213)))[0], 48213)
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    CUENTAKM_OCR_ASYNC=False,
+    CUENTAKM_OCR_CACHE="",
+    CUENTAKM_OCR_ENCOLAR_SI_NO_DISPONIBLE=True,
+)
+class InicioEnColaTests(TestCase):
+    """
+    Con el OCR caído el inicio queda en la cola sin km: el fin que llega
+    después se encola detrás en vez de fallar, y el worker los cierra en orden.
+    """
+
+    @mock.patch(
+        "lecturas.services.procesamiento.extraer_km_desde_imagen",
+        side_effect=[ServicioNoDisponible("caído"), 101000, 100000],
+    )
+    def test_fin_espera_al_inicio(self, _ocr):
+        comercial = Comercial.objects.create(nombre="Cola")
+
+        def subir(tipo):
+            return self.client.post(
+                "/api/lecturas/",
+                {
+                    "comercial_id": comercial.id,
+                    "tipo_lectura": tipo,
+                    "imagen": SimpleUploadedFile("foto.jpg", _foto_jpeg(), "image/jpeg"),
+                },
+            )
+
+        self.assertEqual(subir(LecturaCuentaKM.INICIO).status_code, 202)
+        self.assertEqual(subir(LecturaCuentaKM.FIN).status_code, 202)
+
+        while (trabajo := reclamar_siguiente_trabajo()) is not None:
+            ejecutar_trabajo(trabajo)
+
+        fin = TrabajoOCR.objects.order_by("created_at").last()
+        self.assertEqual(fin.estado, TrabajoOCR.COMPLETADO)
+        self.assertEqual(fin.resultado["kms_semana"], 1000)
+        # el fin ya tenía sus km: el worker solo repite el OCR del inicio
+        self.assertEqual(_ocr.call_count, 3)
+
+    @mock.patch(
+        "lecturas.services.procesamiento.extraer_km_desde_imagen",
+        side_effect=[ServicioNoDisponible("caído"), 101000],
+    )
+    def test_fin_no_se_reclama_con_el_inicio_sin_terminar(self, _ocr):
+        comercial = Comercial.objects.create(nombre="Cola en orden")
+        for tipo in (LecturaCuentaKM.INICIO, LecturaCuentaKM.FIN):
+            respuesta = self.client.post(
+                "/api/lecturas/",
+                {
+                    "comercial_id": comercial.id,
+                    "tipo_lectura": tipo,
+                    "imagen": SimpleUploadedFile("foto.jpg", _foto_jpeg(), "image/jpeg"),
+                },
+            )
+            self.assertEqual(respuesta.status_code, 202)
+
+        inicio = reclamar_siguiente_trabajo()
+        self.assertEqual(inicio.lectura.tipo_lectura, LecturaCuentaKM.INICIO)
+        # con el inicio EN_PROCESO el fin no está listo: el worker deja de vaciar
+        self.assertIsNone(reclamar_siguiente_trabajo())
+
+    @mock.patch(
+        "lecturas.services.procesamiento.extraer_km_desde_imagen", side_effect=ServicioNoDisponible("caído")
+    )
+    def test_trabajo_solo_por_su_clave(self, _ocr):
+        comercial = Comercial.objects.create(nombre="Cola con clave")
+        respuesta = self.client.post(
+            "/api/lecturas/",
+            {
+                "comercial_id": comercial.id,
+                "tipo_lectura": LecturaCuentaKM.INICIO,
+                "imagen": SimpleUploadedFile("foto.jpg", _foto_jpeg(), "image/jpeg"),
+            },
+        )
+        self.assertEqual(respuesta.status_code, 202)
+        data = respuesta.json()
+
+        estado = self.client.get(data["status_url"])
+        self.assertEqual(estado.status_code, 200)
+        self.assertEqual(estado.json()["job_id"], data["job_id"])
+        # el pk correlativo ya no sirve para ver trabajos ajenos
+        trabajo = TrabajoOCR.objects.get()
+        self.assertEqual(self.client.get(f"/api/lecturas/trabajos/{trabajo.pk}/").status_code, 404)
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    CUENTAKM_OCR_COLA_ESPERA_BASE=30,
+    CUENTAKM_OCR_COLA_ESPERA_MAX=600,
+)
+class ReintentosColaTests(TestCase):
+    """
+    Un trabajo cuyo OCR falla vuelve a la cola con una espera antes del
+    siguiente intento, y no se reclama hasta que pasa.
+    """
+
+    @mock.patch("lecturas.services.procesamiento.extraer_km_desde_imagen", side_effect=ValueError("ilegible"))
+    def test_fallo_espera_antes_de_reintentar(self, _ocr):
+        comercial = Comercial.objects.create(nombre="Reintentos")
+        hoy = timezone.localdate()
+        semana, anio = iso_week_year(hoy)
+        lectura = LecturaCuentaKM.objects.create(
+            comercial=comercial,
+            tipo_lectura=LecturaCuentaKM.INICIO,
+            semana=semana,
+            anio=anio,
+            imagen=SimpleUploadedFile("foto.jpg", _foto_jpeg(), "image/jpeg"),
+        )
+        TrabajoOCR.objects.create(lectura=lectura)
+
+        ejecutar_trabajo(reclamar_siguiente_trabajo())
+        trabajo = TrabajoOCR.objects.get()
+        self.assertEqual(trabajo.estado, TrabajoOCR.PENDIENTE)
+        self.assertGreater(trabajo.no_antes_de, timezone.now() + timezone.timedelta(seconds=20))
+        self.assertIsNone(reclamar_siguiente_trabajo())
+
+        TrabajoOCR.objects.update(no_antes_de=timezone.now())
+        self.assertEqual(reclamar_siguiente_trabajo().pk, trabajo.pk)
+
+
+@override_settings(
+    CUENTAKM_OCR_MAX_POR_MINUTO=0,
+    CUENTAKM_OCR_REINTENTOS=2,
+    CUENTAKM_OCR_BACKOFF_BASE=0,
+    CUENTAKM_OCR_CIRCUITO_FALLOS=5,
+)
+class ResilienciaTests(TestCase):
+    """
+    Qué se reintenta dentro de la petición y cuándo se escribe el estado
+    compartido del cortacircuitos.
+    """
+
+    def test_timeout_de_lectura_no_se_reintenta(self):
+        llamada = mock.Mock(side_effect=TimeoutError("read timeout"))
+        with self.assertRaises(ServicioNoDisponible):
+            llamar_con_proteccion("prueba", llamada)
+        self.assertEqual(llamada.call_count, 1)
+        self.assertEqual(EstadoServicioExterno.objects.get(nombre="prueba").fallos_seguidos, 1)
+
+    def test_error_de_conexion_se_reintenta(self):
+        llamada = mock.Mock(side_effect=[ConnectionError("reset"), 42])
+        self.assertEqual(llamar_con_proteccion("prueba", llamada), 42)
+        self.assertEqual(llamada.call_count, 2)
+        self.assertEqual(EstadoServicioExterno.objects.get(nombre="prueba").fallos_seguidos, 0)
+
+    def test_llamada_buena_con_circuito_cerrado_no_escribe(self):
+        EstadoServicioExterno.objects.create(nombre="prueba")
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(llamar_con_proteccion("prueba", lambda: 42), 42)
+        escrituras = [q["sql"] for q in consultas if not q["sql"].lstrip().upper().startswith("SELECT")]
+        self.assertEqual(escrituras, [])
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    CUENTAKM_OCR_BACKEND="fake",
+    CUENTAKM_OCR_ASYNC=False,
+    CUENTAKM_OCR_CACHE="",
+    CUENTAKM_SERVER_TIMING=True,
+    CUENTAKM_METRICAS_TOKEN="secreto",
+)
+class MetricasTests(TestCase):
+    """
+    Server-Timing por etapa en la respuesta y las mismas medidas en /metrics.
+    """
+
+    def setUp(self):
+        # la BD de tests reutiliza ids: que no se cuele el estado cacheado por otro test
+        cache.clear()
+
+    def test_server_timing_y_metrics(self):
+        comercial = Comercial.objects.create(nombre="Métricas")
+        respuesta = self.client.post(
+            "/api/lecturas/",
+            {
+                "comercial_id": comercial.id,
+                "tipo_lectura": LecturaCuentaKM.INICIO,
+                "imagen": SimpleUploadedFile("km_123456.jpg", _foto_jpeg(), "image/jpeg"),
+            },
+        )
+        self.assertEqual(respuesta.status_code, 201, respuesta.content)
+        etapas = [parte.split(";")[0] for parte in respuesta["Server-Timing"].split(", ")]
+        for etapa in ("guardar_imagen", "ocr", "miniatura", "db", "total"):
+            self.assertIn(etapa, etapas)
+
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        with self.settings(CUENTAKM_METRICAS_TOKEN=""):
+            self.assertEqual(self.client.get("/metrics").status_code, 404)
+            with self.settings(DEBUG=True):
+                self.assertEqual(self.client.get("/metrics").status_code, 200)
+        texto = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secreto").content.decode()
+        self.assertIn('cuentakm_etapa_segundos_bucket{etapa="ocr",le="+Inf"}', texto)
+        self.assertIn('cuentakm_peticiones_total{codigo="201",ruta="lecturas"}', texto)
+        self.assertIn('cuentakm_consultas_por_peticion_count{ruta="lecturas"}', texto)
+        self.assertIn('cuentakm_emails_outbox{estado="error"} 0', texto)
+
+    async def test_server_timing_en_asgi(self):
+        comercial = await Comercial.objects.acreate(nombre="Métricas async")
+        respuesta = await self.async_client.get("/api/lecturas/estado/", {"comercial_id": comercial.id})
+        self.assertEqual(respuesta.status_code, 200)
+        # las consultas se hacen en el hilo de sync_to_async y aun así se cuentan
+        self.assertRegex(respuesta["Server-Timing"], r'db;dur=[\d.]+;desc="[1-9]\d* consultas"')
+
+
+class CacheHttpTests(TestCase):
+    """
+    ETag de /api/lecturas/estado/: 304 mientras no cambie nada, 200 tras
+    guardar una lectura, y versiones que caducan si la caché no es compartida.
+    """
+
+    def setUp(self):
+        # la BD de tests reutiliza ids: que no se cuele el estado cacheado por otro test
+        cache.clear()
+
+    def test_304_e_invalidacion(self):
+        comercial = Comercial.objects.create(nombre="ETag")
+        url = f"/api/lecturas/estado/?comercial_id={comercial.id}"
+
+        primera = self.client.get(url)
+        self.assertEqual(primera.status_code, 200)
+        etag = primera["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        semana, anio = iso_week_year(timezone.localdate())
+        with self.captureOnCommitCallbacks(execute=True):
+            _lectura(comercial, semana=semana, anio=anio, km=1000)
+
+        segunda = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(segunda.status_code, 200)
+        self.assertNotEqual(segunda["ETag"], etag)
+        self.assertEqual(segunda.json()["allowed_types"], [LecturaCuentaKM.FIN])
+
+    @override_settings(CUENTAKM_HTTP_CACHE_TTL_LOCAL=7)
+    def test_version_con_cache_local_caduca(self):
+        self.assertEqual(cache_http.ttl_version(), 7)
+
+    @override_settings(
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            "compartida": {
+                "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                "LOCATION": tempfile.mkdtemp(),
+            },
+        },
+        CUENTAKM_HTTP_CACHE_ALIAS="compartida",
+    )
+    def test_version_con_cache_compartida_no_caduca(self):
+        self.assertIsNone(cache_http.ttl_version())
+
+
+class RetencionFotosTests(TestCase):
+    """
+    Retención de fotos: las de semanas que nunca se cerraron caducan antes;
+    las miniaturas de semanas cerradas tienen su propio plazo.
+    """
+
+    def test_solo_semanas_abiertas(self):
+        comercial = Comercial.objects.create(nombre="Retención")
+        abierta = _lectura(comercial, LecturaCuentaKM.INICIO, 10, km=1000, con_fotos=True)
+        cerrada_inicio = _lectura(comercial, LecturaCuentaKM.INICIO, 11, km=1000, con_fotos=True)
+        cerrada_fin = _lectura(comercial, LecturaCuentaKM.FIN, 11, km=1000, con_fotos=True)
+        reciente = _lectura(comercial, LecturaCuentaKM.INICIO, 12, km=1000, con_fotos=True)
+        LecturaCuentaKM.objects.exclude(pk=reciente.pk).update(created_at=timezone.now() - timezone.timedelta(days=60))
+
+        self.assertEqual(caducar_fotos_antiguas(30), 1)
+
+        abierta.refresh_from_db()
+        self.assertFalse(abierta.imagen)
+        self.assertFalse(abierta.miniatura)
+        for lectura in (cerrada_inicio, cerrada_fin, reciente):
+            lectura.refresh_from_db()
+            self.assertTrue(lectura.miniatura)
+        self.assertEqual(caducar_fotos_antiguas(0), 0)
+
+    def test_miniaturas_de_semanas_cerradas(self):
+        comercial = Comercial.objects.create(nombre="Retención miniaturas")
+        abierta = _lectura(comercial, LecturaCuentaKM.INICIO, 10, km=1000, con_fotos=True)
+        cerrada = [
+            _lectura(comercial, LecturaCuentaKM.INICIO, 11, km=1000, con_fotos=True),
+            _lectura(comercial, LecturaCuentaKM.FIN, 11, km=1200, con_fotos=True),
+        ]
+        reciente = _lectura(comercial, LecturaCuentaKM.INICIO, 12, km=1200, con_fotos=True)
+        _lectura(comercial, LecturaCuentaKM.FIN, 12, km=1300, con_fotos=True)
+        LecturaCuentaKM.objects.filter(semana__in=(10, 11)).update(
+            created_at=timezone.now() - timezone.timedelta(days=200)
+        )
+
+        self.assertEqual(caducar_miniaturas_cerradas(0), 0)
+        self.assertEqual(caducar_miniaturas_cerradas(180), 2)
+        for lectura in cerrada:
+            lectura.refresh_from_db()
+            self.assertFalse(lectura.miniatura)
+        for lectura in (abierta, reciente):
+            lectura.refresh_from_db()
+            self.assertTrue(lectura.miniatura)
+
+
+class InformeSemanalTests(TestCase):
+    """
+    /api/informes/semanal/: km de todos los comerciales, solo para staff.
+    """
+
+    URL = "/api/informes/semanal/"
+
+    def test_solo_staff(self):
+        usuarios = get_user_model().objects
+        self.assertEqual(self.client.get(self.URL).status_code, 403)
+
+        self.client.force_login(usuarios.create_user("comercial", password="x"))
+        self.assertEqual(self.client.get(self.URL).status_code, 403)
+
+        self.client.force_login(usuarios.create_user("admin", password="x", is_staff=True))
+        self.assertEqual(self.client.get(self.URL).status_code, 200)
+
+    def test_empareja_inicio_y_fin_por_semana(self):
+        ana = Comercial.objects.create(nombre="Ana")
+        luis = Comercial.objects.create(nombre="Luis")
+        _lectura(ana, LecturaCuentaKM.INICIO, 1, km=1000)
+        _lectura(ana, LecturaCuentaKM.FIN, 1, km=1250)
+        _lectura(luis, LecturaCuentaKM.INICIO, 1, km=500)
+        _lectura(ana, LecturaCuentaKM.INICIO, 2, km=1260)
+        self.client.force_login(get_user_model().objects.create_user("admin", password="x", is_staff=True))
+
+        with CaptureQueriesContext(connection) as consultas:
+            pagina = self.client.get(self.URL, {"limite": 2}).json()
+        informe = [q["sql"] for q in consultas.captured_queries if "lecturas_lecturacuentakm" in q["sql"]]
+        self.assertEqual(len(informe), 1)
+
+        filas = [(f["comercial"]["nombre"], f["semana"], f["km_inicio"], f["km_fin"], f["kms"], f["cerrada"])
+                 for f in pagina["resultados"]]
+        self.assertEqual(filas, [("Ana", 1, 1000, 1250, 250, True), ("Luis", 1, 500, None, None, False)])
+
+        siguiente = self.client.get(self.URL, {"limite": 2, "cursor": pagina["siguiente"]}).json()
+        self.assertEqual([(f["comercial"]["nombre"], f["semana"]) for f in siguiente["resultados"]], [("Ana", 2)])
+        self.assertIsNone(siguiente["siguiente"])
+
+        # 2026-01-05 es el lunes de la semana ISO 2
+        filtrado = self.client.get(self.URL, {"desde": "2026-01-05", "comercial_id": luis.id}).json()
+        self.assertEqual(filtrado["resultados"], [])
+        self.assertEqual(self.client.get(self.URL, {"cursor": "x"}).status_code, 400)
+
+
+class ExportarTests(TestCase):
+    """
+    /api/exportar/: CSV completo, solo para staff.
+    """
+
+    def test_solo_staff(self):
+        usuarios = get_user_model().objects
+        for que in ("lecturas", "semanal"):
+            self.assertEqual(self.client.get(f"/api/exportar/{que}/").status_code, 403)
+
+        self.client.force_login(usuarios.create_user("comercial", password="x"))
+        self.assertEqual(self.client.get("/api/exportar/lecturas/").status_code, 403)
+
+        self.client.force_login(usuarios.create_user("admin", password="x", is_staff=True))
+        for que in ("lecturas", "semanal"):
+            respuesta = self.client.get(f"/api/exportar/{que}/")
+            self.assertEqual(respuesta.status_code, 200)
+            self.assertTrue(respuesta["Content-Type"].startswith("text/csv"))
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    CUENTAKM_UPLOAD_MAX_BYTES=100 * 1024,
+    CUENTAKM_UPLOAD_LOTE_MAX_BYTES=1024 * 1024,
+)
+class LimiteSubidaTests(TestCase):
+    """
+    El rechazo temprano por Content-Length usa el límite de cada vista: el de
+    una foto en /api/lecturas/ y el del lote entero en /api/lecturas/lote/.
+    """
+
+    def _fotos(self):
+        # 80 KB cada una: ninguna supera el límite por foto, las tres juntas el de una subida simple
+        return {
+            nombre: SimpleUploadedFile(f"{nombre}.jpg", b"x" * 80 * 1024, "image/jpeg")
+            for nombre in ("imagen", "foto1", "foto2")
+        }
+
+    def test_subida_simple_se_rechaza_sin_leer_el_cuerpo(self):
+        comercial = Comercial.objects.create(nombre="Límite")
+        with mock.patch.object(
+            LimiteTamanoUploadHandler, "receive_data_chunk", autospec=True
+        ) as recibir:
+            respuesta = self.client.post(
+                "/api/lecturas/",
+                {"comercial_id": comercial.id, "tipo_lectura": LecturaCuentaKM.INICIO, **self._fotos()},
+            )
+        self.assertEqual(respuesta.status_code, 413)
+        recibir.assert_not_called()
+
+    def test_lote_usa_su_propio_limite(self):
+        with mock.patch("lecturas.views.procesar_lote", return_value=[]) as procesar:
+            respuesta = self.client.post("/api/lecturas/lote/", {"items": "[{}]", **self._fotos()})
+        self.assertEqual(respuesta.status_code, 200, respuesta.content)
+        procesar.assert_called_once()
+
+    @override_settings(CUENTAKM_UPLOAD_LOTE_MAX_BYTES=200 * 1024)
+    def test_lote_demasiado_grande(self):
+        respuesta = self.client.post("/api/lecturas/lote/", {"items": "[{}]", **self._fotos()})
+        self.assertEqual(respuesta.status_code, 413)
+
+
+@override_settings(CUENTAKM_OCR_BACKEND="fake", CUENTAKM_OCR_PERFIL="equilibrado")
+class CacheOCRTests(TestCase):
+    """
+    Caché de OCR por hash de la foto + versión (modelo, prompt y preprocesado).
+    """
+
+    def _foto(self, nombre="km_123456.jpg"):
+        ruta = f"{tempfile.mkdtemp()}/{nombre}"
+        with open(ruta, "wb") as f:
+            f.write(_foto_jpeg())
+        return ruta
+
+    @override_settings(CUENTAKM_OCR_CACHE="")
+    def test_sin_cache_no_se_calcula_la_clave(self):
+        with mock.patch("lecturas.services.ocr.clave_cache_ocr_fichero") as clave:
+            self.assertEqual(extraer_km_desde_imagen(self._foto()), 123456)
+        clave.assert_not_called()
+
+    def test_version_incluye_el_preprocesado_aplicado(self):
+        base, gris = version_ocr(), version_ocr("gris")
+        with override_settings(CUENTAKM_OCR_MAX_LADO=800):
+            self.assertNotEqual(version_ocr(), base)
+            # MAX_LADO/CALIDAD solo se aplican al perfil por defecto
+            self.assertEqual(version_ocr("gris"), gris)
+        with override_settings(CUENTAKM_OCR_CALIDAD=60):
+            self.assertNotEqual(version_ocr(), base)
+
+    @override_settings(CUENTAKM_OCR_CACHE="bd")
+    def test_acierto_no_repite_el_ocr(self):
+        ruta = self._foto()
+        with mock.patch.object(
+            FakeBackend, "leer", autospec=True, return_value=ResultadoOCR(123456, 1.0, "123456", "fake")
+        ) as leer:
+            self.assertEqual(extraer_km_desde_imagen(ruta), 123456)
+            self.assertEqual(extraer_km_desde_imagen(ruta), 123456)
+            self.assertEqual(leer.call_count, 1)
+
+            # otra foto (otros bytes) no acierta
+            otra = self._foto()
+            with open(otra, "ab") as f:
+                f.write(b"\0")
+            extraer_km_desde_imagen(otra)
+            self.assertEqual(leer.call_count, 2)
+
+    def test_desalojo_de_caducadas_y_antiguas(self):
+        cache = CacheOCRBD(ttl=3600, max_entradas=2)
+        ahora = timezone.now()
+        for horas, clave in ((3, "a"), (2, "b")):
+            cache.set(clave, 1, "1")
+            CacheOCR.objects.filter(clave=clave).update(created_at=ahora - timezone.timedelta(hours=horas))
+        cache.set("caducada", 1, "1")
+        CacheOCR.objects.filter(clave="caducada").update(expira_en=ahora - timezone.timedelta(seconds=1))
+        self.assertIsNone(cache.get("caducada"))
+
+        cache.set("c", 3, "3")
+        # fuera la caducada y, por encima de max_entradas, la más antigua
+        self.assertEqual(set(CacheOCR.objects.values_list("clave", flat=True)), {"b", "c"})
+        self.assertEqual(cache.get("c"), {"km": 3, "texto": "3"})
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    CUENTAKM_OCR_BACKEND="fake",
+    CUENTAKM_OCR_ASYNC=False,
+    CUENTAKM_OCR_CACHE="",
+    CUENTAKM_IDEMPOTENCIA_RETRY_AFTER=7,
+)
+class IdempotenciaTests(TestCase):
+    """
+    Idempotency-Key en POST /api/lecturas/.
+    """
+
+    def _subir(self, comercial, clave, foto="km_123456.jpg", tipo=LecturaCuentaKM.INICIO):
+        return self.client.post(
+            "/api/lecturas/",
+            {
+                "comercial_id": comercial.id,
+                "tipo_lectura": tipo,
+                "imagen": SimpleUploadedFile(foto, _foto_jpeg(), "image/jpeg"),
+            },
+            HTTP_IDEMPOTENCY_KEY=clave,
+        )
+
+    def test_en_curso_responde_409_sin_esperar(self):
+        comercial = Comercial.objects.create(nombre="Idempotencia en curso")
+        with mock.patch("lecturas.services.idempotencia.huella_peticion", return_value="h"):
+            ClaveIdempotencia.objects.create(
+                clave="k1", huella="h", expira_en=timezone.now() + timezone.timedelta(hours=1)
+            )
+            inicio = time.monotonic()
+            respuesta = self._subir(comercial, "k1")
+        self.assertEqual(respuesta.status_code, 409)
+        self.assertEqual(respuesta["Retry-After"], "7")
+        self.assertLess(time.monotonic() - inicio, 5)
+        self.assertFalse(LecturaCuentaKM.objects.filter(comercial=comercial).exists())
+
+    def test_reintento_repite_la_respuesta_guardada(self):
+        comercial = Comercial.objects.create(nombre="Idempotencia repetida")
+        primera = self._subir(comercial, "k2")
+        self.assertLess(primera.status_code, 300, primera.content)
+        self.assertNotIn("Idempotent-Replayed", primera)
+
+        repetida = self._subir(comercial, "k2")
+        self.assertEqual(repetida.status_code, primera.status_code)
+        self.assertEqual(repetida["Idempotent-Replayed"], "true")
+        self.assertEqual(repetida.json(), primera.json())
+        self.assertEqual(LecturaCuentaKM.objects.filter(comercial=comercial).count(), 1)
+
+    def test_misma_clave_con_otra_peticion_es_422(self):
+        comercial = Comercial.objects.create(nombre="Idempotencia reutilizada")
+        self._subir(comercial, "k3")
+        respuesta = self._subir(comercial, "k3", foto="km_654321.jpg", tipo=LecturaCuentaKM.FIN)
+        self.assertEqual(respuesta.status_code, 422)
+        self.assertEqual(LecturaCuentaKM.objects.filter(comercial=comercial).count(), 1)
+        self.assertEqual(self._subir(comercial, "x" * 256).status_code, 400)
+
+
+@override_settings(OPENAI_API_KEY="prueba", CUENTAKM_OCR_PRECALENTAR="arranque")
+class PrecalentadoTests(TestCase):
+    """
+    El cliente OCR se precalienta al servir, no en cada comando de manage.py.
+    """
+
+    def test_ready_no_precalienta(self):
+        with mock.patch("lecturas.services.openai_km.get_cliente_ocr") as cliente:
+            apps.get_app_config("lecturas").ready()
+        cliente.assert_not_called()
+
+    def test_al_servir_si(self):
+        with mock.patch("lecturas.services.openai_km.get_cliente_ocr") as cliente:
+            precalentar_al_servir()
+        cliente.assert_called_once()
+
+
+@override_settings(
+    OPENAI_API_KEY="prueba",
+    OPENAI_BASE_URL="http://ocr.invalid/v1",
+    CUENTAKM_OCR_CONNECT_TIMEOUT=2.5,
+    CUENTAKM_OCR_READ_TIMEOUT=12.0,
+)
+class ClienteOCRTests(TestCase):
+    """
+    Un cliente OCR por proceso: una sola sesión HTTP (pool de conexiones)
+    para todas las lecturas, con los timeouts configurados.
+    """
+
+    def setUp(self):
+        reiniciar_cliente_ocr()
+        self.addCleanup(reiniciar_cliente_ocr)
+
+    def test_una_sesion_con_los_timeouts_configurados(self):
+        envios = []
+
+        def send(adapter, peticion, **kwargs):
+            envios.append((adapter, kwargs["timeout"]))
+            respuesta = requests.Response()
+            respuesta.status_code = 200
+            respuesta.headers["Content-Type"] = "application/json"
+            respuesta._content = json.dumps({"choices": [{"message": {"content": "123456"}}]}).encode()
+            respuesta.request, respuesta.url = peticion, peticion.url
+            return respuesta
+
+        def leer_dos_veces():
+            for _ in range(2):
+                resultados.append(get_cliente_ocr().leer("aGFsYQ==", "image/jpeg"))
+
+        # en un hilo nuevo, como un worker recién arrancado: el SDK guarda la
+        # sesión por hilo y este no debe traer una de otro test
+        resultados = []
+        with mock.patch("requests.adapters.HTTPAdapter.send", autospec=True, side_effect=send):
+            hilo = threading.Thread(target=leer_dos_veces)
+            hilo.start()
+            hilo.join()
+
+        self.assertEqual(resultados, ["123456", "123456"])
+        self.assertIs(get_cliente_ocr(), get_cliente_ocr())
+        (adaptador, timeout), (otro_adaptador, otro_timeout) = envios
+        self.assertIs(adaptador, otro_adaptador)
+        self.assertIs(adaptador, get_cliente_ocr().openai.requestssession.get_adapter("http://ocr.invalid/"))
+        self.assertEqual(timeout, (2.5, 12.0))
+        self.assertEqual(otro_timeout, (2.5, 12.0))
+
+
+class EstadoComercialTests(TestCase):
+    """
+    Mantenimiento de EstadoComercial (la fila por comercial que lee /estado/).
+    """
+
+    def test_alta_concurrente_del_estado(self):
+        comercial = Comercial.objects.create(nombre="Estado concurrente")
+        filter_real = EstadoComercial.objects.filter
+        llamadas = []
+
+        def filter_con_carrera(*args, **kwargs):
+            # el primer UPDATE no encuentra la fila; otra petición la inserta justo después
+            if not llamadas:
+                llamadas.append(1)
+                EstadoComercial.objects.create(comercial=comercial)
+                return mock.Mock(update=mock.Mock(return_value=0))
+            return filter_real(*args, **kwargs)
+
+        lectura = _lectura(comercial, km=500)
+        EstadoComercial.objects.filter(comercial=comercial).delete()
+        with mock.patch.object(EstadoComercial.objects, "filter", side_effect=filter_con_carrera):
+            recalcular_estado(comercial.id)
+
+        estado = EstadoComercial.objects.get(comercial=comercial)
+        self.assertEqual(estado.ultima_lectura_id, lectura.pk)
+        self.assertEqual(estado.ultimos_km, 500)
+
+    def test_se_mantiene_con_las_senales(self):
+        comercial = Comercial.objects.create(nombre="Estado por señales")
+        inicio = _lectura(comercial, LecturaCuentaKM.INICIO, km=100)
+        fin = _lectura(comercial, LecturaCuentaKM.FIN)
+
+        estado = EstadoComercial.objects.get(comercial=comercial)
+        self.assertEqual((estado.ultima_lectura_id, estado.ultimo_tipo), (fin.pk, LecturaCuentaKM.FIN))
+        self.assertEqual((estado.ultimo_inicio_id, estado.ultimo_fin_id), (inicio.pk, fin.pk))
+        self.assertIsNone(estado.ultimos_km)
+
+        # los km del OCR llegan después del alta
+        fin.kilometros = 350
+        fin.save(update_fields=["kilometros"])
+        estado.refresh_from_db()
+        self.assertEqual(estado.ultimos_km, 350)
+
+        fin.delete()
+        estado.refresh_from_db()
+        self.assertEqual((estado.ultima_lectura_id, estado.ultimos_km), (inicio.pk, 100))
+        self.assertIsNone(estado.ultimo_fin_id)
+
+    def test_guardado_completo_recalcula(self):
+        ana = Comercial.objects.create(nombre="Ana")
+        luis = Comercial.objects.create(nombre="Luis")
+        lectura = _lectura(ana, LecturaCuentaKM.INICIO, km=100)
+
+        # como el formulario del admin: save() sin update_fields
+        lectura.tipo_lectura = LecturaCuentaKM.FIN
+        lectura.save()
+        estado = EstadoComercial.objects.get(comercial=ana)
+        self.assertEqual((estado.ultimo_tipo, estado.ultimo_fin_id), (LecturaCuentaKM.FIN, lectura.pk))
+        self.assertIsNone(estado.ultimo_inicio_id)
+
+        lectura = LecturaCuentaKM.objects.get(pk=lectura.pk)
+        lectura.comercial = luis
+        lectura.save()
+        estado.refresh_from_db()
+        self.assertIsNone(estado.ultima_lectura_id)
+        self.assertIsNone(estado.ultimo_fin_id)
+        nuevo = EstadoComercial.objects.get(comercial=luis)
+        self.assertEqual((nuevo.ultima_lectura_id, nuevo.ultimos_km), (lectura.pk, 100))
+
+    def test_reconstruccion_desde_el_historial(self):
+        con_lecturas = Comercial.objects.create(nombre="Con lecturas")
+        sin_lecturas = Comercial.objects.create(nombre="Sin lecturas")
+        inicio = _lectura(con_lecturas, LecturaCuentaKM.INICIO, km=100)
+        fin = _lectura(con_lecturas, LecturaCuentaKM.FIN, km=300)
+        EstadoComercial.objects.all().delete()
+
+        salida = io.StringIO()
+        call_command("reconstruir_estado_comerciales", stdout=salida)
+
+        self.assertIn("2 comercial(es)", salida.getvalue())
+        estado = EstadoComercial.objects.get(comercial=con_lecturas)
+        self.assertEqual((estado.ultima_lectura_id, estado.ultimos_km), (fin.pk, 300))
+        self.assertEqual((estado.ultimo_inicio_id, estado.ultimo_fin_id), (inicio.pk, fin.pk))
+        vacio = EstadoComercial.objects.get(comercial=sin_lecturas)
+        self.assertIsNone(vacio.ultima_lectura_id)
+        self.assertEqual(vacio.ultimo_tipo, "")
+
+
+@override_settings(CUENTAKM_OCR_PERFIL="equilibrado")
+class PreprocesadoTests(TestCase):
+    """
+    Foto reducida, orientada y recomprimida antes de mandarla al modelo.
+    """
+
+    def _abrir(self, datos):
+        return Image.open(io.BytesIO(datos))
+
+    def test_reduce_y_recomprime(self):
+        original = foto_cuentakm(123456, tamano=(4000, 3000))
+        procesada, mime = preprocesar_imagen(original)
+        self.assertEqual(mime, "image/jpeg")
+        self.assertLess(len(procesada), len(original))
+        self.assertEqual(self._abrir(procesada).size, (1600, 1200))
+
+    def test_corrige_orientacion_exif_y_pasa_a_gris(self):
+        buf = io.BytesIO()
+        exif = Image.Exif()
+        exif[0x0112] = 6  # girada 90°: el móvil la guarda tumbada
+        Image.open(io.BytesIO(foto_cuentakm(123456, tamano=(3200, 2400)))).save(buf, "JPEG", exif=exif, quality=95)
+
+        procesada, _ = preprocesar_imagen(buf.getvalue(), "gris")
+        img = self._abrir(procesada)
+        self.assertEqual(img.size, (960, 1280))
+        self.assertEqual(img.mode, "L")
+
+    def test_webp_en_el_perfil_agresivo(self):
+        procesada, mime = preprocesar_imagen(foto_cuentakm(123456, tamano=(2000, 1500)), "agresivo")
+        self.assertEqual(mime, "image/webp")
+        self.assertEqual(self._abrir(procesada).format, "WEBP")
+
+    def test_se_manda_el_original(self):
+        # perfil "original", formato ilegible y foto que ya pesa menos que recomprimida
+        self.assertIsNone(preprocesar_imagen(foto_cuentakm(1, tamano=(4000, 3000)), "original")[0])
+        self.assertIsNone(preprocesar_imagen(b"esto no es una imagen")[0])
+        png = io.BytesIO()
+        Image.new("RGB", (64, 48), "black").save(png, "PNG")
+        self.assertIsNone(preprocesar_imagen(png.getvalue())[0])
+
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    CUENTAKM_BORRADO_DIFERIDO=False,
+    CUENTAKM_OUTBOX_ERROR_RETENCION_DIAS=14,
+)
+class OutboxTests(TestCase):
+    """
+    Envío de EmailOutbox: un fallo no corta el lote y se reintenta con espera.
+    """
+
+    def _encolar(self, asunto):
+        return EmailOutbox.objects.create(asunto=asunto, cuerpo="-", destinatarios=["admin@example.com"])
+
+    def test_envia_los_pendientes(self):
+        msg = self._encolar("uno")
+        futuro = self._encolar("dos")
+        EmailOutbox.objects.filter(pk=futuro.pk).update(proximo_intento=timezone.now() + timezone.timedelta(minutes=5))
+        self.assertEqual(enviar_pendientes(), (1, 0))
+        self.assertEqual([m.subject for m in mail.outbox], ["uno"])
+        msg.refresh_from_db()
+        self.assertEqual(msg.estado, EmailOutbox.ENVIADO)
+        self.assertEqual(msg.intentos, 1)
+        self.assertIsNotNone(msg.enviado_at)
+
+    def test_fallo_espera_y_acaba_en_error(self):
+        metricas.reiniciar()
+        fallido = self._encolar("falla")
+        self._encolar("sale")
+        send_real = mail.EmailMessage.send
+
+        def send(email, *args, **kwargs):
+            if email.subject == "falla":
+                raise OSError("SMTP caído")
+            return send_real(email, *args, **kwargs)
+
+        with mock.patch.object(mail.EmailMessage, "send", autospec=True, side_effect=send), \
+                self.assertLogs("lecturas.services.outbox", "ERROR"):
+            antes = timezone.now()
+            self.assertEqual(enviar_pendientes(max_intentos=2, backoff_base=60), (1, 1))
+            fallido.refresh_from_db()
+            self.assertEqual(fallido.estado, EmailOutbox.PENDIENTE)
+            self.assertEqual(fallido.intentos, 1)
+            self.assertEqual(fallido.ultimo_error, "SMTP caído")
+            espera = (fallido.proximo_intento - antes).total_seconds()
+            self.assertTrue(48 <= espera <= 73, espera)
+
+            # aún no toca: no se vuelve a intentar
+            self.assertEqual(enviar_pendientes(max_intentos=2), (0, 0))
+
+            EmailOutbox.objects.filter(pk=fallido.pk).update(proximo_intento=timezone.now())
+            self.assertEqual(enviar_pendientes(max_intentos=2), (0, 1))
+        self.assertEqual(metricas.valor("emails_fallidos"), 2)
+        self.assertEqual(metricas.valor("emails_descartados"), 1)
+        fallido.refresh_from_db()
+        self.assertEqual(fallido.estado, EmailOutbox.ERROR)
+        self.assertEqual(fallido.intentos, 2)
+        self.assertEqual([m.subject for m in mail.outbox], ["sale"])
+
+    def test_reencolar_desde_el_admin(self):
+        fallido = self._encolar("falla")
+        EmailOutbox.objects.filter(pk=fallido.pk).update(estado=EmailOutbox.ERROR, intentos=5, ultimo_error="x")
+        enviado = self._encolar("ya salió")
+        EmailOutbox.objects.filter(pk=enviado.pk).update(estado=EmailOutbox.ENVIADO, intentos=1)
+        self.client.force_login(get_user_model().objects.create_superuser("admin", "admin@example.com", "x"))
+
+        self.client.post(
+            "/admin/lecturas/emailoutbox/",
+            {"action": "reencolar", "_selected_action": [fallido.pk, enviado.pk]},
+        )
+
+        fallido.refresh_from_db()
+        self.assertEqual((fallido.estado, fallido.intentos, fallido.ultimo_error), (EmailOutbox.PENDIENTE, 0, ""))
+        self.assertEqual(EmailOutbox.objects.get(pk=enviado.pk).estado, EmailOutbox.ENVIADO)
+        self.assertEqual(enviar_pendientes(), (1, 0))
+
+    def test_adjuntos_de_emails_en_error_caducan(self):
+        def fichero(nombre):
+            return default_storage.save(f"lecturas/{nombre}", ContentFile(b"jpeg"))
+
+        def en_error(adjuntos, dias, borrar_adjuntos=True):
+            msg = EmailOutbox.objects.create(
+                asunto="falla", cuerpo="-", adjuntos=adjuntos, borrar_adjuntos=borrar_adjuntos,
+                estado=EmailOutbox.ERROR,
+            )
+            EmailOutbox.objects.filter(pk=msg.pk).update(created_at=timezone.now() - timezone.timedelta(days=dias))
+            return msg
+
+        comercial = Comercial.objects.create(nombre="Outbox en error")
+        antigua = _lectura(comercial, imagen=fichero("antigua.jpg"), miniatura=fichero("antigua_min.jpg"))
+        reciente = _lectura(comercial, LecturaCuentaKM.FIN, imagen=fichero("reciente.jpg"))
+        caducado = en_error([antigua.miniatura.name], dias=20)
+        en_error([reciente.imagen.name], dias=2)
+        suelta, suelta_reciente = fichero("suelta.jpg"), fichero("suelta_reciente.jpg")
+        en_error([suelta], dias=20, borrar_adjuntos=False)
+        en_error([suelta_reciente], dias=2, borrar_adjuntos=False)
+
+        call_command("barrer_media", gracia_minutos=0, stdout=io.StringIO())
+
+        antigua.refresh_from_db()
+        self.assertFalse(antigua.imagen)
+        self.assertTrue(default_storage.exists(antigua.miniatura.name))
+        self.assertFalse(EmailOutbox.objects.get(pk=caducado.pk).borrar_adjuntos)
+        reciente.refresh_from_db()
+        self.assertTrue(default_storage.exists(reciente.imagen.name))
+        self.assertFalse(default_storage.exists("lecturas/antigua.jpg"))
+        self.assertFalse(default_storage.exists(suelta))
+        self.assertTrue(default_storage.exists(suelta_reciente))
+
+
+class ResumenSemanalTests(TestCase):
+    """
+    ResumenSemanal: upsert al cerrar la semana y reconstrucción en bloque.
+    """
+
+    def _semana(self, comercial, semana, km_inicio, km_fin):
+        return (
+            _lectura(comercial, LecturaCuentaKM.INICIO, semana, km=km_inicio),
+            _lectura(comercial, LecturaCuentaKM.FIN, semana, km=km_fin),
+        )
+
+    def test_upsert_y_borrado_del_fin(self):
+        comercial = Comercial.objects.create(nombre="Resumen")
+        inicio, fin = self._semana(comercial, 1, 1000, 1200)
+        semanas.registrar_semana(inicio, fin, 200)
+
+        # reprocesar el fin (p.ej. km corregidos) actualiza la misma fila
+        fin.kilometros = 1300
+        fin.fin_fuera_de_plazo = True
+        semanas.registrar_semana(inicio, fin, 300)
+        resumen = ResumenSemanal.objects.get(comercial=comercial)
+        self.assertEqual((resumen.km_fin, resumen.kms, resumen.fin_fuera_de_plazo), (1300, 300, True))
+        self.assertEqual(resumen.cerrada_at, fin.created_at)
+
+        # sin fin, la semana deja de estar cerrada
+        fin.delete()
+        self.assertFalse(ResumenSemanal.objects.exists())
+
+    def test_editar_la_lectura_recalcula_la_semana(self):
+        comercial = Comercial.objects.create(nombre="Resumen editado")
+        inicio, fin = self._semana(comercial, 1, 1000, 1200)
+        semanas.registrar_semana(inicio, fin, 200)
+
+        # corrección de km (revisión de OCR, o el admin con update_fields)
+        fin.kilometros = 1250
+        fin.save(update_fields=["kilometros"])
+        self.assertEqual(ResumenSemanal.objects.get(comercial=comercial, semana=1).kms, 250)
+
+        # el formulario del admin guarda entero; aquí mueve el fin a otra semana
+        fin = LecturaCuentaKM.objects.get(pk=fin.pk)
+        fin.semana = 2
+        fin.save()
+        resumenes = ResumenSemanal.objects.filter(comercial=comercial)
+        self.assertEqual(list(resumenes.values_list("semana", "km_inicio", "km_fin")), [(2, None, 1250)])
+
+    def test_reconstruccion_por_rango(self):
+        ana = Comercial.objects.create(nombre="Ana")
+        luis = Comercial.objects.create(nombre="Luis")
+        self._semana(ana, 1, 100, 150)
+        self._semana(ana, 2, 150, 400)
+        self._semana(luis, 2, 10, 20)
+        _lectura(luis, LecturaCuentaKM.INICIO, 3, km=20)
+        # fila obsoleta de la semana 2 y fila de la semana 1 que no debe tocarse
+        ResumenSemanal.objects.create(comercial=ana, anio=2026, semana=2, kms=999)
+        ResumenSemanal.objects.create(comercial=ana, anio=2026, semana=1, kms=-1)
+
+        salida = io.StringIO()
+        # 2026-01-05 es el lunes de la semana ISO 2
+        call_command("reconstruir_resumen_semanal", desde="2026-01-05", stdout=salida)
+
+        self.assertIn("2 semana(s)", salida.getvalue())
+        filas = ResumenSemanal.objects.order_by("semana", "comercial__nombre").values_list(
+            "comercial__nombre", "semana", "km_inicio", "km_fin", "kms"
+        )
+        self.assertEqual(
+            list(filas),
+            [("Ana", 1, None, None, -1), ("Ana", 2, 150, 400, 250), ("Luis", 2, 10, 20, 10)],
+        )
+
+        self.assertEqual(semanas.reconstruir(), 3)
+        self.assertEqual(ResumenSemanal.objects.get(comercial=ana, semana=1).kms, 50)
+
+
+class IndexSPATests(TestCase):
+    """
+    index.html de la SPA: precomprimido, con ETag y 304 si no ha cambiado.
+    """
+
+    HTML = b"<!doctype html><title>CuentaKM</title>" + b"<div id=app></div>" * 50
+
+    def setUp(self):
+        estaticos = tempfile.mkdtemp()
+        (Path(estaticos) / "dist").mkdir()
+        (Path(estaticos) / "dist" / "index.html").write_bytes(self.HTML)
+        ajustes = override_settings(DEBUG=False, STATIC_ROOT=estaticos)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        # el index se carga una vez por proceso
+        config_urls._index = None
+        self.addCleanup(setattr, config_urls, "_index", None)
+
+    def test_304_si_no_ha_cambiado(self):
+        primera = self.client.get("/")
+        self.assertEqual(primera.status_code, 200)
+        self.assertEqual(primera.content, self.HTML)
+        self.assertEqual(primera["Cache-Control"], "no-cache")
+
+        repetida = self.client.get("/", HTTP_IF_NONE_MATCH=primera["ETag"])
+        self.assertEqual(repetida.status_code, 304)
+        self.assertEqual(repetida.content, b"")
+        self.assertEqual(repetida["ETag"], primera["ETag"])
+
+        otra = self.client.get("/", HTTP_IF_NONE_MATCH='W/"otro"')
+        self.assertEqual(otra.status_code, 200)
+
+    def test_content_encoding_segun_accept_encoding(self):
+        respuesta = self.client.get("/", HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(respuesta["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(respuesta.content), self.HTML)
+        self.assertEqual(respuesta["Content-Length"], str(len(respuesta.content)))
+        self.assertIn("Accept-Encoding", respuesta["Vary"])
+
+        sin_gzip = self.client.get("/", HTTP_ACCEPT_ENCODING="gzip;q=0, identity")
+        self.assertFalse(sin_gzip.has_header("Content-Encoding"))
+        self.assertEqual(sin_gzip.content, self.HTML)
+
+    @unittest.skipIf(config_urls.brotli is None, "Brotli no instalado")
+    def test_brotli_antes_que_gzip(self):
+        respuesta = self.client.get("/", HTTP_ACCEPT_ENCODING="gzip, br")
+        self.assertEqual(respuesta["Content-Encoding"], "br")
+        self.assertEqual(config_urls.brotli.decompress(respuesta.content), self.HTML)
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    CUENTAKM_OCR_ASYNC=False,
+    CUENTAKM_OCR_CACHE="",
+    CUENTAKM_EMAIL_OUTBOX=False,
+    CUENTAKM_EMAIL_POR_LECTURA=True,
+    CUENTAKM_BORRADO_DIFERIDO=False,
+)
+class MiniaturasTests(TestCase):
+    """
+    Miniatura JPEG junto a la original: la usan los emails y el admin, y
+    sobrevive al cierre de la semana.
+    """
+
+    def _subir(self, comercial, tipo, km):
+        with mock.patch("lecturas.services.procesamiento.extraer_km_desde_imagen", return_value=km):
+            respuesta = self.client.post(
+                "/api/lecturas/",
+                {
+                    "comercial_id": comercial.id,
+                    "tipo_lectura": tipo,
+                    "imagen": SimpleUploadedFile("km.jpg", foto_cuentakm(km, tamano=(4000, 3000)), "image/jpeg"),
+                },
+            )
+        self.assertEqual(respuesta.status_code, 201, respuesta.content)
+        return LecturaCuentaKM.objects.get(comercial=comercial, tipo_lectura=tipo)
+
+    def test_miniatura_al_leer_los_km_y_en_el_email_de_cierre(self):
+        comercial = Comercial.objects.create(nombre="Miniaturas")
+        inicio = self._subir(comercial, LecturaCuentaKM.INICIO, 1000)
+
+        self.assertEqual(inicio.miniatura.name, nombre_miniatura(inicio.imagen.name))
+        self.assertLess(inicio.miniatura.size * 10, inicio.imagen.size)
+        with Image.open(inicio.miniatura.path) as img:
+            self.assertEqual(max(img.size), 480)
+
+        fin = self._subir(comercial, LecturaCuentaKM.FIN, 1250)
+
+        # al cerrar la semana se borran las originales, no las miniaturas
+        for lectura in (inicio, fin):
+            lectura.refresh_from_db()
+            self.assertFalse(lectura.imagen)
+            self.assertTrue(default_storage.exists(lectura.miniatura.name))
+        self.assertEqual(len(mail.outbox), 1)
+        adjuntos = mail.outbox[0].attachments
+        self.assertEqual(
+            sorted(nombre for nombre, _, _ in adjuntos),
+            sorted(Path(lectura.miniatura.name).name for lectura in (inicio, fin)),
+        )
+        self.assertTrue(all(len(contenido) < 100 * 1024 for _, contenido, _ in adjuntos))
+
+    def test_sin_miniatura_se_usa_la_original(self):
+        comercial = Comercial.objects.create(nombre="Sin miniatura")
+        lectura = _lectura(comercial, imagen="lecturas/original.jpg")
+        self.assertEqual(foto_para_adjuntar(lectura).name, "lecturas/original.jpg")
+        lectura.miniatura = "lecturas/original_min.jpg"
+        self.assertEqual(foto_para_adjuntar(lectura).name, "lecturas/original_min.jpg")
+        self.assertIsNone(foto_para_adjuntar(_lectura(comercial, LecturaCuentaKM.FIN)))
+
+    def test_comando_genera_las_que_faltan(self):
+        comercial = Comercial.objects.create(nombre="Miniaturas antiguas")
+        nombre = default_storage.save("lecturas/antigua.jpg", ContentFile(foto_cuentakm(4321, tamano=(2000, 1500))))
+        antigua = _lectura(comercial, km=4321, imagen=nombre)
+        _lectura(comercial, LecturaCuentaKM.FIN, km=4400, imagen="lecturas/no_existe.jpg")
+
+        salida = io.StringIO()
+        with self.assertLogs("lecturas.services.miniaturas", "ERROR"):
+            call_command("generar_miniaturas", stdout=salida)
+
+        self.assertEqual(salida.getvalue().strip(), "Generadas 1 miniatura(s), 1 fallida(s)")
+        antigua.refresh_from_db()
+        self.assertEqual(antigua.miniatura.name, "lecturas/antigua_min.jpg")
+        self.assertTrue(default_storage.exists(antigua.miniatura.name))
+
+    def test_vista_previa_en_el_admin(self):
+        comercial = Comercial.objects.create(nombre="Admin")
+        _lectura(comercial, km=1000, con_fotos=True)
+        _lectura(comercial, LecturaCuentaKM.FIN, km=1200)
+        self.client.force_login(
+            get_user_model().objects.create_superuser("admin", "admin@example.com", "x")
+        )
+
+        html = self.client.get("/admin/lecturas/lecturacuentakm/").content.decode()
+
+        self.assertIn(f'<img src="/media/lecturas/{comercial.pk}_{LecturaCuentaKM.INICIO}_1_min.jpg"', html)
+        self.assertNotIn(f"{comercial.pk}_{LecturaCuentaKM.INICIO}_1.jpg", html)
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    CUENTAKM_OCR_ASYNC=False,
+    CUENTAKM_OCR_CACHE="",
+    CUENTAKM_EMAIL_OUTBOX=False,
+    CUENTAKM_BORRADO_DIFERIDO=False,
+)
+class ResumenSemanalEmailTests(TestCase):
+    """
+    enviar_resumen_semanal: un solo email por semana para todos los comerciales.
+    """
+
+    def _con_foto(self, comercial, tipo, km, **campos):
+        nombre = default_storage.save("lecturas/km.jpg", ContentFile(_foto_jpeg()))
+        return _lectura(comercial, tipo, km=km, imagen=nombre, **campos)
+
+    def test_un_email_con_la_semana_de_todos(self):
+        ana = Comercial.objects.create(nombre="Ana")
+        luis = Comercial.objects.create(nombre="Luis")
+        Comercial.objects.create(nombre="Marta")
+        inicio = self._con_foto(ana, LecturaCuentaKM.INICIO, 1000)
+        fin = self._con_foto(ana, LecturaCuentaKM.FIN, 1250, fin_fuera_de_plazo=True)
+        abierta = self._con_foto(luis, LecturaCuentaKM.INICIO, 500)
+
+        salida = io.StringIO()
+        call_command("enviar_resumen_semanal", anio=2026, semana=1, stdout=salida)
+
+        self.assertEqual(len(mail.outbox), 1)
+        email = mail.outbox[0]
+        self.assertEqual(email.subject, "[Cuentakm] Resumen semana 1/2026")
+        lineas = email.body.splitlines()
+        self.assertIn("Ana: inicio 1000 km | fin 1250 km | realizados 250 km  [AVISO: fin_fuera_de_plazo]", lineas)
+        self.assertIn("Luis: inicio 500 km | fin - | realizados - km  [AVISO: semana sin cerrar]", lineas)
+        self.assertIn("Marta: inicio - | fin - | realizados - km  [AVISO: sin lecturas]", lineas)
+        self.assertEqual(lineas[-1], "Total equipo: 250 km")
+
+        # una sola hoja de contactos con las tres fotos, no tres adjuntos
+        [(nombre, contenido, mime)] = email.attachments
+        self.assertEqual((nombre, mime), ("cuentakm_semana_2026_01.jpg", "image/jpeg"))
+        with Image.open(io.BytesIO(contenido)) as hoja:
+            self.assertEqual(hoja.size, (3 * 240, 240 + 28))
+
+        # tras enviarlo se borran las fotos de las semanas cerradas
+        for lectura, conservada in ((inicio, False), (fin, False), (abierta, True)):
+            lectura.refresh_from_db()
+            self.assertEqual(bool(lectura.imagen), conservada)
+        self.assertIn("Borradas 2 foto(s)", salida.getvalue())
+
+    def test_fallo_de_envio_cuenta_y_no_borra(self):
+        metricas.reiniciar()
+        comercial = Comercial.objects.create(nombre="Resumen fallido")
+        inicio = self._con_foto(comercial, LecturaCuentaKM.INICIO, 1000)
+        self._con_foto(comercial, LecturaCuentaKM.FIN, 1100)
+
+        with mock.patch.object(mail.EmailMessage, "send", side_effect=OSError("SMTP caído")):
+            with self.assertRaises(OSError):
+                call_command("enviar_resumen_semanal", anio=2026, semana=1, stdout=io.StringIO())
+
+        self.assertEqual(metricas.valor("emails_fallidos"), 1)
+        inicio.refresh_from_db()
+        self.assertTrue(inicio.imagen)
+
+    @override_settings(CUENTAKM_EMAIL_POR_LECTURA=False)
+    def test_sin_emails_por_lectura(self):
+        comercial = Comercial.objects.create(nombre="Solo resumen")
+        for tipo, km in ((LecturaCuentaKM.INICIO, 1000), (LecturaCuentaKM.FIN, 1200)):
+            with mock.patch("lecturas.services.procesamiento.extraer_km_desde_imagen", return_value=km):
+                respuesta = self.client.post(
+                    "/api/lecturas/",
+                    {
+                        "comercial_id": comercial.id,
+                        "tipo_lectura": tipo,
+                        "imagen": SimpleUploadedFile("km.jpg", _foto_jpeg(), "image/jpeg"),
+                    },
+                )
+            self.assertEqual(respuesta.status_code, 201, respuesta.content)
+
+        self.assertEqual(mail.outbox, [])
+        # las fotos esperan al resumen, que las adjunta y luego las borra
+        self.assertEqual(LecturaCuentaKM.objects.filter(comercial=comercial).exclude(imagen="").count(), 2)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), CUENTAKM_OCR_BACKEND="fake")
+class ReprocesoTests(TestCase):
+    """
+    reprocesar_lecturas: revisiones en vez de cambios, punto de control por
+    bloques y reanudación con los mismos filtros.
+    """
+
+    def _con_foto(self, comercial, semana, km, km_foto, tipo=LecturaCuentaKM.INICIO):
+        # FakeBackend lee el km del nombre del fichero
+        nombre = default_storage.save(f"lecturas/c{comercial.pk}s{semana}_{km_foto}.jpg", ContentFile(b"jpeg"))
+        return _lectura(comercial, tipo, semana, km=km, imagen=nombre)
+
+    def _reprocesar(self, *args):
+        salida = io.StringIO()
+        call_command("reprocesar_lecturas", "--concurrencia", "1", "--max-por-minuto", "0", *args, stdout=salida)
+        return salida.getvalue()
+
+    def test_corte_del_ocr_y_reanudacion(self):
+        comercial = Comercial.objects.create(nombre="Reproceso")
+        lecturas = [
+            self._con_foto(comercial, semana, semana * 1000, km_foto)
+            for semana, km_foto in ((1, 1000), (2, 2500), (3, 3000), (4, 4000), (5, 5500))
+        ]
+        leer_real = FakeBackend.leer
+
+        def leer_con_corte(backend, ruta, perfil=None):
+            if ruta.endswith("_5500.jpg"):
+                raise ServicioNoDisponible("circuito abierto")
+            return leer_real(backend, ruta, perfil)
+
+        with mock.patch.object(FakeBackend, "leer", autospec=True, side_effect=leer_con_corte):
+            with self.assertRaises(CommandError):
+                self._reprocesar()
+
+        # el bloque de 4 (concurrencia x 4) se guardó; el que falló, no
+        punto = PuntoControlReproceso.objects.get(nombre="fake")
+        self.assertEqual((punto.ultimo_id, punto.procesadas, punto.diferencias), (lecturas[3].pk, 4, 1))
+
+        salida = self._reprocesar()
+        self.assertIn(f"1 lectura(s) pendiente(s), continuando tras la #{lecturas[3].pk}", salida)
+        revisiones = RevisionLectura.objects.order_by("lectura_id").values_list("lectura_id", "km_actual", "km_nuevo")
+        self.assertEqual(list(revisiones), [(lecturas[1].pk, 2000, 2500), (lecturas[4].pk, 5000, 5500)])
+        # las lecturas no se tocan hasta aplicar la revisión
+        self.assertEqual(LecturaCuentaKM.objects.get(pk=lecturas[4].pk).kilometros, 5000)
+
+        self.assertIn("0 lectura(s) pendiente(s)", self._reprocesar())
+
+    def test_el_punto_de_control_solo_vale_para_sus_filtros(self):
+        ana = Comercial.objects.create(nombre="Ana")
+        luis = Comercial.objects.create(nombre="Luis")
+        self._con_foto(luis, 1, 100, 150)
+        self._con_foto(ana, 1, 100, 100)
+
+        self._reprocesar("--comercial", str(ana.pk))
+        with self.assertRaises(CommandError):
+            self._reprocesar("--comercial", str(luis.pk))
+        self.assertFalse(RevisionLectura.objects.exists())
+
+        self._reprocesar("--comercial", str(luis.pk), "--reiniciar")
+        self.assertEqual(RevisionLectura.objects.get().km_nuevo, 150)
+        self.assertEqual(PuntoControlReproceso.objects.get().filtros, {"comercial_id": luis.pk})
+
+    def test_aplicar_revision(self):
+        comercial = Comercial.objects.create(nombre="Revisión aplicada")
+        inicio = _lectura(comercial, LecturaCuentaKM.INICIO, km=1000)
+        fin = _lectura(comercial, LecturaCuentaKM.FIN, km=1200)
+        semanas.registrar_semana(inicio, fin, 200)
+        revision = RevisionLectura.objects.create(lectura=fin, ejecucion="fake", km_actual=1200, km_nuevo=1300)
+
+        aplicar_revision(revision)
+
+        revision.refresh_from_db()
+        self.assertEqual(revision.estado, RevisionLectura.APLICADA)
+        self.assertEqual(LecturaCuentaKM.objects.get(pk=fin.pk).kilometros, 1300)
+        self.assertEqual(EstadoComercial.objects.get(comercial=comercial).ultimos_km, 1300)
+        self.assertEqual(ResumenSemanal.objects.get(comercial=comercial).kms, 300)
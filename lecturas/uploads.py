@@ -0,0 +1,67 @@
+from django.conf import settings
+from django.core.files.uploadhandler import StopUpload, TemporaryFileUploadHandler
+from django.http import QueryDict
+from django.utils.datastructures import MultiValueDict
+
+
+# holgura para el resto del formulario (comercial_id, tipo, boundaries...) sobre una foto
+MARGEN_FORMULARIO = 64 * 1024
+
+
+class LimiteTamanoUploadHandler(TemporaryFileUploadHandler):
+    """
+    Vuelca SIEMPRE las subidas a un fichero temporal (nunca las acumula en
+    memoria) y corta la subida en cuanto una foto supera CUENTAKM_UPLOAD_MAX_BYTES
+    o la petición entera su límite: el de una foto (más el formulario), salvo
+    que la vista haya fijado otro con limitar_subida() (lotes).
+    Al guardar en FileSystemStorage, Django mueve el temporal en vez de copiarlo.
+
+    Si la subida se rechaza, marca `request.cuentakm_subida_excedida` para que
+    la vista responda 413 en lugar de "Falta imagen".
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.limite_fichero = getattr(settings, "CUENTAKM_UPLOAD_MAX_BYTES", 15 * 1024 * 1024)
+        self.limite_total = max(
+            self.limite_fichero + MARGEN_FORMULARIO, getattr(request, "cuentakm_limite_subida", 0) or 0
+        )
+        self.recibidos_fichero = 0
+        self.recibidos_total = 0
+
+    def _rechazar(self):
+        if self.request is not None:
+            self.request.cuentakm_subida_excedida = True
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # Rechazo temprano por Content-Length: ni siquiera se lee el cuerpo
+        if content_length and content_length > self.limite_total:
+            self._rechazar()
+            return QueryDict(encoding=encoding), MultiValueDict()
+        return None
+
+    def new_file(self, *args, **kwargs):
+        self.recibidos_fichero = 0
+        return super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        # Por si el cliente no manda Content-Length fiable (chunked, etc.)
+        self.recibidos_fichero += len(raw_data)
+        self.recibidos_total += len(raw_data)
+        if self.recibidos_fichero > self.limite_fichero or self.recibidos_total > self.limite_total:
+            self._rechazar()
+            raise StopUpload(connection_reset=True)
+        return super().receive_data_chunk(raw_data, start)
+
+
+def limitar_subida(request, limite_total: int):
+    """
+    Límite de la petición entera para esta vista. Hay que llamarlo antes de
+    leer request.data/FILES (el handler se crea al leerlos).
+    """
+    # en las vistas de DRF el handler recibe la HttpRequest de Django
+    getattr(request, "_request", request).cuentakm_limite_subida = limite_total
+
+
+def subida_excedida(request) -> bool:
+    return getattr(request, "cuentakm_subida_excedida", False)
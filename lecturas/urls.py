@@ -1,8 +1,30 @@
+from django.conf import settings
 from django.urls import path
-from .views import ComercialesView, LecturasView, EstadoLecturasView
+from .views import (
+    ComercialesView,
+    EstadoLecturasAsyncView,
+    EstadoLecturasView,
+    ExportarView,
+    InformeSemanalView,
+    LecturasAsyncView,
+    LecturasLoteView,
+    LecturasView,
+    TrabajoOCRView,
+)
+
+# Con ASGI (uvicorn), las vistas async de subida y estado no ocupan un hilo
+# mientras esperan al OCR; con WSGI (gunicorn sync) se quedan las de DRF.
+if getattr(settings, "CUENTAKM_VISTAS_ASYNC", False):
+    VistaLecturas, VistaEstado = LecturasAsyncView, EstadoLecturasAsyncView
+else:
+    VistaLecturas, VistaEstado = LecturasView, EstadoLecturasView
 
 urlpatterns = [
     path("comerciales/", ComercialesView.as_view(), name="comerciales"),
-    path("lecturas/", LecturasView.as_view(), name="lecturas"),
-    path("lecturas/estado/", EstadoLecturasView.as_view(), name="lecturas_estado"),
+    path("lecturas/", VistaLecturas.as_view(), name="lecturas"),
+    path("lecturas/lote/", LecturasLoteView.as_view(), name="lecturas_lote"),
+    path("lecturas/estado/", VistaEstado.as_view(), name="lecturas_estado"),
+    path("lecturas/trabajos/<uuid:clave>/", TrabajoOCRView.as_view(), name="lecturas_trabajo"),
+    path("informes/semanal/", InformeSemanalView.as_view(), name="informe_semanal"),
+    path("exportar/<str:que>/", ExportarView.as_view(), name="exportar"),
 ]
@@ -1,23 +1,59 @@
-import os
+import hmac
+import json
 import logging
-from datetime import datetime, date
+from functools import partial
+
+from asgiref.sync import async_to_sync, sync_to_async
 
 from django.conf import settings
-from django.core.files.storage import default_storage
-from django.db.models import Q
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 
 from rest_framework.views import APIView
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.authentication import SessionAuthentication
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.response import Response
 from rest_framework import status
 
-from django.core.mail import EmailMessage
-
-from .models import Comercial, LecturaCuentaKM  # <-- ajusta si tu modelo se llama distinto
-from .services.openai_km import extraer_km_desde_imagen  # <-- tu función de OCR con OpenAI
+from .models import Comercial, TrabajoOCR
+from .services.cache_http import ambito_estado, arespuesta_condicional, respuesta_condicional, respuesta_json
+from .services.cola_ocr import encolar_lectura
+from .services.estado import aobtener_estado, obtener_estado
+from .services.exportacion import (
+    CABECERA_LECTURAS,
+    CABECERA_SEMANAL,
+    filas_lecturas,
+    filas_semanales,
+    respuesta_csv,
+)
+from .services.idempotencia import responder_idempotente
+from .services.informes import (
+    LIMITE_POR_DEFECTO,
+    ParametroInvalido,
+    decodificar_cursor,
+    lecturas_filtradas,
+    pagina_informe_semanal,
+)
+from .services import metricas
+from .services.lotes import procesar_lote
+from .services.outbox import mensajes_por_estado
+from .uploads import limitar_subida, subida_excedida
+from .services.procesamiento import (
+    LecturaDuplicada,
+    LecturaRechazada,
+    aprocesar_lectura,
+    crear_lectura,
+    iso_week_year,
+    procesar_lectura,
+    tipos_permitidos,
+)
 
 
 logger = logging.getLogger(__name__)
@@ -27,127 +63,14 @@ class CsrfExemptSessionAuthentication(SessionAuthentication):
         return
 
 
-# -------------------------
-# Helpers
-# -------------------------
-
-def iso_week_year(d: date):
-    iso = d.isocalendar()
-    return iso.week, iso.year
-
-
-def is_monday(d: date) -> bool:
-    return d.weekday() == 0  # Monday=0
-
-
-def is_friday(d: date) -> bool:
-    return d.weekday() == 4  # Friday=4
-
-
-def delete_image_field_file(instance, field_name: str):
+def ocr_asincrono_solicitado(request) -> bool:
     """
-    Borra físicamente el archivo asociado a un ImageField/FileField
-    y deja el campo vacío (sin borrar el registro).
+    Modo asíncrono (202 + trabajo en cola) si está activado en settings
+    o si el cliente lo pide con la cabecera `Prefer: respond-async`.
     """
-    f = getattr(instance, field_name, None)
-    if not f:
-        return
-    try:
-        if f.name and default_storage.exists(f.name):
-            default_storage.delete(f.name)
-    except Exception:
-        logger.exception("Error borrando archivo %s", f.name)
-    try:
-        setattr(instance, field_name, None)
-        instance.save(update_fields=[field_name])
-    except Exception:
-        logger.exception("Error limpiando campo %s del modelo", field_name)
-
-
-def enviar_email_admin_fin_semana(comercial, lectura_inicio, lectura_fin, kms_semana, warning=None):
-    """
-    Envía email a admin con:
-    - medición inicio y fin
-    - diferencia
-    - warning (si aplica)
-    - adjunta las 2 fotos (si existen)
-    """
-    subject = f"[Cuentakm] {comercial.nombre} – Semana {lectura_fin.semana}/{lectura_fin.anio}"
-    lines = [
-        f"Comercial: {comercial.nombre}",
-        f"Semana: {lectura_fin.semana}/{lectura_fin.anio}",
-        "",
-        f"Inicio de semana: {lectura_inicio.kilometros} km  ({lectura_inicio.created_at})",
-        f"Fin de semana:    {lectura_fin.kilometros} km  ({lectura_fin.created_at})",
-        "",
-        f"Kilómetros realizados: {kms_semana} km",
-    ]
-    if warning:
-        lines += ["", f"AVISO: {warning}"]
-
-    body = "\n".join(lines)
-
-    to_email = ["ivallejo@tipsitpv.com"]
-    from_email = getattr(settings, "DEFAULT_FROM_EMAIL", None) or getattr(settings, "EMAIL_HOST_USER", None)
-
-    email = EmailMessage(
-        subject=subject,
-        body=body,
-        from_email=from_email,
-        to=to_email,
-    )
-
-    # Adjuntar fotos
-    # IMPORTANTE: EmailMessage.attach_file necesita ruta absoluta en disco, no el "name" relativo.
-    # Si usas default_storage local, esto funciona con .path.
-    for lectura, label in [(lectura_inicio, "inicio"), (lectura_fin, "fin")]:
-        try:
-            if lectura.imagen and lectura.imagen.name:
-                # Para storage local:
-                file_path = lectura.imagen.path
-                email.attach_file(file_path)
-        except Exception:
-            logger.exception("No se pudo adjuntar foto %s", label)
-
-    email.send(fail_silently=False)
-    logger.info("[EMAIL] Enviado resumen fin de semana a Administración")
-
-
-def enviar_email_admin_mismatch_lunes(comercial, lectura_fin_anterior, lectura_inicio_nueva, warning):
-    """
-    Email específico cuando el lunes (inicio nueva semana) NO cuadra con el fin anterior.
-    Adjunta foto fin anterior y foto inicio nueva (si existen).
-    """
-    subject = f"[Cuentakm][AVISO] Posible uso fin de semana – {comercial.nombre}"
-    lines = [
-        f"Comercial: {comercial.nombre}",
-        "",
-        f"Fin semana anterior: {lectura_fin_anterior.kilometros} km  ({lectura_fin_anterior.created_at})",
-        f"Inicio semana nueva: {lectura_inicio_nueva.kilometros} km  ({lectura_inicio_nueva.created_at})",
-        "",
-        f"AVISO: {warning}",
-    ]
-    body = "\n".join(lines)
-
-    to_email = ["ivallejo@tipsitpv.com"]
-    from_email = getattr(settings, "DEFAULT_FROM_EMAIL", None) or getattr(settings, "EMAIL_HOST_USER", None)
-
-    email = EmailMessage(
-        subject=subject,
-        body=body,
-        from_email=from_email,
-        to=to_email,
-    )
-
-    for lectura, label in [(lectura_fin_anterior, "fin_anterior"), (lectura_inicio_nueva, "inicio_nueva")]:
-        try:
-            if lectura.imagen and lectura.imagen.name:
-                email.attach_file(lectura.imagen.path)
-        except Exception:
-            logger.exception("No se pudo adjuntar foto %s", label)
-
-    email.send(fail_silently=False)
-    logger.info("[EMAIL] Enviado aviso mismatch lunes a Administración")
+    if getattr(settings, "CUENTAKM_OCR_ASYNC", False):
+        return True
+    return "respond-async" in request.headers.get("Prefer", "")
 
 
 # -------------------------
@@ -159,9 +82,13 @@ class ComercialesView(APIView):
     permission_classes = [AllowAny]
     parser_classes = [MultiPartParser, FormParser, JSONParser]
     def get(self, request):
+        return respuesta_condicional(request, "comerciales", self._construir)
+
+    @staticmethod
+    def _construir():
         qs = Comercial.objects.all().order_by("nombre")
         data = [{"id": c.id, "nombre": c.nombre} for c in qs]
-        return Response(data, status=status.HTTP_200_OK)
+        return data, status.HTTP_200_OK
 
 
 class EstadoLecturasView(APIView):
@@ -181,28 +108,34 @@ class EstadoLecturasView(APIView):
         if not comercial_id:
             return Response({"error": "Falta comercial_id"}, status=status.HTTP_400_BAD_REQUEST)
 
+        hoy = timezone.localdate()
+        if not comercial_id.isdigit():
+            data, codigo = self._construir(comercial_id, hoy)
+            return Response(data, status=codigo)
+
+        # semana_actual depende del día: la fecha forma parte del ETag
+        return respuesta_condicional(
+            request,
+            ambito_estado(int(comercial_id)),
+            lambda: self._construir(comercial_id, hoy),
+            variante=hoy.isoformat(),
+        )
+
+    @classmethod
+    def _construir(cls, comercial_id, hoy):
         try:
-            comercial = Comercial.objects.get(id=comercial_id)
+            estado = obtener_estado(comercial_id)
         except Comercial.DoesNotExist:
-            return Response({"error": "Comercial no encontrado"}, status=status.HTTP_404_NOT_FOUND)
+            return {"error": "Comercial no encontrado"}, status.HTTP_404_NOT_FOUND
+        return cls.datos(estado, hoy)
 
-        hoy = timezone.localdate()
-        semana_actual, anio_actual = iso_week_year(hoy)
+    @staticmethod
+    def datos(estado, hoy):
+        comercial = estado.comercial
 
-        last = (
-            LecturaCuentaKM.objects
-            .filter(comercial=comercial)
-            .order_by("-created_at")
-            .first()
-        )
+        semana_actual, anio_actual = iso_week_year(hoy)
 
-        if not last:
-            allowed = ["inicio_semana"]
-        else:
-            if last.tipo_lectura == "inicio_semana":
-                allowed = ["fin_semana"]
-            else:
-                allowed = ["inicio_semana"]
+        allowed, last = tipos_permitidos(estado)
 
         last_data = None
         if last:
@@ -215,7 +148,7 @@ class EstadoLecturasView(APIView):
                 "created_at": last.created_at,
             }
 
-        return Response(
+        return (
             {
                 "comercial": {"id": comercial.id, "nombre": comercial.nombre},
                 "semana_actual": semana_actual,
@@ -223,7 +156,7 @@ class EstadoLecturasView(APIView):
                 "allowed_types": allowed,
                 "last": last_data,
             },
-            status=status.HTTP_200_OK
+            status.HTTP_200_OK,
         )
 
 
@@ -233,182 +166,347 @@ class LecturasView(APIView):
     parser_classes = [MultiPartParser, FormParser, JSONParser]
     
     def post(self, request):
+        # reintentos del móvil: misma clave => misma respuesta, sin repetir el OCR
+        clave = request.headers.get("Idempotency-Key")
+        if clave:
+            return responder_idempotente(request, clave, lambda: self._procesar(request))
+        return self._procesar(request)
+
+    def _procesar(self, request):
         comercial_id = request.data.get("comercial_id")
         tipo_lectura = request.data.get("tipo_lectura")  # el front lo manda, pero lo validamos contra allowed
         imagen = request.FILES.get("imagen")
 
-        if not comercial_id:
-            return Response({"error": "Falta comercial_id"}, status=status.HTTP_400_BAD_REQUEST)
-        if not imagen:
-            return Response({"error": "Falta imagen"}, status=status.HTTP_400_BAD_REQUEST)
+        error = _validar_subida(request, comercial_id, imagen)
+        if error:
+            return Response(*error)
 
+        # 1) Validamos y guardamos registro (con imagen) para poder adjuntarla luego si hace falta.
+        # Con el estado del comercial bloqueado: dos subidas a la vez no pasan las dos.
         try:
-            comercial = Comercial.objects.get(id=comercial_id)
-        except Comercial.DoesNotExist:
-            return Response({"error": "Comercial no encontrado"}, status=status.HTTP_404_NOT_FOUND)
+            lectura = crear_lectura(comercial_id, tipo_lectura, imagen)
+        except (Comercial.DoesNotExist, LecturaRechazada) as e:
+            return Response(*_error_alta(e))
+
+        # Modo asíncrono: el OCR, las reglas y los emails los hace el worker
+        if ocr_asincrono_solicitado(request):
+            return Response(*_respuesta_encolada(request, encolar_lectura(lectura)))
+
+        # 2) Extraer km con OpenAI y 3) reglas inicio/fin de semana, emails y borrado de fotos
+        data, codigo, cabeceras = _respuesta_procesada(request, *procesar_lectura(lectura))
+        return Response(data, status=codigo, headers=cabeceras)
 
-        hoy = timezone.localdate()
-        semana_actual, anio_actual = iso_week_year(hoy)
 
-        last = (
-            LecturaCuentaKM.objects
-            .filter(comercial=comercial)
-            .order_by("-created_at")
-            .first()
+# Partes comunes de LecturasView y LecturasAsyncView: devuelven (data, status[, headers])
+
+def _validar_subida(request, comercial_id, imagen):
+    # el upload handler corta las subidas demasiado grandes sin llegar a leerlas
+    if subida_excedida(request):
+        limite_mb = settings.CUENTAKM_UPLOAD_MAX_BYTES // (1024 * 1024)
+        return (
+            {"error": f"La foto supera el tamaño máximo permitido ({limite_mb} MB)"},
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
         )
+    if not comercial_id:
+        return {"error": "Falta comercial_id"}, status.HTTP_400_BAD_REQUEST
+    if not imagen:
+        return {"error": "Falta imagen"}, status.HTTP_400_BAD_REQUEST
+    return None
+
+
+def _error_alta(e):
+    if isinstance(e, Comercial.DoesNotExist):
+        return {"error": "Comercial no encontrado"}, status.HTTP_404_NOT_FOUND
+    if isinstance(e, LecturaDuplicada):
+        return {"error": str(e)}, status.HTTP_409_CONFLICT
+    return {"error": str(e)}, status.HTTP_400_BAD_REQUEST
+
+
+def _respuesta_encolada(request, trabajo):
+    return (
+        {
+            "job_id": str(trabajo.clave),
+            "estado": trabajo.estado,
+            "status_url": request.build_absolute_uri(reverse("lecturas_trabajo", args=[trabajo.clave])),
+        },
+        status.HTTP_202_ACCEPTED,
+    )
 
-        # Regla de allowed types (misma que EstadoLecturasView)
-        if not last:
-            allowed = ["inicio_semana"]
-        else:
-            allowed = ["fin_semana"] if last.tipo_lectura == "inicio_semana" else ["inicio_semana"]
 
-        if tipo_lectura not in allowed:
-            return Response(
-                {"error": f"Tipo de lectura no permitido ahora. Permitidos: {allowed}"},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
+def _respuesta_procesada(request, codigo, data):
+    cabeceras = None
+    if codigo == status.HTTP_202_ACCEPTED:
+        # OCR no disponible: la lectura ha quedado en la cola
+        data["status_url"] = request.build_absolute_uri(reverse("lecturas_trabajo", args=[data["job_id"]]))
+    if codigo == status.HTTP_503_SERVICE_UNAVAILABLE:
+        cabeceras = {"Retry-After": "60"}
+    return data, codigo, cabeceras
+
+
+# -------------------------
+# Vistas async (ASGI)
+# -------------------------
+# Las mismas respuestas que LecturasView / EstadoLecturasView, pero sin
+# ocupar un hilo mientras se espera al OCR: con uvicorn un worker atiende
+# cientos de subidas en vuelo. DRF no tiene vistas async, así que son vistas
+# de Django puras. Se activan con CUENTAKM_VISTAS_ASYNC (ver urls.py).
+
+class EstadoLecturasAsyncView(View):
+    async def get(self, request):
+        comercial_id = request.GET.get("comercial_id")
+        if not comercial_id:
+            return respuesta_json({"error": "Falta comercial_id"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # 1) Guardamos registro (con imagen) para poder adjuntarla luego si hace falta
-        lectura = LecturaCuentaKM.objects.create(
-            comercial=comercial,
-            tipo_lectura=tipo_lectura,
-            semana=semana_actual,
-            anio=anio_actual,
-            imagen=imagen,
+        hoy = timezone.localdate()
+        if not comercial_id.isdigit():
+            data, codigo = await self._construir(comercial_id, hoy)
+            return respuesta_json(data, status=codigo)
+
+        return await arespuesta_condicional(
+            request,
+            ambito_estado(int(comercial_id)),
+            lambda: self._construir(comercial_id, hoy),
+            variante=hoy.isoformat(),
         )
 
-        # 2) Extraer km con OpenAI
+    @staticmethod
+    async def _construir(comercial_id, hoy):
         try:
-            lectura.kilometros = extraer_km_desde_imagen(lectura.imagen.path)
-            lectura.save(update_fields=["kilometros"])
-        except Exception as e:
-            logger.exception("Error leyendo km con OpenAI")
-            # si falla, borramos la foto que acabamos de subir para no acumular basura
-            delete_image_field_file(lectura, "imagen")
-            lectura.delete()
-            return Response({"error": f"Error leyendo kilómetros: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-        warning = None
-        kms_semana = None
-
-        # -------------------------
-        # CASO A: inicio_semana
-        # -------------------------
-        if tipo_lectura == "inicio_semana":
-            # Si existe un fin_semana anterior, y esto NO es la primera vez:
-            lectura_fin_anterior = (
-                LecturaCuentaKM.objects
-                .filter(comercial=comercial, tipo_lectura="fin_semana")
-                .order_by("-created_at")
-                .first()
-            )
+            estado = await aobtener_estado(comercial_id)
+        except Comercial.DoesNotExist:
+            return {"error": "Comercial no encontrado"}, status.HTTP_404_NOT_FOUND
+        return EstadoLecturasView.datos(estado, hoy)
 
-            # Regla: si hay cierre anterior, el inicio nuevo debería ser IGUAL al fin anterior.
-            if lectura_fin_anterior:
-                if lectura.kilometros != lectura_fin_anterior.kilometros:
-                    warning = (
-                        "La lectura del lunes (inicio de semana) no coincide con el fin de semana anterior. "
-                        "Se avisará a Administración."
-                    )
-                    try:
-                        enviar_email_admin_mismatch_lunes(
-                            comercial=comercial,
-                            lectura_fin_anterior=lectura_fin_anterior,
-                            lectura_inicio_nueva=lectura,
-                            warning=warning
-                        )
-                    except Exception:
-                        logger.exception("[EMAIL] Error enviando aviso mismatch lunes")
-
-            # Nota: NO borramos la foto de inicio, porque la necesitamos para el email del fin de semana.
-            return Response(
-                {
-                    "comercial": comercial.nombre,
-                    "tipo_lectura": tipo_lectura,
-                    "kilometros": lectura.kilometros,
-                    "semana": lectura.semana,
-                    "anio": lectura.anio,
-                    "kms_semana": kms_semana,
-                    "warning": warning,
-                },
-                status=status.HTTP_201_CREATED,
-            )
 
-        # -------------------------
-        # CASO B: fin_semana
-        # -------------------------
-        # Debe existir inicio_semana (para poder calcular)
-        lectura_inicio = (
-            LecturaCuentaKM.objects
-            .filter(
-                comercial=comercial,
-                tipo_lectura="inicio_semana",
-                semana=semana_actual,
-                anio=anio_actual,
-            )
-            .order_by("-created_at")
-            .first()
-        )
+@method_decorator(csrf_exempt, name="dispatch")
+class LecturasAsyncView(View):
+    """
+    Los emails van siempre a la outbox (`manage.py enviar_emails`): no hay
+    SMTP en la petición. Con CUENTAKM_BORRADO_DIFERIDO tampoco se borran
+    fotos del disco.
+    """
 
-        if not lectura_inicio:
-            # no podemos calcular; borramos esta foto (fin) para no acumular
-            delete_image_field_file(lectura, "imagen")
-            lectura.delete()
-            return Response(
-                {
-                    "error": "No tenemos la lectura de inicio de semana para esta semana. "
-                             "No podemos calcular los km."
-                },
-                status=status.HTTP_400_BAD_REQUEST,
+    async def post(self, request):
+        # el multipart (a fichero temporal, con el límite de tamaño) se lee en un hilo
+        await sync_to_async(lambda: request.FILES)()
+
+        clave = request.headers.get("Idempotency-Key")
+        if clave:
+            # el registro de la clave es síncrono: se hace en el hilo de esta petición
+            return await sync_to_async(responder_idempotente)(
+                request, clave, async_to_sync(partial(self._procesar, request)), responder=respuesta_json
             )
+        return await self._procesar(request)
 
-        kms_semana = lectura.kilometros - lectura_inicio.kilometros
-        if kms_semana < 0:
-            warning = "Los kilómetros de fin de semana son menores que los de inicio. Revisar posible error de lectura."
+    async def _procesar(self, request):
+        comercial_id = request.POST.get("comercial_id")
+        tipo_lectura = request.POST.get("tipo_lectura")
+        imagen = request.FILES.get("imagen")
+
+        error = _validar_subida(request, comercial_id, imagen)
+        if error:
+            return respuesta_json(*error)
 
-        # Warning por “fin fuera de plazo” (si no se hace en viernes)
-        if not is_friday(hoy):
-            warning_extra = (
-                "La lectura de fin de semana se ha subido fuera de plazo (no es viernes). "
-                "Se notificará a Administración."
-            )
-            warning = f"{warning} | {warning_extra}" if warning else warning_extra
-            try:
-                lectura.fin_fuera_de_plazo = True
-                lectura.save(update_fields=["fin_fuera_de_plazo"])
-            except Exception:
-                pass
-
-        # Email a admin SIEMPRE en fin de semana (como pediste), con las dos fotos
         try:
-            enviar_email_admin_fin_semana(
-                comercial=comercial,
-                lectura_inicio=lectura_inicio,
-                lectura_fin=lectura,
-                kms_semana=kms_semana,
-                warning=warning,
+            lectura = await sync_to_async(crear_lectura)(comercial_id, tipo_lectura, imagen)
+        except (Comercial.DoesNotExist, LecturaRechazada) as e:
+            return respuesta_json(*_error_alta(e))
+
+        if ocr_asincrono_solicitado(request):
+            trabajo = await sync_to_async(encolar_lectura)(lectura)
+            return respuesta_json(*_respuesta_encolada(request, trabajo))
+
+        data, codigo, cabeceras = _respuesta_procesada(request, *(await aprocesar_lectura(lectura)))
+        return respuesta_json(data, status=codigo, headers=cabeceras)
+
+
+class LecturasLoteView(APIView):
+    """
+    Varias lecturas en una sola petición multipart (fotos recogidas por la oficina).
+    Campo `items` (JSON): [{"comercial_id": 1, "tipo_lectura": "inicio_semana", "imagen": "foto1"}, ...]
+    donde "imagen" es el nombre del campo de fichero con la foto de ese elemento.
+    Responde 200 con el resultado de cada elemento (status, resultado/error) en el mismo orden.
+    """
+    authentication_classes = [CsrfExemptSessionAuthentication]
+    permission_classes = [AllowAny]
+    parser_classes = [MultiPartParser, FormParser]
+
+    def post(self, request):
+        # el lote entero puede superar el límite de una foto (el de cada foto sigue valiendo)
+        limitar_subida(request, settings.CUENTAKM_UPLOAD_LOTE_MAX_BYTES)
+        datos = request.data
+        if subida_excedida(request):
+            limite_mb = settings.CUENTAKM_UPLOAD_MAX_BYTES // (1024 * 1024)
+            limite_lote_mb = settings.CUENTAKM_UPLOAD_LOTE_MAX_BYTES // (1024 * 1024)
+            return Response(
+                {"error": f"Alguna foto supera {limite_mb} MB o el lote supera {limite_lote_mb} MB"},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
             )
-        except Exception:
-            logger.exception("[EMAIL] Error enviando email fin de semana")
 
-        # ✅ BORRADO DE FOTOS: tras fin de semana, borramos foto de inicio y foto de fin
-        # (así no peta media/)
         try:
-            delete_image_field_file(lectura_inicio, "imagen")
-            delete_image_field_file(lectura, "imagen")
-        except Exception:
-            logger.exception("Error borrando fotos tras fin de semana")
+            items = json.loads(datos.get("items") or "")
+        except ValueError:
+            items = None
+        if not isinstance(items, list) or not items:
+            return Response({"error": "Falta items (lista JSON de lecturas)"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.CUENTAKM_LOTE_MAX_ITEMS:
+            return Response(
+                {"error": f"Máximo {settings.CUENTAKM_LOTE_MAX_ITEMS} lecturas por lote"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
+        elementos = [self._elemento(request, item) for item in items]
+        resultados = procesar_lote(elementos, asincrono=ocr_asincrono_solicitado(request))
+        return Response({"resultados": resultados}, status=status.HTTP_200_OK)
+
+    @staticmethod
+    def _elemento(request, item):
+        if not isinstance(item, dict):
+            return {"error": "Elemento no válido"}
+        elemento = {
+            "comercial_id": item.get("comercial_id"),
+            "tipo_lectura": item.get("tipo_lectura"),
+            "imagen": request.FILES.get(str(item.get("imagen"))),
+        }
+        if not elemento["comercial_id"]:
+            elemento["error"] = "Falta comercial_id"
+        elif not elemento["imagen"]:
+            elemento["error"] = "Falta imagen"
+        return elemento
+
+
+class TrabajoOCRView(APIView):
+    """
+    Estado de un trabajo de OCR encolado por LecturasView en modo asíncrono.
+    Cuando termina, `resultado` contiene lo mismo que devolvería el POST síncrono
+    y `http_status` el código que habría tenido.
+    Se busca por la clave aleatoria que recibió quien subió la foto, no por el
+    pk: sin ella no se ven los trabajos (ni los km) de otros comerciales.
+    """
+    authentication_classes = [CsrfExemptSessionAuthentication]
+    permission_classes = [AllowAny]
+
+    def get(self, request, clave):
+        trabajo = get_object_or_404(TrabajoOCR, clave=clave)
         return Response(
             {
-                "comercial": comercial.nombre,
-                "tipo_lectura": tipo_lectura,
-                "kilometros": lectura.kilometros,
-                "semana": lectura.semana,
-                "anio": lectura.anio,
-                "kms_semana": kms_semana,
-                "warning": warning,
+                "job_id": str(trabajo.clave),
+                "estado": trabajo.estado,
+                "lectura_id": trabajo.lectura_id,
+                "intentos": trabajo.intentos,
+                "http_status": trabajo.http_status,
+                "resultado": trabajo.resultado,
+                "error": trabajo.error or None,
+                "created_at": trabajo.created_at,
+                "updated_at": trabajo.updated_at,
             },
-            status=status.HTTP_201_CREATED,
+            status=status.HTTP_200_OK,
+        )
+
+
+class InformeSemanalView(APIView):
+    """
+    Km por comercial y semana ISO, emparejando inicio y fin en la BD.
+    Filtros: ?desde=AAAA-MM-DD&hasta=AAAA-MM-DD&comercial_id=N
+    Paginación por clave: ?limite=N&cursor=<siguiente de la página anterior>
+    Solo para staff (sesión del admin): son los km de todos los comerciales.
+    """
+    authentication_classes = [SessionAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        params = request.query_params
+        try:
+            filtros = self.filtros(params)
+            filtros["cursor"] = decodificar_cursor(params["cursor"]) if params.get("cursor") else None
+            limite = self._entero(params, "limite") or LIMITE_POR_DEFECTO
+        except ParametroInvalido as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        filas, siguiente = pagina_informe_semanal(limite=limite, **filtros)
+
+        siguiente_url = None
+        if siguiente:
+            query = params.copy()
+            query["cursor"] = siguiente
+            siguiente_url = request.build_absolute_uri(f"{request.path}?{query.urlencode()}")
+
+        return Response(
+            {"resultados": filas, "siguiente": siguiente, "siguiente_url": siguiente_url},
+            status=status.HTTP_200_OK,
+        )
+
+    @classmethod
+    def filtros(cls, params):
+        return {
+            "desde": cls._fecha(params, "desde"),
+            "hasta": cls._fecha(params, "hasta"),
+            "comercial_id": cls._entero(params, "comercial_id"),
+        }
+
+    @staticmethod
+    def _fecha(params, nombre):
+        valor = params.get(nombre)
+        if not valor:
+            return None
+        try:
+            fecha = parse_date(valor)
+        except ValueError:
+            fecha = None
+        if fecha is None:
+            raise ParametroInvalido(f"{nombre} debe ser una fecha AAAA-MM-DD")
+        return fecha
+
+    @staticmethod
+    def _entero(params, nombre):
+        valor = params.get(nombre)
+        if not valor:
+            return None
+        if not valor.isdigit():
+            raise ParametroInvalido(f"{nombre} debe ser un número")
+        return int(valor)
+
+
+class ExportarView(APIView):
+    """
+    Exportación completa en CSV (streaming), con los mismos filtros que el informe:
+    /api/exportar/lecturas/ o /api/exportar/semanal/ ?desde=&hasta=&comercial_id=
+    Solo para staff, como el informe.
+    """
+    authentication_classes = [SessionAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, que):
+        try:
+            filtros = InformeSemanalView.filtros(request.query_params)
+        except ParametroInvalido as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if que == "semanal":
+            return respuesta_csv("km_semanales.csv", CABECERA_SEMANAL, filas_semanales(**filtros))
+
+        # lecturas: se filtra por semana ISO igual que el informe
+        qs = lecturas_filtradas(**filtros)
+        return respuesta_csv("lecturas.csv", CABECERA_LECTURAS, filas_lecturas(qs))
+
+
+class MetricasView(View):
+    """
+    GET /metrics: contadores e histogramas del proceso en formato Prometheus
+    (latencia por ruta y por etapa, OCR, caché, normalización, emails, SQL),
+    más los mensajes de la outbox por estado, leídos de la BD.
+    Con CUENTAKM_METRICAS_TOKEN hay que mandar "Authorization: Bearer <token>";
+    sin token solo responde en DEBUG.
+    """
+
+    def get(self, request):
+        token = getattr(settings, "CUENTAKM_METRICAS_TOKEN", "")
+        if not token:
+            if not settings.DEBUG:
+                return HttpResponse(status=404)
+        elif not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+            return HttpResponse(status=401)
+        medidores = [("emails_outbox", {"estado": e}, n) for e, n in mensajes_por_estado().items()]
+        return HttpResponse(
+            metricas.exportar_prometheus(medidores), content_type=metricas.CONTENT_TYPE_PROMETHEUS
         )